@@ -1,12 +1,13 @@
+from app.utils.model_clients import chat_model, embedding_model
+from app.utils.semantic_cache import SemanticCache, SemanticCacheRunnable
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_ollama import ChatOllama
 
+# Optional semantic answer cache replaying answers to near-identical conversations
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_EMBEDDING_MODEL = "nomic-embed-text"
 
-llm = ChatOllama(
-    model="llama3-groq-tool-use:latest",
-    temperature=0,
-    max_tokens=512
-)
+
+llm = chat_model("llama3-groq-tool-use:latest", temperature=0, max_tokens=512)
 
 template = ChatPromptTemplate.from_messages(
     [
@@ -24,3 +25,8 @@ template = ChatPromptTemplate.from_messages(
 )
 
 chain = template | llm
+
+if SEMANTIC_CACHE_ENABLED:
+    chain = SemanticCacheRunnable(
+        chain, SemanticCache(embedding_model(SEMANTIC_CACHE_EMBEDDING_MODEL))
+    )
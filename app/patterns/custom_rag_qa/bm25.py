@@ -0,0 +1,169 @@
+"""In-process BM25 inverted index over the chunks of a vector store.
+
+The index only stores term frequencies keyed by document id: the documents
+themselves are resolved through the vector store (`get_by_ids`), so texts are not
+duplicated. It is persisted next to the vector store and kept in sync with it by
+`sync()`, which only tokenizes the documents added since the last call. Searches
+and updates are serialized by a lock, so the index can be synced while other
+threads search it.
+"""
+from collections import Counter
+import heapq
+import json
+import math
+import re
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore, replace_file
+
+# Words, optionally joined by "-", "_", "." or "/" as in error codes, versions,
+# file names and product names (e.g. "ERR-404", "tf.keras", "model_v2")
+_TOKEN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+_PART = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in into is "
+    "it its of on or so such than that the their then there these they this to was "
+    "we what when where which while who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms of a text without stopwords. Compound terms are also split."""
+    terms = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        parts = _PART.findall(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part not in STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 inverted index mapping terms to document ids."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        """
+        Initialize an empty index.
+
+        Args:
+            k1 (float): Term frequency saturation.
+            b (float): Strength of the document length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._doc_terms: Dict[str, Dict[str, int]] = {}
+        self._doc_lengths: Dict[str, int] = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        """Number of indexed documents."""
+        with self._lock:
+            return len(self._doc_terms)
+
+    @property
+    def ids(self) -> Set[str]:
+        """Ids of the indexed documents."""
+        with self._lock:
+            return set(self._doc_terms)
+
+    def add(self, ids: Iterable[str], texts: Iterable[str]) -> None:
+        """Index texts under the given ids, replacing documents already indexed."""
+        terms = [(id_, dict(Counter(tokenize(text)))) for id_, text in zip(ids, texts)]
+        with self._lock:
+            for id_, document_terms in terms:
+                self._add_terms(id_, document_terms)
+
+    def _add_terms(self, id_: str, terms: Dict[str, int]) -> None:
+        if id_ in self._doc_terms:
+            self.delete([id_])
+        self._doc_terms[id_] = terms
+        length = sum(terms.values())
+        self._doc_lengths[id_] = length
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings.setdefault(term, {})[id_] = frequency
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Remove documents from the index."""
+        with self._lock:
+            for id_ in ids:
+                terms = self._doc_terms.pop(id_, None)
+                if terms is None:
+                    continue
+                self._total_length -= self._doc_lengths.pop(id_)
+                for term in terms:
+                    posting = self._postings[term]
+                    del posting[id_]
+                    if not posting:
+                        del self._postings[term]
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """Return up to k (document id, BM25 score) pairs, best first."""
+        query_terms = set(tokenize(query))
+        with self._lock:
+            if not self._doc_terms:
+                return []
+            n_docs = len(self._doc_terms)
+            average_length = self._total_length / n_docs
+            scores: Dict[str, float] = {}
+            for term in query_terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(
+                    1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5)
+                )
+                for id_, frequency in posting.items():
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self._doc_lengths[id_] / average_length
+                    )
+                    scores[id_] = scores.get(id_, 0.0) + idf * frequency * (
+                        self.k1 + 1
+                    ) / (frequency + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def sync(self, vector_store: NumpyVectorStore) -> bool:
+        """
+        Add the documents of the store missing from the index and remove the ones
+        deleted from the store.
+
+        Returns:
+            bool: Whether the index changed.
+        """
+        store_ids = vector_store.ids
+        indexed_ids = self.ids
+        stale = indexed_ids - set(store_ids)
+        missing = [id_ for id_ in store_ids if id_ not in indexed_ids]
+        documents = vector_store.get_by_ids(missing)
+        # Tokenize outside the lock so that searches only wait for the update itself
+        terms = [
+            (doc.id, dict(Counter(tokenize(doc.page_content)))) for doc in documents
+        ]
+        with self._lock:
+            self.delete(stale)
+            for id_, document_terms in terms:
+                self._add_terms(id_, document_terms)
+        return bool(stale or missing)
+
+    def save(self, path: str) -> None:
+        """Atomically write the index to a JSON file."""
+        with self._lock:
+            data = json.dumps(
+                {"k1": self.k1, "b": self.b, "documents": self._doc_terms}
+            )
+        replace_file(path, lambda f: f.write(data.encode("utf-8")))
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Load an index written by `save`."""
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(k1=data["k1"], b=data["b"])
+        for id_, terms in data["documents"].items():
+            index._add_terms(id_, terms)
+        return index
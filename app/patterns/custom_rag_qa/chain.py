@@ -1,21 +1,52 @@
 # mypy: disable-error-code="arg-type,attr-defined"
 # pylint: disable=W0613, W0622
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import logging
-from typing import Any, AsyncIterator, Dict, List
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 
+from app.patterns.custom_rag_qa.hybrid_retriever import (
+    HybridRetriever,
+    resolve_retrieval_mode,
+)
+from app.patterns.custom_rag_qa.ingestion import EMBEDDING_MAX_CONCURRENCY
+from app.patterns.custom_rag_qa.references import (
+    reference_artifact,
+    referenced_ids,
+    resolve_references,
+)
+from app.patterns.custom_rag_qa.router import (
+    DecisionLog,
+    get_router,
+    last_user_message,
+    route,
+)
+from app.patterns.custom_rag_qa.speculative import SpeculativeRetrieval
 from app.patterns.custom_rag_qa.templates import (
     inspect_conversation_template,
     rag_template,
     template_docs,
 )
-from app.patterns.custom_rag_qa.vector_store import get_vector_store
+from app.patterns.custom_rag_qa.vector_store import (
+    get_lexical_index,
+    get_vector_store,
+)
+from app.utils.chain_registry import shared_resources
+from app.utils.chain_timing import stage
 from app.utils.decorators import custom_chain
+from app.utils.embedding_batcher import BatchedEmbeddings
+from app.utils.embedding_cache import CachedEmbeddings
+from app.utils.model_clients import chat_model, embedding_model
 from app.utils.output_types import OnChatModelStreamEvent, OnToolEndEvent
+from app.utils.semantic_cache import SemanticCache, replay
 from langchain.schema import Document
 from langchain.tools import tool
 from langchain_core.messages import ToolMessage
-from langchain_ollama import ChatOllama, OllamaEmbeddings
+from langchain_ollama import ChatOllama
 from langchain_core.documents.compressor import BaseDocumentCompressor
 
 
@@ -23,26 +54,198 @@ from langchain_core.documents.compressor import BaseDocumentCompressor
 EMBEDDING_MODEL = "nomic-embed-text"
 LLM_MODEL = "llama3-groq-tool-use:latest"
 TOP_K = 5
+# Index backend, see VECTOR_STORE_BACKENDS ("numpy" exact search, "ivf" ANN index)
+VECTOR_STORE_BACKEND = "numpy"
+# "vector" (MMR only) until benchmarks/hybrid_retrieval.py has measured the other
+# modes on the served corpus. "hybrid" fuses BM25 and MMR results. "auto" answers
+# keyword-like queries from BM25 alone (no embedding call), and is only served when
+# the report written at RETRIEVAL_BENCHMARK_PATH shows it keeps the recall of
+# "hybrid". Also "lexical"
+RETRIEVAL_MODE = "vector"
+RETRIEVAL_BENCHMARK_PATH = ".retrieval_benchmark.json"
+# On-disk tier of the embedding cache, shared by ingestion and queries
+EMBEDDING_CACHE_PATH = ".embedding_cache.sqlite"
+# Cache misses of concurrent requests are sent as one embedding call, gathered for
+# up to EMBEDDING_BATCH_WAIT seconds or EMBEDDING_BATCH_SIZE texts. 0 disables it.
+# Batches embedded at once: the concurrent batches of an ingestion run in parallel,
+# with a worker left for the queries
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_BATCH_WAIT = 0.002
+EMBEDDING_BATCH_WORKERS = EMBEDDING_MAX_CONCURRENCY + 1
+# Local router tried before the inspection LLM: "llm" to always call the LLM,
+# "heuristic", "centroid" or "logistic" (trained offline from the decisions logged
+# below, see router.main)
+ROUTER = "llm"
+# Log the questions decided by the inspection LLM to train the logistic router.
+# Off by default, as the questions of the users are written in plain text
+ROUTER_DECISION_LOG = False
+ROUTER_DECISION_LOG_PATH = ".router_decisions.jsonl"
+ROUTER_MODEL_PATH = ".router_logistic.npz"
+# Start retrieving for the last human message while the inspection LLM runs, and
+# reuse the result if the tool call query shares enough terms with it
+SPECULATIVE_RETRIEVAL = False
+SPECULATIVE_MATCH_THRESHOLD = 0.8
+# Semantic answer cache: minimum similarity of conversation tails, TTL in seconds
+SEMANTIC_CACHE_ENABLED = False
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_TTL = 3600
+SEMANTIC_CACHE_MAX_ENTRIES = 1000
+# Send the retrieved documents once, formatted in the tool message, with only their
+# ids in its artifact. Clients send the ids back and the documents are resolved from
+# the vector store, instead of shipping them twice in every stream and request
+DOC_REFERENCES = True
+# Upper bound on concurrent blocking retrievals (query embedding + vector search)
+RETRIEVAL_MAX_WORKERS = 4
+# Seconds between checks for a generation of the vector store persisted by another
+# process (e.g. the indexing CLI), served without restarting
+VECTOR_STORE_RELOAD_INTERVAL = 30.0
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-# Set up embedding model and vector store
-embedding = OllamaEmbeddings(model=EMBEDDING_MODEL)
-vector_store = get_vector_store(embedding=embedding)
-
-retriever = vector_store.as_retriever(
-    search_type="mmr",  # Maximum Marginal Relevance
-    search_kwargs={
-        "k": TOP_K,
-        "fetch_k": 20,  # Więcej dokumentów do wyboru
-        "lambda_mult": 0.5  # Balans między podobieństwem a różnorodnością
-    }
+# Models, indexes and chains are built on first use (or by `warm_up`), so importing
+# the module does not connect to Ollama or ingest the corpus. Tests and callers can
+# still replace them by assigning the module attributes.
+NOT_LOADED: Any = object()
+embedding: Any = NOT_LOADED
+vector_store: Any = NOT_LOADED
+lexical_index: Any = NOT_LOADED
+retriever: Any = NOT_LOADED
+llm: Any = NOT_LOADED
+inspect_conversation: Any = NOT_LOADED
+router: Any = NOT_LOADED
+response_chain: Any = NOT_LOADED
+semantic_cache: Any = NOT_LOADED
+_load_lock = threading.RLock()
+_reload_lock = threading.Lock()
+_reload_checked_at = 0.0
+
+
+def _load(name: str, factory: Callable[[], Any]) -> Any:
+    """Module attribute `name`, built with `factory` on first use."""
+    if globals()[name] is NOT_LOADED:
+        with _load_lock:
+            if globals()[name] is NOT_LOADED:
+                globals()[name] = factory()
+    return globals()[name]
+
+
+async def _aload(name: str, loader: Callable[[], Any]) -> Any:
+    """
+    The result of `loader`, called in a thread while `name` is not loaded yet, so
+    that neither building the resource nor waiting for `_load_lock` blocks the
+    event loop.
+    """
+    if globals()[name] is not NOT_LOADED:
+        return globals()[name]
+    return await asyncio.to_thread(loader)
+
+
+def _build_embedding() -> CachedEmbeddings:
+    underlying: Any = embedding_model(EMBEDDING_MODEL)
+    if EMBEDDING_BATCH_SIZE > 0:
+        # Under the cache, so that cache hits never wait for a batch
+        underlying = BatchedEmbeddings(
+            underlying,
+            max_batch_size=EMBEDDING_BATCH_SIZE,
+            max_wait=EMBEDDING_BATCH_WAIT,
+            workers=EMBEDDING_BATCH_WORKERS,
+        )
+    return CachedEmbeddings(
+        underlying, model_name=EMBEDDING_MODEL, path=EMBEDDING_CACHE_PATH
+    )
+
+
+def load_embedding() -> CachedEmbeddings:
+    """The embedding model, with its batcher and cache."""
+    return _load("embedding", _build_embedding)
+
+
+def load_vector_store() -> Any:
+    """The vector store, built from the corpus if it was not persisted yet."""
+    # Shared with the other chains of the process using the same index
+    return _load(
+        "vector_store",
+        lambda: shared_resources.get(
+            ("vector_store", VECTOR_STORE_BACKEND, EMBEDDING_MODEL),
+            lambda: get_vector_store(
+                embedding=load_embedding(), backend=VECTOR_STORE_BACKEND
+            ),
+        ),
+    )
+
+
+def load_lexical_index() -> Any:
+    """The BM25 index of the vector store documents."""
+    return _load(
+        "lexical_index",
+        lambda: shared_resources.get(
+            ("lexical_index", VECTOR_STORE_BACKEND, EMBEDDING_MODEL),
+            lambda: get_lexical_index(
+                load_vector_store(), backend=VECTOR_STORE_BACKEND
+            ),
+        ),
+    )
+
+
+def _build_retriever() -> HybridRetriever:
+    mode = resolve_retrieval_mode(RETRIEVAL_MODE, RETRIEVAL_BENCHMARK_PATH)
+    return HybridRetriever(
+        vector_store=load_vector_store(),
+        # The BM25 index is only built for the modes using it
+        lexical_index=load_lexical_index() if mode != "vector" else None,
+        mode=mode,
+        k=TOP_K,
+        fetch_k=20,  # Więcej dokumentów do wyboru
+        lambda_mult=0.5,  # Balans między podobieństwem a różnorodnością
+    )
+
+
+def load_retriever() -> Any:
+    """The retriever of RETRIEVAL_MODE: MMR search, BM25 or both."""
+    return _load("retriever", _build_retriever)
+
+
+def reload_vector_store() -> bool:
+    """
+    Load the latest generation of the vector store if another process persisted a
+    newer one, checked at most every VECTOR_STORE_RELOAD_INTERVAL seconds, and bring
+    the lexical index up to date with it.
+
+    Returns:
+        bool: Whether a new generation was loaded.
+    """
+    global _reload_checked_at
+    if vector_store is NOT_LOADED:
+        # Loads the latest generation on first use anyway
+        return False
+    with _reload_lock:
+        now = time.monotonic()
+        if now - _reload_checked_at < VECTOR_STORE_RELOAD_INTERVAL:
+            return False
+        _reload_checked_at = now
+        if not vector_store.reload():
+            return False
+        if lexical_index is not NOT_LOADED:
+            lexical_index.sync(vector_store)
+    log.info(f"Reloaded the vector store, {len(vector_store)} documents")
+    return True
+
+
+def _retrieve(query: str) -> List[Document]:
+    reload_vector_store()
+    return load_retriever().invoke(query)
+
+
+# Dedicated pool so blocking retrievals never run on (or exhaust) the event loop
+retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieval"
 )
 
+
 @tool
-def retrieve_docs(query: str) -> List[Document]:
+async def retrieve_docs(query: str) -> List[Document]:
     """
     Useful for retrieving relevant documents based on a query.
     Use this when you need additional information to answer a question.
@@ -53,27 +256,137 @@ def retrieve_docs(query: str) -> List[Document]:
     Returns:
         List[Document]: A list of the top-ranked Document objects, limited to TOP_K (5) results.
     """
-    retrieved_docs = retriever.invoke(query)
+    loop = asyncio.get_running_loop()
+    retrieved_docs = await loop.run_in_executor(retrieval_executor, _retrieve, query)
     # return retrieved_docs[:TOP_K]
     return retrieved_docs
 
 @tool
-def should_continue() -> None:
+async def should_continue() -> None:
     """
     Use this tool if you determine that you have enough context to respond to the questions of the user.
     """
     return None
 
-# Initialize language model
-llm = ChatOllama(model="llama3-groq-tool-use:latest", temperature=0)
 
-# Set up conversation inspector
-inspect_conversation = inspect_conversation_template | llm.bind_tools(
-    [retrieve_docs, should_continue], tool_choice="any"
-)
+def load_llm() -> ChatOllama:
+    """The language model."""
+    return _load("llm", lambda: chat_model(LLM_MODEL, temperature=0))
+
+
+def load_inspect_conversation() -> Any:
+    """The conversation inspector, calling one of the tools."""
+    return _load(
+        "inspect_conversation",
+        lambda: inspect_conversation_template
+        | load_llm().bind_tools([retrieve_docs, should_continue], tool_choice="any"),
+    )
+
+
+def load_router() -> Any:
+    """Local routing, the inspection LLM is only called when it is uncertain."""
+    return _load(
+        "router",
+        lambda: get_router(
+            ROUTER,
+            load_embedding(),
+            load_vector_store() if ROUTER == "centroid" else None,
+            model_path=ROUTER_MODEL_PATH,
+        ),
+    )
+
+
+decision_log = DecisionLog(ROUTER_DECISION_LOG_PATH) if ROUTER_DECISION_LOG else None
+
+
+def load_response_chain() -> Any:
+    """The response chain."""
+    return _load("response_chain", lambda: rag_template | load_llm())
+
+
+def load_semantic_cache() -> Optional[SemanticCache]:
+    """Optional semantic answer cache for near-identical conversations."""
+    return _load(
+        "semantic_cache",
+        lambda: (
+            SemanticCache(
+                load_embedding(),
+                threshold=SEMANTIC_CACHE_THRESHOLD,
+                ttl=SEMANTIC_CACHE_TTL,
+                max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+            )
+            if SEMANTIC_CACHE_ENABLED
+            else None
+        ),
+    )
+
+
+def warm_up() -> None:
+    """Build every resource of the chain ahead of the first request."""
+    load_retriever()
+    load_inspect_conversation()
+    load_router()
+    load_response_chain()
+    load_semantic_cache()
+
+
+def format_docs(docs: List[Document]) -> str:
+    """Format retrieved documents as the context of the response LLM."""
+    return template_docs.format(docs=docs)
+
+
+async def run_tool(
+    tool_call: Dict[str, Any], docs: Optional[List[Document]] = None
+) -> Any:
+    """
+    Execute the tool selected by the conversation inspection, reusing the documents
+    retrieved speculatively if given.
+    """
+    if tool_call["name"] == "retrieve_docs":
+        # Retrieve relevant documents
+        if docs is None:
+            with stage("retrieval"):
+                docs = await retrieve_docs.ainvoke(tool_call["args"])
+        # Format the retrieved documents
+        formatted_docs = format_docs(docs)
+        # Create a ToolMessage with the formatted documents, referring to the
+        # documents by id when they all have one
+        artifact = reference_artifact(docs) if DOC_REFERENCES else None
+        return ToolMessage(
+            tool_call_id=tool_call["name"],
+            name=tool_call["name"],
+            content=formatted_docs,
+            artifact=artifact or docs,
+        )
+    # If no documents need to be retrieved, continue with the conversation
+    return await should_continue.ainvoke(tool_call)
+
+
+async def aresolve_references(messages: List[Any]) -> List[Any]:
+    """
+    Rebuild the documents of previous turns sent back as references, in a thread
+    while the vector store is not loaded.
+    """
+    resolve = partial(
+        resolve_references,
+        messages,
+        lambda ids: load_vector_store().get_by_ids(ids),
+        format_docs,
+    )
+    if vector_store is NOT_LOADED:
+        return await asyncio.to_thread(resolve)
+    return resolve()
+
+
+def document_ids(tool_message: Any) -> List[str]:
+    """Ids of the documents retrieved by a tool call, empty if none were."""
+    if not isinstance(tool_message, ToolMessage) or not tool_message.artifact:
+        return []
+    ids = referenced_ids(tool_message.artifact)
+    if ids is not None:
+        return ids
+    return [doc.id for doc in tool_message.artifact]
 
-# Set up response chain
-response_chain = rag_template | llm
 
 # TODO: Add support for the case of a problem answering a question, e.g.: 
 # "I'm sorry but I do not have enough information to complete this task. 
@@ -89,29 +402,64 @@ async def chain(
     astream_events, support for synchronous invocation through the `invoke` method,
     and OpenTelemetry tracing.
     """
+    # Rebuild the documents of previous turns sent back as references
+    input["messages"] = await aresolve_references(input["messages"])
+
+    semantic_cache = await _aload("semantic_cache", load_semantic_cache)
+    if semantic_cache is not None:
+        # A similar conversation was answered: re-run its (cheap, local) tool call
+        # and replay the answer if it retrieves the same documents. This skips both
+        # the inspection and the response LLM calls.
+        with stage("semantic_cache"):
+            cache_vector = await semantic_cache.aembed(input["messages"])
+            # Only a hit once the documents are checked below
+            entry = semantic_cache.lookup(cache_vector, record=False)
+        if entry is not None and entry.tool_call is not None:
+            tool_message = await run_tool(entry.tool_call)
+            if document_ids(tool_message) == list(entry.doc_ids):
+                semantic_cache.record(hit=True)
+                log.info("Replaying answer from the semantic cache")
+                yield OnToolEndEvent(
+                    data={"input": entry.tool_call["args"], "output": tool_message}
+                )
+                for event in replay(entry):
+                    yield event
+                return
+        semantic_cache.record(hit=False)
+
     # Inspect conversation and determine next action
-    inspection_result = inspect_conversation.invoke(input)
+    speculation = None
+    if SPECULATIVE_RETRIEVAL:
+        speculation = SpeculativeRetrieval(
+            lambda query: retrieve_docs.ainvoke({"query": query}),
+            last_user_message(input["messages"]),
+            threshold=SPECULATIVE_MATCH_THRESHOLD,
+        )
+    try:
+        with stage("inspection"):
+            inspection_result = await route(
+                await _aload("router", load_router),
+                await _aload("inspect_conversation", load_inspect_conversation),
+                input,
+                decision_log,
+                # Retrieval only overlaps the inspection if it is an LLM call
+                on_fallback=speculation.start if speculation else None,
+            )
+    except BaseException:
+        if speculation is not None:
+            speculation.cancel()
+        raise
 
     log.info(f"Inspection result: {inspection_result.content}")
 
     tool_call_result = inspection_result.tool_calls[0]
 
     # Execute the appropriate tool based on the inspection result
-    if tool_call_result["name"] == "retrieve_docs":
-        # Retrieve relevant documents
-        docs = retrieve_docs.invoke(tool_call_result["args"])
-        # Format the retrieved documents
-        formatted_docs = template_docs.format(docs=docs)
-        # Create a ToolMessage with the formatted documents
-        tool_message = ToolMessage(
-            tool_call_id=tool_call_result["name"],
-            name=tool_call_result["name"],
-            content=formatted_docs,
-            artifact=docs,
-        )
-    else:
-        # If no documents need to be retrieved, continue with the conversation
-        tool_message = should_continue.invoke(tool_call_result)
+    speculative_docs = None
+    if speculation is not None:
+        with stage("speculative_retrieval"):
+            speculative_docs = await speculation.resolve(tool_call_result)
+    tool_message = await run_tool(tool_call_result, speculative_docs)
 
     # Update input messages with new information
     input["messages"] = input["messages"] + [inspection_result, tool_message]
@@ -122,5 +470,19 @@ async def chain(
     )
 
     # Stream LLM response
+    chunks = []
+    response_chain = await _aload("response_chain", load_response_chain)
     async for chunk in response_chain.astream(input=input):
+        chunks.append(chunk.content)
         yield OnChatModelStreamEvent(data={"chunk": chunk})
+
+    if semantic_cache is not None:
+        semantic_cache.add(
+            cache_vector,
+            chunks,
+            doc_ids=document_ids(tool_message),
+            tool_call={
+                "name": tool_call_result["name"],
+                "args": tool_call_result["args"],
+            },
+        )
@@ -0,0 +1,145 @@
+"""Hybrid retriever fusing BM25 and dense MMR results with reciprocal-rank fusion.
+
+Dense retrieval needs an embedding call per query and is weak on exact terms such
+as error codes or product names, which lexical retrieval handles well. "vector"
+mode (the default) only runs the dense MMR search. "hybrid" mode fuses both
+retrievers for every query. In "auto" mode, keyword-like queries are answered from
+the BM25 index alone, skipping the embedding round-trip; it is only enabled by
+`resolve_retrieval_mode` when a benchmark report shows that it keeps the recall of
+"hybrid" on the corpus (see benchmarks/hybrid_retrieval.py).
+"""
+import json
+import logging
+import os
+import re
+from typing import Any, Dict, List, Literal, Optional, Sequence
+
+from app.patterns.custom_rag_qa.bm25 import BM25Index, tokenize
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+RetrievalMode = Literal["auto", "hybrid", "lexical", "vector"]
+
+# Identifiers such as "ERR-404", "HTTP_503", "v1.2" or "CamelCase" names
+_IDENTIFIER = re.compile(r"\b(?:\w*\d\w*|\w+[-_./]\w+|[A-Z][a-z]+[A-Z]\w*)\b")
+_QUESTION = re.compile(
+    r"\?|^\s*(?:how|what|why|when|where|which|who|can|could|should|is|are|does|do|"
+    r"explain|describe|compare)\b",
+    re.IGNORECASE,
+)
+KEYWORD_QUERY_MAX_TERMS = 3
+# Largest drop of recall@k from "hybrid" to "auto", per kind of query, for which
+# "auto" is enabled
+AUTO_MAX_RECALL_LOSS = 0.01
+
+
+def is_keyword_query(query: str) -> bool:
+    """
+    Whether a query looks like a keyword lookup rather than a natural language
+    question: a quoted phrase, or an identifier or a few terms without a question form.
+    """
+    if '"' in query:
+        return True
+    if _QUESTION.search(query):
+        return False
+    return (
+        bool(_IDENTIFIER.search(query))
+        or len(tokenize(query)) <= KEYWORD_QUERY_MAX_TERMS
+    )
+
+
+def auto_mode_keeps_recall(
+    report: Dict[str, Any], max_recall_loss: float = AUTO_MAX_RECALL_LOSS
+) -> bool:
+    """
+    Whether "auto" retrieval keeps the recall@k of "hybrid" for every kind of query
+    of a benchmark report, as written by benchmarks/hybrid_retrieval.py.
+    """
+    results = report.get("results") or {}
+    try:
+        return bool(results) and all(
+            modes["auto"]["recall"] >= modes["hybrid"]["recall"] - max_recall_loss
+            for modes in results.values()
+        )
+    except (KeyError, TypeError):
+        return False
+
+
+def resolve_retrieval_mode(
+    mode: RetrievalMode, report_path: str, max_recall_loss: float = AUTO_MAX_RECALL_LOSS
+) -> RetrievalMode:
+    """
+    The retrieval mode to serve: "auto" falls back to "vector" unless the benchmark
+    report at `report_path` shows it keeps the recall of "hybrid".
+    """
+    if mode != "auto":
+        return mode
+    report: Dict[str, Any] = {}
+    if os.path.isfile(report_path):
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+    if auto_mode_keeps_recall(report, max_recall_loss):
+        return "auto"
+    logging.warning(
+        f"Retrieval mode 'auto' needs a benchmark report at {report_path} showing it "
+        f"keeps the recall of 'hybrid', using 'vector'"
+    )
+    return "vector"
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[str]], rrf_k: int = 60
+) -> List[str]:
+    """Fuse ranked lists of ids, scoring each id with the sum of 1 / (rrf_k + rank)."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda id_: scores[id_], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining a BM25 index and MMR search over a NumPy vector store. The
+    lexical index may be None in "vector" mode.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_store: NumpyVectorStore
+    lexical_index: Optional[BM25Index] = None
+    mode: RetrievalMode = "vector"
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+    rrf_k: int = 60
+
+    def _lexical_ids(self, query: str) -> List[str]:
+        return [id_ for id_, _ in self.lexical_index.search(query, self.k)]
+
+    def _vector_ids(self, query: str) -> List[str]:
+        documents = self.vector_store.max_marginal_relevance_search(
+            query, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+        )
+        return [doc.id for doc in documents]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        mode = self.mode
+        if mode == "auto":
+            mode = "lexical" if is_keyword_query(query) else "hybrid"
+
+        if mode == "vector":
+            return self.vector_store.get_by_ids(self._vector_ids(query))
+        lexical_ids = self._lexical_ids(query)
+        if mode == "lexical" and (lexical_ids or self.mode == "lexical"):
+            return self.vector_store.get_by_ids(lexical_ids)
+        # Hybrid, or an "auto" keyword query without any lexical match
+        fused = reciprocal_rank_fusion(
+            [lexical_ids, self._vector_ids(query)], rrf_k=self.rrf_k
+        )
+        return self.vector_store.get_by_ids(fused[: self.k])
@@ -0,0 +1,207 @@
+"""Incremental, deduplicating (re-)indexing of the RAG corpus.
+
+The store keeps a manifest in its `index_metadata`, mapping every indexed source to
+the hash of its content and the ids of its chunks. Chunk ids are derived from the
+source and the chunk text, so re-indexing a source:
+    - skips it entirely when its content hash did not change,
+    - embeds only the chunks whose id is not stored yet,
+    - tombstones the chunks that disappeared, and the chunks of removed sources.
+
+Tombstoned rows are dropped by a background compaction once they make up more than
+`COMPACTION_THRESHOLD` of the store, while queries keep being served.
+
+Usage:
+    poetry run python -m app.patterns.custom_rag_qa.indexing "docs/*.pdf" --backend numpy
+"""
+import argparse
+from dataclasses import dataclass
+import hashlib
+import logging
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from app.patterns.custom_rag_qa.ingestion import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_CONCURRENCY,
+    add_batches,
+    download,
+    is_url,
+    iter_batches,
+    iter_chunks,
+    iter_pdf_pages,
+    resolve_sources,
+)
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from langchain.text_splitter import TextSplitter
+from langchain_core.documents import Document
+
+MANIFEST_KEY = "sources"
+COMPACTION_THRESHOLD = 0.2
+
+
+@dataclass
+class ReindexStats:
+    """Counters of an incremental indexing run."""
+
+    sources_unchanged: int = 0
+    sources_changed: int = 0
+    sources_removed: int = 0
+    chunks_added: int = 0
+    chunks_unchanged: int = 0
+    chunks_removed: int = 0
+    seconds: float = 0.0
+
+
+def chunk_id(source: str, text: str) -> str:
+    """Stable id of a chunk, identical chunks of a source share it."""
+    digest = hashlib.sha256(f"{source}\0{text}".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def source_hash(path: str) -> str:
+    """Hash of the content of a local file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def reindex(
+    vector_store: NumpyVectorStore,
+    sources: Iterable[str],
+    text_splitter: Optional[TextSplitter] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+    max_workers: Optional[int] = None,
+    remove_missing: bool = True,
+    compaction_threshold: Optional[float] = COMPACTION_THRESHOLD,
+) -> ReindexStats:
+    """
+    Bring a vector store up to date with a set of PDF sources.
+
+    Args:
+        vector_store (NumpyVectorStore): The store to update, it is not persisted.
+        sources (Iterable[str]): Local paths or URLs of PDF files.
+        text_splitter (Optional[TextSplitter]): Splitter used to chunk pages.
+        batch_size (int): Number of chunks per embedding call.
+        max_concurrency (int): Maximum number of embedding calls in flight.
+        max_workers (Optional[int]): Size of the PDF parsing process pool.
+        remove_missing (bool): Whether to remove indexed sources absent from `sources`.
+        compaction_threshold (Optional[float]): Tombstone ratio above which a background
+            compaction is started. None disables compaction.
+
+    Returns:
+        ReindexStats: What was added, kept and removed.
+    """
+    stats = ReindexStats()
+    start = time.perf_counter()
+    sources = list(dict.fromkeys(sources))
+    manifest: Dict[str, dict] = dict(vector_store.index_metadata.get(MANIFEST_KEY, {}))
+    removed_ids: List[str] = []
+
+    with tempfile.TemporaryDirectory() as download_dir:
+        # Remote sources are downloaded once, both to hash and to parse them
+        local_paths = {
+            source: download(source, download_dir) if is_url(source) else source
+            for source in sources
+        }
+        hashes = {source: source_hash(path) for source, path in local_paths.items()}
+        changed = [
+            source
+            for source in sources
+            if manifest.get(source, {}).get("hash") != hashes[source]
+        ]
+        stats.sources_unchanged = len(sources) - len(changed)
+        stats.sources_changed = len(changed)
+
+        chunk_ids: Dict[str, List[str]] = {source: [] for source in changed}
+        seen: Set[str] = set()
+
+        def new_chunks(chunks: Iterable[Document]) -> Iterator[Document]:
+            for chunk in chunks:
+                source = chunk.metadata["source"]
+                chunk.id = chunk_id(source, chunk.page_content)
+                if chunk.id in seen:
+                    continue
+                seen.add(chunk.id)
+                chunk_ids[source].append(chunk.id)
+                if vector_store.get_by_ids([chunk.id]):
+                    stats.chunks_unchanged += 1
+                    continue
+                yield chunk
+
+        pages = iter_pdf_pages(changed, max_workers, local_paths=local_paths)
+        batches = iter_batches(
+            new_chunks(iter_chunks(pages, text_splitter)), batch_size
+        )
+        stats.chunks_added = add_batches(vector_store, batches, max_concurrency)
+
+    for source in changed:
+        if source in manifest:
+            previous = manifest[source]["chunks"]
+        else:
+            # Chunks indexed before the manifest existed, e.g. a migrated store
+            previous = vector_store.ids_by_metadata("source", source)
+        removed_ids += [id_ for id_ in previous if id_ not in seen]
+        manifest[source] = {"hash": hashes[source], "chunks": chunk_ids[source]}
+    if remove_missing:
+        for source in [source for source in manifest if source not in hashes]:
+            removed_ids += manifest.pop(source)["chunks"]
+            stats.sources_removed += 1
+
+    if removed_ids:
+        vector_store.delete(removed_ids)
+    stats.chunks_removed = len(removed_ids)
+    vector_store.index_metadata[MANIFEST_KEY] = manifest
+    stats.seconds = time.perf_counter() - start
+    logging.info(f"Re-indexed {len(sources)} sources in {stats.seconds:.1f}s: {stats}")
+
+    if (
+        compaction_threshold is not None
+        and vector_store.tombstone_ratio > compaction_threshold
+    ):
+        vector_store.compact_in_background()
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Incrementally re-index PDFs (directories, globs or URLs) into a persisted store."""
+    # Imported here so that the pipeline itself does not depend on Ollama
+    from app.patterns.custom_rag_qa.vector_store import (
+        get_lexical_index,
+        open_vector_store,
+    )
+    from langchain_ollama import OllamaEmbeddings
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("sources", nargs="+", help="PDF files, directories or globs")
+    parser.add_argument("--backend", default="numpy", choices=["numpy", "ivf"])
+    parser.add_argument("--persist-path", default=None)
+    parser.add_argument("--embedding-model", default="nomic-embed-text")
+    parser.add_argument("--keep-missing", action="store_true")
+    args = parser.parse_args(argv)
+
+    vector_store = open_vector_store(
+        embedding=OllamaEmbeddings(model=args.embedding_model),
+        persist_path=args.persist_path,
+        backend=args.backend,
+    )
+    stats = reindex(
+        vector_store,
+        resolve_sources(args.sources),
+        remove_missing=not args.keep_missing,
+        # Compact synchronously, the process exits right after persisting
+        compaction_threshold=None,
+    )
+    if vector_store.tombstone_ratio > COMPACTION_THRESHOLD:
+        vector_store.compact()
+    vector_store.persist()
+    get_lexical_index(vector_store, args.persist_path, args.backend)
+    print(stats)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
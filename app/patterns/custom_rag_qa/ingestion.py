@@ -0,0 +1,320 @@
+"""Streaming, parallel ingestion pipeline for PDF documents.
+
+The pipeline is a chain of generators, so only a bounded window of pages, chunks and
+embedding batches is held in memory at any time:
+
+    sources -> pages (process pool) -> chunks (incremental splitting)
+            -> batches -> embeddings (bounded thread concurrency) -> index appends
+
+Usage:
+    poetry run python -m app.patterns.custom_rag_qa.ingestion "docs/*.pdf" --backend numpy
+"""
+import argparse
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import glob
+import itertools
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter, TextSplitter
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from pypdf import PdfReader
+import requests
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+PAGES_PER_TASK = 8
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_CONCURRENCY = 4
+
+
+@dataclass
+class IngestionStats:
+    """Throughput counters of an ingestion run."""
+
+    pages: int = 0
+    chunks: int = 0
+    seconds: float = 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        """Parsed pages per second of wall-clock time."""
+        return self.pages / self.seconds if self.seconds else 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        """Indexed chunks per second of wall-clock time."""
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+
+def default_text_splitter() -> TextSplitter:
+    """The text splitter used for the RAG corpus."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+    )
+
+
+def resolve_sources(patterns: Iterable[str]) -> List[str]:
+    """Expand URLs, directories and glob patterns into a sorted list of PDF sources."""
+    sources: List[str] = []
+    for pattern in patterns:
+        if is_url(pattern):
+            sources.append(pattern)
+        elif os.path.isdir(pattern):
+            sources.extend(
+                sorted(glob.glob(os.path.join(pattern, "**", "*.pdf"), recursive=True))
+            )
+        else:
+            sources.extend(sorted(glob.glob(pattern, recursive=True)))
+    return sources
+
+
+def is_url(source: str) -> bool:
+    """Whether a source has to be downloaded before parsing."""
+    return source.startswith(("http://", "https://"))
+
+
+def download(url: str, directory: str) -> str:
+    """Download a remote PDF to a local file and return its path."""
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with tempfile.NamedTemporaryFile(
+            dir=directory, suffix=".pdf", delete=False
+        ) as f:
+            for block in response.iter_content(chunk_size=1 << 20):
+                f.write(block)
+    return f.name
+
+
+def _extract_pages(task: Tuple[str, str, int, int]) -> List[Document]:
+    """Extract the text of pages [start, end) of a PDF. Runs in a worker process."""
+    path, source, start, end = task
+    reader = PdfReader(path)
+    return [
+        Document(
+            page_content=reader.pages[page].extract_text(),
+            metadata={"source": source, "page": page},
+        )
+        for page in range(start, end)
+    ]
+
+
+def bounded_map(
+    executor: Executor, fn: Callable[[T], R], items: Iterable[T], window: int
+) -> Iterator[R]:
+    """
+    Like `executor.map`, but lazily consumes `items` and keeps at most `window`
+    tasks in flight, yielding results in input order.
+    """
+    pending: deque = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_pdf_pages(
+    sources: Iterable[str],
+    max_workers: Optional[int] = None,
+    pages_per_task: int = PAGES_PER_TASK,
+    local_paths: Optional[Dict[str, str]] = None,
+) -> Iterator[Document]:
+    """
+    Parse PDF pages across a pool of spawned processes and yield one Document per
+    page, in order.
+
+    Args:
+        sources (Iterable[str]): Local paths or URLs of PDF files.
+        max_workers (Optional[int]): Size of the process pool. Defaults to the CPU count.
+        pages_per_task (int): Pages parsed per task, amortizes reopening the PDF.
+        local_paths (Optional[Dict[str, str]]): Already downloaded copies of sources.
+    """
+    local_paths = local_paths or {}
+    max_workers = max_workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as download_dir:
+
+        def tasks() -> Iterator[Tuple[str, str, int, int]]:
+            for source in sources:
+                path = local_paths.get(source, source)
+                if is_url(path):
+                    path = download(path, download_dir)
+                n_pages = len(PdfReader(path).pages)
+                for start in range(0, n_pages, pages_per_task):
+                    yield path, source, start, min(start + pages_per_task, n_pages)
+
+        # Spawned rather than forked, as the server process runs threads (event
+        # loop, retrieval and embedding pools) whose locks a fork could copy held
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            for pages in bounded_map(pool, _extract_pages, tasks(), 2 * max_workers):
+                yield from pages
+
+
+def iter_chunks(
+    pages: Iterable[Document], text_splitter: Optional[TextSplitter] = None
+) -> Iterator[Document]:
+    """Split pages into chunks one page at a time."""
+    text_splitter = text_splitter or default_text_splitter()
+    for page in pages:
+        yield from text_splitter.split_documents([page])
+
+
+def iter_batches(items: Iterable[T], batch_size: int) -> Iterator[List[T]]:
+    """Group an iterable into lists of at most `batch_size` items."""
+    iterator = iter(items)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def add_batches(
+    vector_store: VectorStore,
+    batches: Iterable[List[Document]],
+    max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+) -> int:
+    """
+    Embed batches of chunks and append them to a vector store, in order.
+
+    Stores exposing `add_embeddings` (NumpyVectorStore and subclasses) get up to
+    `max_concurrency` concurrent embedding calls, others are filled batch by batch
+    with `add_documents`. Chunks carrying a `Document.id` keep it in the store.
+
+    Returns:
+        int: The number of chunks added.
+    """
+    n_chunks = 0
+    if not hasattr(vector_store, "add_embeddings"):
+        for batch in batches:
+            vector_store.add_documents(documents=batch)
+            n_chunks += len(batch)
+        return n_chunks
+
+    embedding = vector_store.embeddings
+
+    def embed(batch: List[Document]) -> Tuple[List[Document], List[List[float]]]:
+        return batch, embedding.embed_documents([doc.page_content for doc in batch])
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        for batch, vectors in bounded_map(pool, embed, batches, max_concurrency):
+            vector_store.add_embeddings(
+                texts=[doc.page_content for doc in batch],
+                embeddings=vectors,
+                metadatas=[doc.metadata for doc in batch],
+                ids=[doc.id for doc in batch] if all(d.id for d in batch) else None,
+            )
+            n_chunks += len(batch)
+    return n_chunks
+
+
+def ingest(
+    sources: Iterable[str],
+    vector_store: VectorStore,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+    max_workers: Optional[int] = None,
+    text_splitter: Optional[TextSplitter] = None,
+) -> IngestionStats:
+    """
+    Stream PDF sources into a vector store.
+
+    Pages are parsed across a process pool, chunked incrementally and embedded in
+    batches with at most `max_concurrency` embedding calls in flight. Batches are
+    appended to the index as soon as they are embedded, in source order.
+
+    Args:
+        sources (Iterable[str]): Local paths or URLs of PDF files.
+        vector_store (VectorStore): The store to append to, see `add_batches`.
+        batch_size (int): Number of chunks per embedding call.
+        max_concurrency (int): Maximum number of embedding calls in flight.
+        max_workers (Optional[int]): Size of the PDF parsing process pool.
+        text_splitter (Optional[TextSplitter]): Splitter used to chunk pages.
+
+    Returns:
+        IngestionStats: Pages and chunks processed and the elapsed time.
+    """
+    stats = IngestionStats()
+    start = time.perf_counter()
+
+    def count_pages(pages: Iterable[Document]) -> Iterator[Document]:
+        for page in pages:
+            stats.pages += 1
+            yield page
+
+    pages = count_pages(iter_pdf_pages(sources, max_workers))
+    chunks = iter_chunks(pages, text_splitter)
+    batches = iter_batches(chunks, batch_size)
+
+    stats.chunks = add_batches(vector_store, batches, max_concurrency)
+
+    stats.seconds = time.perf_counter() - start
+    logging.info(
+        f"Ingested {stats.pages} pages ({stats.pages_per_second:.1f} pages/s) and "
+        f"{stats.chunks} chunks ({stats.chunks_per_second:.1f} chunks/s) "
+        f"in {stats.seconds:.1f}s"
+    )
+    return stats
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Ingest local PDFs (directories, globs or URLs) into a persisted vector store."""
+    # Imported here so that the pipeline itself does not depend on Ollama
+    from app.patterns.custom_rag_qa.vector_store import (
+        MEMMAP_BACKENDS,
+        get_lexical_index,
+        open_vector_store,
+    )
+    from langchain_ollama import OllamaEmbeddings
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("sources", nargs="+", help="PDF files, directories or globs")
+    parser.add_argument("--backend", default="numpy")
+    parser.add_argument("--persist-path", default=None)
+    parser.add_argument("--embedding-model", default="nomic-embed-text")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE)
+    parser.add_argument(
+        "--max-concurrency", type=int, default=EMBEDDING_MAX_CONCURRENCY
+    )
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    sources = resolve_sources(args.sources)
+    if not sources:
+        parser.error(f"No PDF found for {args.sources}")
+
+    vector_store = open_vector_store(
+        embedding=OllamaEmbeddings(model=args.embedding_model),
+        persist_path=args.persist_path,
+        backend=args.backend,
+    )
+    stats = ingest(
+        sources,
+        vector_store,
+        batch_size=args.batch_size,
+        max_concurrency=args.max_concurrency,
+        max_workers=args.max_workers,
+    )
+    vector_store.persist()
+    if args.backend in MEMMAP_BACKENDS:
+        get_lexical_index(vector_store, args.persist_path, args.backend)
+    print(
+        f"{len(sources)} files, {stats.pages} pages, {stats.chunks} chunks in "
+        f"{stats.seconds:.1f}s: {stats.pages_per_second:.1f} pages/s, "
+        f"{stats.chunks_per_second:.1f} chunks/s"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
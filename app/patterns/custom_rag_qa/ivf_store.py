@@ -0,0 +1,185 @@
+"""Approximate nearest-neighbour vector store based on an inverted file (IVF) index.
+
+The embedding matrix is partitioned with spherical k-means into `n_lists` cells.
+A query only scores the vectors of the `n_probe` cells whose centroids are closest
+to it, so search cost grows with the size of the probed cells instead of the whole
+corpus. Small corpora (below `min_train_size`) are searched exactly.
+"""
+import logging
+import math
+import os
+from typing import Optional
+
+from app.patterns.custom_rag_qa.numpy_store import (
+    NumpyVectorStore,
+    normalize,
+    replace_file,
+    top_k,
+)
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+IVF_INDEX_FILE = "ivf-{generation}.npz"
+# Rows scored per block when assigning vectors to cells, bounds peak memory
+ASSIGN_BLOCK_SIZE = 65536
+
+
+class IVFVectorStore(NumpyVectorStore):
+    """Vector store with an IVF approximate nearest-neighbour index over cosine similarity."""
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        *,
+        persist_path: Optional[str] = None,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        min_train_size: int = 4096,
+        kmeans_iterations: int = 10,
+        seed: int = 0,
+    ) -> None:
+        """
+        Initialize the store, loading it from `persist_path` if it exists.
+
+        Args:
+            embedding (Embeddings): The embedding model used for texts and queries.
+            persist_path (Optional[str]): Directory the store and its index are persisted to.
+            n_lists (Optional[int]): Number of IVF cells. Defaults to sqrt(N) at train time.
+            n_probe (int): Number of cells scored per query.
+            min_train_size (int): Below this corpus size, search is exact.
+            kmeans_iterations (int): Number of k-means iterations when training.
+            seed (int): Seed for centroid initialization and training sampling.
+        """
+        self._n_lists = n_lists
+        self.n_probe = n_probe
+        self._min_train_size = min_train_size
+        self._kmeans_iterations = kmeans_iterations
+        self._rng = np.random.default_rng(seed)
+
+        self._reset_index()
+
+        super().__init__(embedding, persist_path=persist_path)
+
+    def _reset_index(self) -> None:
+        self._centroids: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._trained_size = 0
+        self._list_members = np.empty(0, dtype=np.int64)
+        self._list_offsets = np.zeros(1, dtype=np.int64)
+        self._lists_dirty = False
+
+    def _update_index(self, previous_size: int) -> None:
+        """Train the coarse quantizer when needed, otherwise assign the new rows."""
+        if self._size < self._min_train_size:
+            return
+        if self._centroids is None or self._size > 4 * self._trained_size:
+            self.train()
+            return
+        self._assignments = np.concatenate(
+            [self._assignments, self._assign(self._matrix[previous_size:])]
+        )
+        self._lists_dirty = True
+
+    def train(self) -> None:
+        """(Re)train the IVF centroids with spherical k-means and reassign all vectors."""
+        n_lists = self._n_lists or max(1, int(math.sqrt(self._size)))
+        n_lists = min(n_lists, self._size)
+        sample_size = min(self._size, 64 * n_lists)
+        sample = self._matrix[
+            np.sort(self._rng.choice(self._size, size=sample_size, replace=False))
+        ]
+        centroids = sample[self._rng.choice(sample_size, size=n_lists, replace=False)]
+        for _ in range(self._kmeans_iterations):
+            labels = self._assign(sample, centroids)
+            counts = np.bincount(labels, minlength=n_lists)
+            empty = counts == 0
+            starts = np.cumsum(counts) - counts
+            sums = np.zeros_like(centroids)
+            sums[~empty] = np.add.reduceat(
+                sample[np.argsort(labels, kind="stable")], starts[~empty], axis=0
+            )
+            # Re-seed empty cells with random samples to keep all lists in use
+            sums[empty] = sample[self._rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = normalize(sums)
+        self._centroids = centroids
+        self._assignments = self._assign(self._matrix)
+        self._trained_size = self._size
+        self._lists_dirty = True
+        logging.info(f"Trained IVF index with {n_lists} lists on {self._size} vectors")
+
+    def _assign(
+        self, vectors: np.ndarray, centroids: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        centroids = self._centroids if centroids is None else centroids
+        labels = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], ASSIGN_BLOCK_SIZE):
+            block = vectors[start : start + ASSIGN_BLOCK_SIZE]
+            labels[start : start + ASSIGN_BLOCK_SIZE] = np.argmax(
+                block @ centroids.T, axis=1
+            )
+        return labels
+
+    def _rebuild_lists(self) -> None:
+        """Group vector indices by cell (CSR layout) for fast candidate lookup."""
+        self._list_members = np.argsort(self._assignments, kind="stable")
+        counts = np.bincount(self._assignments, minlength=len(self._centroids))
+        self._list_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._lists_dirty = False
+
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        if self._lists_dirty:
+            self._rebuild_lists()
+        cells = top_k(self._centroids @ query, self.n_probe)
+        return np.concatenate(
+            [
+                self._list_members[
+                    self._list_offsets[cell] : self._list_offsets[cell + 1]
+                ]
+                for cell in cells
+            ]
+        )
+
+    def _compact_index(self, keep: np.ndarray) -> Optional[np.ndarray]:
+        if self._centroids is None:
+            return None
+        return self._assignments[keep]
+
+    def _apply_compacted_index(self, state: Optional[np.ndarray]) -> None:
+        if state is not None:
+            self._assignments = state
+            self._lists_dirty = True
+
+    def _persist_index(self, generation: int) -> None:
+        if self._centroids is None:
+            return
+        # Written through a file handle so numpy does not append a `.npz` suffix
+        replace_file(
+            os.path.join(
+                self._persist_path, IVF_INDEX_FILE.format(generation=generation)
+            ),
+            lambda f: np.savez(
+                f,
+                centroids=self._centroids,
+                assignments=self._assignments,
+                trained_size=np.asarray(self._trained_size),
+            ),
+        )
+
+    def _load_index(self, generation: int) -> None:
+        index_path = os.path.join(
+            self._persist_path, IVF_INDEX_FILE.format(generation=generation)
+        )
+        if not os.path.isfile(index_path):
+            # E.g. a store migrated from another backend, or a generation written by
+            # a NumpyVectorStore: drop the index of the previous generation and build
+            # the index of this one
+            self._reset_index()
+            self._update_index(0)
+            return
+        with np.load(index_path) as data:
+            self._centroids = data["centroids"]
+            self._assignments = data["assignments"]
+            self._trained_size = int(data["trained_size"])
+        self._lists_dirty = True
@@ -0,0 +1,661 @@
+"""Exact vector store over a float32 NumPy matrix with memory-mapped persistence.
+
+A persisted store is a directory holding numbered generations of:
+    - `embeddings-<n>.npy`: the L2-normalized float32 embedding matrix, loaded with
+      `mmap_mode="r"` so that worker processes share its pages through the OS cache.
+    - `documents-<n>.json`: a compact sidecar with the ids, texts, metadatas,
+      tombstoned rows and index metadata (e.g. the incremental indexing manifest).
+    - `CURRENT`: the number of the latest complete generation.
+
+A new generation is fully written before `CURRENT` is atomically replaced, so a
+process loading the store never sees a half-written version, and processes that
+already mapped an older generation keep a consistent view. Writers hold an
+exclusive lock on the `LOCK` file of the directory while they publish, so that
+concurrent writers never pick the same generation. Serving processes pick up new
+generations with `reload()`.
+
+Deleted documents are tombstoned and skipped by searches until `compact()` rewrites
+the matrix without them. All reads and writes of a store instance are guarded by a
+lock, and compaction builds the new arrays outside of it, so queries keep being
+served while it runs.
+"""
+from contextlib import contextmanager
+import json
+import logging
+import os
+import re
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+import uuid
+
+from app.patterns.custom_rag_qa.mmr import batched_mmr
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+EMBEDDINGS_FILE = "embeddings-{generation}.npy"
+DOCUMENTS_FILE = "documents-{generation}.json"
+_GENERATION_FILE = re.compile(r"^[a-z]+-(\d+)\.[a-z]+$")
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize row vectors so that dot products are cosine similarities."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k highest scores, sorted by decreasing score."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def replace_file(path: str, write: Callable[[Any], Any]) -> None:
+    """Write a file next to `path` and atomically move it into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def read_generation(persist_path: str) -> int:
+    """Return the latest complete generation of a persisted store, 0 if there is none."""
+    try:
+        with open(os.path.join(persist_path, CURRENT_FILE), "r") as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        return 0
+
+
+@contextmanager
+def publish_lock(persist_path: str) -> Iterator[None]:
+    """Hold the exclusive lock of a store directory, across processes."""
+    with open(os.path.join(persist_path, LOCK_FILE), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_store_files(
+    persist_path: str,
+    embeddings: np.ndarray,
+    ids: List[str],
+    texts: List[str],
+    metadatas: List[dict],
+    deleted_rows: Sequence[int] = (),
+    index_metadata: Optional[Dict[str, Any]] = None,
+    write_index: Optional[Callable[[int], None]] = None,
+) -> int:
+    """
+    Write a new generation of a store in the memory-mappable layout.
+
+    Args:
+        persist_path (str): The store directory.
+        embeddings (np.ndarray): One embedding per document.
+        ids (List[str]): Document ids.
+        texts (List[str]): Document texts.
+        metadatas (List[dict]): Document metadatas.
+        deleted_rows (Sequence[int]): Tombstoned rows.
+        index_metadata (Optional[Dict[str, Any]]): Store level metadata.
+        write_index (Optional[Callable[[int], None]]): Writes index backend files
+            for the given generation before it is made current.
+
+    Returns:
+        int: The generation written.
+    """
+    os.makedirs(persist_path, exist_ok=True)
+    documents = json.dumps(
+        {
+            "ids": ids,
+            "texts": texts,
+            "metadatas": metadatas,
+            "deleted_rows": list(deleted_rows),
+            "index_metadata": index_metadata or {},
+        },
+        separators=(",", ":"),
+        ensure_ascii=False,
+    ).encode("utf-8")
+    with publish_lock(persist_path):
+        generation = read_generation(persist_path) + 1
+        replace_file(
+            os.path.join(persist_path, EMBEDDINGS_FILE.format(generation=generation)),
+            lambda f: np.save(f, normalize(embeddings)),
+        )
+        replace_file(
+            os.path.join(persist_path, DOCUMENTS_FILE.format(generation=generation)),
+            lambda f: f.write(documents),
+        )
+        if write_index is not None:
+            write_index(generation)
+        replace_file(
+            os.path.join(persist_path, CURRENT_FILE),
+            lambda f: f.write(str(generation).encode("utf-8")),
+        )
+        # Keep the previous generation for processes that are loading it right now.
+        # Processes that already mapped older files keep them alive until they unmap.
+        for name in os.listdir(persist_path):
+            match = _GENERATION_FILE.match(name)
+            if match and int(match.group(1)) < generation - 1:
+                os.remove(os.path.join(persist_path, name))
+    return generation
+
+
+def migrate_sklearn_json(json_path: str, persist_path: str) -> None:
+    """
+    One-shot migration of a `SKLearnVectorStore` JSON file to the memory-mapped layout.
+
+    Args:
+        json_path (str): The file written by `SKLearnVectorStore.persist()`.
+        persist_path (str): The directory to write the migrated store to.
+    """
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    write_store_files(
+        persist_path,
+        embeddings=np.asarray(data["embeddings"], dtype=np.float32),
+        ids=data["ids"],
+        texts=data["texts"],
+        metadatas=data["metadatas"],
+    )
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine similarity vector store backed by a (memory-mapped) NumPy matrix."""
+
+    def __init__(
+        self, embedding: Embeddings, *, persist_path: Optional[str] = None
+    ) -> None:
+        """
+        Initialize the store, loading it from `persist_path` if it exists.
+
+        Args:
+            embedding (Embeddings): The embedding model used for texts and queries.
+            persist_path (Optional[str]): Directory the store is persisted to.
+        """
+        self._embedding_function = embedding
+        self._persist_path = persist_path
+        self._lock = threading.RLock()
+        # Incremented on every change, lets compaction detect concurrent writes
+        self._version = 0
+        self._generation = 0
+        # Free-form metadata persisted with the store, e.g. the indexing manifest
+        self.index_metadata: Dict[str, Any] = {}
+
+        # The embedding buffer grows geometrically to keep appends amortized O(1).
+        # After loading it is a read-only memmap, replaced by a private copy on append.
+        self._buffer = np.empty((0, 0), dtype=np.float32)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._texts: List[str] = []
+        self._metadatas: List[dict] = []
+        self._ids: List[str] = []
+        self._id_to_row: Dict[str, int] = {}
+
+        if self._persist_path is not None and read_generation(self._persist_path):
+            self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """The embedding model used by the store."""
+        return self._embedding_function
+
+    @property
+    def _matrix(self) -> np.ndarray:
+        return self._buffer[: self._size]
+
+    def __len__(self) -> int:
+        """Number of live (not tombstoned) documents."""
+        return len(self._id_to_row)
+
+    @property
+    def ids(self) -> List[str]:
+        """Ids of the live documents."""
+        with self._lock:
+            return list(self._id_to_row)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        """Fraction of the stored rows that are tombstoned."""
+        return 1.0 - len(self) / self._size if self._size else 0.0
+
+    # Writing
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Embed texts and add them to the store."""
+        _texts = list(texts)
+        if not _texts:
+            return []
+        return self.add_embeddings(
+            _texts,
+            self._embedding_function.embed_documents(_texts),
+            metadatas=metadatas,
+            ids=ids,
+        )
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """
+        Add texts with precomputed embeddings, e.g. from a concurrent ingestion.
+        Documents whose id is already stored replace the previous version.
+        """
+        if not texts:
+            return []
+        _ids = ids or [str(uuid.uuid4()) for _ in texts]
+        self._append(
+            np.asarray(embeddings, dtype=np.float32),
+            list(texts),
+            metadatas or [{} for _ in texts],
+            _ids,
+        )
+        return _ids
+
+    def _append(
+        self,
+        vectors: np.ndarray,
+        texts: List[str],
+        metadatas: List[dict],
+        ids: List[str],
+    ) -> None:
+        vectors = normalize(vectors)
+        with self._lock:
+            if self._buffer.shape[1] not in (0, vectors.shape[1]):
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match "
+                    f"the store dimension {self._buffer.shape[1]}"
+                )
+            self.delete([id_ for id_ in ids if id_ in self._id_to_row])
+            new_size = self._size + vectors.shape[0]
+            if new_size > self._buffer.shape[0] or not self._buffer.flags.writeable:
+                capacity = max(new_size, 2 * self._buffer.shape[0])
+                buffer = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+                if self._size:
+                    buffer[: self._size] = self._matrix
+                self._buffer = buffer
+                deleted = np.zeros(capacity, dtype=bool)
+                deleted[: self._size] = self._deleted[: self._size]
+                self._deleted = deleted
+            self._buffer[self._size : new_size] = vectors
+            previous_size = self._size
+            self._size = new_size
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+            self._ids.extend(ids)
+            for row, id_ in enumerate(ids, start=previous_size):
+                self._id_to_row[id_] = row
+            self._version += 1
+            self._update_index(previous_size)
+
+    def _update_index(self, previous_size: int) -> None:
+        """Hook for index backends, called after rows from `previous_size` were added."""
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Tombstone documents by id. They are removed for good by `compact()`."""
+        if not ids:
+            return False
+        with self._lock:
+            rows = [self._id_to_row.pop(id_) for id_ in ids if id_ in self._id_to_row]
+            if not rows:
+                return False
+            self._deleted[rows] = True
+            self._version += 1
+        return True
+
+    def get_by_ids(self, ids: Sequence[str], /) -> List[Document]:
+        """Return the live documents with the given ids, in the order of `ids`."""
+        with self._lock:
+            return [
+                self._document(self._id_to_row[id_])
+                for id_ in ids
+                if id_ in self._id_to_row
+            ]
+
+    def centroid(self) -> Optional[np.ndarray]:
+        """Mean of the normalized embeddings of the live documents, None if empty."""
+        with self._lock:
+            live = self._matrix[~self._deleted[: self._size]]
+            return live.mean(axis=0) if len(live) else None
+
+    def ids_by_metadata(self, key: str, value: Any) -> List[str]:
+        """Return the ids of the live documents whose metadata `key` equals `value`."""
+        with self._lock:
+            return [
+                id_
+                for id_, row in self._id_to_row.items()
+                if self._metadatas[row].get(key) == value
+            ]
+
+    def compact(self) -> bool:
+        """
+        Rewrite the matrix without tombstoned rows.
+
+        The compacted arrays are built without holding the lock, so concurrent
+        queries are not blocked. If the store changed meanwhile, the result is
+        discarded and False is returned, the next compaction will try again.
+        """
+        with self._lock:
+            version, size = self._version, self._size
+            matrix, deleted = self._matrix, self._deleted[:size].copy()
+            ids, texts = list(self._ids), list(self._texts)
+            metadatas = list(self._metadatas)
+        if not deleted.any():
+            return True
+
+        keep = np.flatnonzero(~deleted)
+        compacted = (
+            np.ascontiguousarray(matrix[keep]),
+            [ids[row] for row in keep],
+            [texts[row] for row in keep],
+            [metadatas[row] for row in keep],
+        )
+        index_state = self._compact_index(keep)
+
+        with self._lock:
+            if self._version != version:
+                logging.info("Vector store changed during compaction, retrying later")
+                return False
+            self._buffer, self._ids, self._texts, self._metadatas = compacted
+            self._size = len(keep)
+            self._deleted = np.zeros(self._size, dtype=bool)
+            self._id_to_row = {id_: row for row, id_ in enumerate(self._ids)}
+            self._apply_compacted_index(index_state)
+            self._version += 1
+        logging.info(f"Compacted vector store from {size} to {len(keep)} rows")
+        return True
+
+    def compact_in_background(
+        self, min_tombstone_ratio: float = 0.0
+    ) -> threading.Thread:
+        """Run `compact()` in a daemon thread if enough rows are tombstoned."""
+
+        def run() -> None:
+            if self.tombstone_ratio > min_tombstone_ratio and not self.compact():
+                self.compact()
+
+        thread = threading.Thread(
+            target=run, name="vector-store-compaction", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _compact_index(self, keep: np.ndarray) -> Any:
+        """Hook for index backends: compute their state for the kept rows (no lock held)."""
+        return None
+
+    def _apply_compacted_index(self, state: Any) -> None:
+        """Hook for index backends: install the state computed by `_compact_index`."""
+
+    # Searching
+
+    def _candidate_rows(self, query: np.ndarray) -> Optional[np.ndarray]:
+        """Hook for index backends: rows worth scoring for a query, None for all rows."""
+        return None
+
+    def _search_by_vector(
+        self, embedding: List[float], k: int
+    ) -> List[Tuple[int, float]]:
+        """Return up to k live (row index, cosine similarity) pairs, best first."""
+        if self._size == 0:
+            return []
+        query = normalize(np.asarray(embedding, dtype=np.float32))
+        candidates = self._candidate_rows(query)
+        if candidates is None:
+            scores = self._matrix @ query
+            scores[self._deleted[: self._size]] = -np.inf
+        else:
+            scores = self._matrix[candidates] @ query
+            scores[self._deleted[candidates]] = -np.inf
+        top = top_k(scores, k)
+        top = top[np.isfinite(scores[top])]
+        rows = top if candidates is None else candidates[top]
+        return list(zip(rows.tolist(), scores[top].tolist()))
+
+    def _document(self, row: int) -> Document:
+        return Document(
+            id=self._ids[row],
+            page_content=self._texts[row],
+            metadata={"id": self._ids[row], **self._metadatas[row]},
+        )
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """Return documents most similar to the query with their cosine similarity."""
+        embedding = self._embedding_function.embed_query(query)
+        with self._lock:
+            return [
+                (self._document(row), score)
+                for row, score in self._search_by_vector(embedding, k)
+            ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """Return documents most similar to the query."""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        """Return documents most similar to the embedding vector."""
+        with self._lock:
+            return [
+                self._document(row) for row, _ in self._search_by_vector(embedding, k)
+            ]
+
+    def _select_relevance_score_fn(self) -> Any:
+        return self._cosine_relevance_score_fn
+
+    def _similarity_search_with_relevance_scores(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        # Scores are already similarities, map [-1, 1] onto [0, 1]
+        return [
+            (doc, (score + 1.0) / 2.0)
+            for doc, score in self.similarity_search_with_score(query, k, **kwargs)
+        ]
+
+    def max_marginal_relevance_search_by_vectors(
+        self,
+        embeddings: List[List[float]],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+    ) -> List[List[Document]]:
+        """Return documents selected with maximal marginal relevance for a batch of queries."""
+        with self._lock:
+            rows = [
+                [row for row, _ in self._search_by_vector(embedding, fetch_k)]
+                for embedding in embeddings
+            ]
+            n_candidates = max((len(query_rows) for query_rows in rows), default=0)
+            if n_candidates == 0:
+                return [[] for _ in embeddings]
+            # Pad the candidate sets of the batch to the same size
+            candidates = np.zeros(
+                (len(rows), n_candidates, self._buffer.shape[1]), dtype=np.float32
+            )
+            mask = np.zeros((len(rows), n_candidates), dtype=bool)
+            for i, query_rows in enumerate(rows):
+                candidates[i, : len(query_rows)] = self._matrix[query_rows]
+                mask[i, : len(query_rows)] = True
+            documents = [
+                [self._document(row) for row in query_rows] for query_rows in rows
+            ]
+        selected = batched_mmr(
+            normalize(np.asarray(embeddings, dtype=np.float32)),
+            candidates,
+            k=k,
+            lambda_mult=lambda_mult,
+            mask=mask,
+        )
+        return [
+            [query_documents[i] for i in query_selected if i >= 0]
+            for query_documents, query_selected in zip(documents, selected.tolist())
+        ]
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """Return documents selected with maximal marginal relevance."""
+        return self.max_marginal_relevance_search_by_vectors(
+            [embedding], k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        )[0]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        """Return documents selected with maximal marginal relevance."""
+        embedding = self._embedding_function.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(
+            embedding, k, fetch_k=fetch_k, lambda_mult=lambda_mult, **kwargs
+        )
+
+    def max_marginal_relevance_search_batch(
+        self,
+        queries: List[str],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+    ) -> List[List[Document]]:
+        """Return documents selected with maximal marginal relevance for each query."""
+        embeddings = [self._embedding_function.embed_query(query) for query in queries]
+        return self.max_marginal_relevance_search_by_vectors(
+            embeddings, k, fetch_k=fetch_k, lambda_mult=lambda_mult
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        persist_path: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        """Create a store from texts."""
+        vector_store = cls(embedding, persist_path=persist_path, **kwargs)
+        vector_store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return vector_store
+
+    # Persistence
+
+    def persist(self) -> None:
+        """Persist a new generation of the store to `persist_path`."""
+        if self._persist_path is None:
+            raise ValueError(
+                "You must specify a persist_path on creation to persist the collection."
+            )
+        with self._lock:
+            self._generation = write_store_files(
+                self._persist_path,
+                self._matrix,
+                self._ids,
+                self._texts,
+                self._metadatas,
+                deleted_rows=np.flatnonzero(self._deleted[: self._size]).tolist(),
+                index_metadata=self.index_metadata,
+                write_index=self._persist_index,
+            )
+
+    def _persist_index(self, generation: int) -> None:
+        """Hook for index backends to persist their own structures."""
+
+    def reload(self) -> bool:
+        """Load the latest persisted generation if another process wrote a newer one."""
+        if self._persist_path is None:
+            return False
+        if read_generation(self._persist_path) <= self._generation:
+            return False
+        self._load()
+        return True
+
+    def _load(self) -> None:
+        generation = read_generation(self._persist_path)
+        buffer = np.load(
+            os.path.join(
+                self._persist_path, EMBEDDINGS_FILE.format(generation=generation)
+            ),
+            mmap_mode="r",
+        )
+        with open(
+            os.path.join(
+                self._persist_path, DOCUMENTS_FILE.format(generation=generation)
+            ),
+            "rb",
+        ) as f:
+            documents = json.loads(f.read())
+        if len(documents["ids"]) != buffer.shape[0]:
+            raise ValueError(
+                f"Corrupted vector store at {self._persist_path}: "
+                f"{buffer.shape[0]} embeddings for {len(documents['ids'])} documents"
+            )
+        deleted = np.zeros(buffer.shape[0], dtype=bool)
+        deleted[documents["deleted_rows"]] = True
+        with self._lock:
+            self._buffer = buffer
+            self._size = buffer.shape[0]
+            self._deleted = deleted
+            self._ids = documents["ids"]
+            self._texts = documents["texts"]
+            self._metadatas = documents["metadatas"]
+            self._id_to_row = {
+                id_: row for row, id_ in enumerate(self._ids) if not deleted[row]
+            }
+            self.index_metadata = documents["index_metadata"]
+            self._generation = generation
+            self._version += 1
+            self._load_index(generation)
+
+    def _load_index(self, generation: int) -> None:
+        """Hook for index backends to load their own structures."""
@@ -0,0 +1,75 @@
+"""Reference mode of the retrieved documents.
+
+A `retrieve_docs` ToolMessage carries the formatted documents in its `content` and,
+in reference mode, only their ids in its `artifact` (`{"doc_refs": [...]}`) instead
+of the full Document list. Clients keep the ids and send the tool message back with
+an empty content; `resolve_references` rebuilds it from the vector store.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.documents import Document
+from langchain_core.messages import ToolMessage
+
+DOC_REFS_KEY = "doc_refs"
+
+
+def reference_artifact(docs: Sequence[Document]) -> Optional[Dict[str, List[str]]]:
+    """Artifact referring to documents by id, None if some document has no id."""
+    if not all(doc.id for doc in docs):
+        return None
+    return {DOC_REFS_KEY: [doc.id for doc in docs]}
+
+
+def referenced_ids(artifact: Any) -> Optional[List[str]]:
+    """Ids of a reference artifact, None if the artifact holds something else."""
+    if isinstance(artifact, dict) and isinstance(artifact.get(DOC_REFS_KEY), list):
+        return artifact[DOC_REFS_KEY]
+    return None
+
+
+def resolve_references(
+    messages: List[Any],
+    get_by_ids: Callable[[List[str]], List[Document]],
+    format_docs: Callable[[List[Document]], str],
+) -> List[Any]:
+    """
+    Rebuild the content of the tool messages sent back with document ids only.
+
+    Args:
+        messages (List[Any]): The conversation, as messages or message dicts.
+        get_by_ids (Callable[[List[str]], List[Document]]): Resolves ids, e.g. the
+            `get_by_ids` method of the vector store. Only called if needed.
+        format_docs (Callable[[List[Document]], str]): Formats the documents as in
+            the original tool message.
+
+    Returns:
+        List[Any]: The conversation, with the referenced documents in the content of
+            the tool messages.
+    """
+    resolved = []
+    for message in messages:
+        is_dict = isinstance(message, dict)
+        if is_dict and message.get("type") == "tool":
+            content, artifact = message.get("content"), message.get("artifact")
+        elif isinstance(message, ToolMessage):
+            content, artifact = message.content, message.artifact
+        else:
+            resolved.append(message)
+            continue
+        ids = referenced_ids(artifact)
+        if content or not ids:
+            resolved.append(message)
+            continue
+        docs = get_by_ids(ids)
+        if len(docs) < len(ids):
+            logging.warning(
+                f"{len(ids) - len(docs)} referenced documents are no longer indexed"
+            )
+        content = format_docs(docs)
+        resolved.append(
+            {**message, "content": content}
+            if is_dict
+            else message.model_copy(update={"content": content})
+        )
+    return resolved
@@ -0,0 +1,418 @@
+"""Local routing stage deciding between `retrieve_docs` and `should_continue`.
+
+The conversation inspection is a full LLM round-trip. Routers try a cheap local
+decision first and only defer to the LLM when they are uncertain:
+    - HeuristicRouter: greetings/acknowledgements vs self-contained questions,
+    - CentroidRouter: similarity of the question to the corpus centroid,
+    - LogisticRouter: logistic regression on embeddings of logged LLM decisions.
+
+The logistic router is trained offline, as embedding the decision log takes one
+embedding call per logged question:
+    python -m app.patterns.custom_rag_qa.router --decision-log .router_decisions.jsonl
+
+The decision log holds the questions of the users in plain text, so the chain only
+writes it when enabled.
+
+Every decision records its latency and whether it fell back to the LLM in the
+`router_*` metrics.
+"""
+from abc import ABC, abstractmethod
+import argparse
+import asyncio
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import uuid
+
+from app.utils.metrics import metrics
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, BaseMessage, convert_to_messages
+from langchain_core.runnables import Runnable
+from langchain_ollama import OllamaEmbeddings
+import numpy as np
+
+RETRIEVE = "retrieve_docs"
+CONTINUE = "should_continue"
+# The decision log is rotated to "<path>.1" beyond this size
+DECISION_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+decision_seconds = metrics.histogram(
+    "router_decision_seconds", "Latency of routing decisions by source"
+)
+decisions_total = metrics.counter(
+    "router_decisions_total", "Routing decisions by source (local or llm) and tool"
+)
+fallback_rate = metrics.gauge(
+    "router_fallback_rate", "Fraction of routing decisions deferred to the LLM"
+)
+
+
+@dataclass
+class RouteDecision:
+    """A routing decision. `tool` is None when the router is uncertain."""
+
+    tool: Optional[str] = None
+    args: Dict[str, Any] = field(default_factory=dict)
+    confidence: float = 0.0
+
+
+def last_user_message(messages: Sequence[Any]) -> str:
+    """Content of the last human message of a conversation."""
+    for message in reversed(convert_to_messages(list(messages))):
+        if message.type == "human" and isinstance(message.content, str):
+            return message.content
+    return ""
+
+
+class Router(ABC):
+    """Base class of local routers."""
+
+    name = "router"
+
+    @abstractmethod
+    async def aroute(self, messages: Sequence[BaseMessage]) -> RouteDecision:
+        """Decide on the next tool, or return an uncertain decision."""
+
+
+class HeuristicRouter(Router):
+    """Rule based router for the obvious cases."""
+
+    name = "heuristic"
+
+    _SMALL_TALK = re.compile(
+        r"^\s*(?:hi|hello|hey|thanks?|thank you|ok(?:ay)?|great|cool|bye|goodbye|"
+        r"good (?:morning|afternoon|evening)|got it|perfect|nice)\b[\s!.,]*$",
+        re.IGNORECASE,
+    )
+    _QUESTION = re.compile(
+        r"\?|^\s*(?:how|what|why|when|where|which|who|explain|describe|compare|"
+        r"list|define|tell me)\b",
+        re.IGNORECASE,
+    )
+    # Follow-ups need the conversation to be rewritten into a search query
+    _REFERENCE = re.compile(
+        r"\b(?:it|its|this|that|these|those|they|them|he|she|above|previous|more)\b",
+        re.IGNORECASE,
+    )
+
+    async def aroute(self, messages: Sequence[BaseMessage]) -> RouteDecision:
+        text = last_user_message(messages)
+        if self._SMALL_TALK.match(text):
+            return RouteDecision(CONTINUE, confidence=1.0)
+        is_follow_up = len(messages) > 1 and self._REFERENCE.search(text)
+        if self._QUESTION.search(text) and not is_follow_up:
+            return RouteDecision(RETRIEVE, {"query": text}, confidence=0.9)
+        return RouteDecision()
+
+
+class CentroidRouter(Router):
+    """Retrieve when the question is close enough to the corpus centroid."""
+
+    name = "centroid"
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        centroid: np.ndarray,
+        retrieve_threshold: float = 0.6,
+        continue_threshold: float = 0.3,
+    ) -> None:
+        """
+        Initialize the router.
+
+        Args:
+            embedding (Embeddings): The model that embedded the corpus.
+            centroid (np.ndarray): Mean of the normalized corpus embeddings.
+            retrieve_threshold (float): Similarity above which documents are retrieved.
+            continue_threshold (float): Similarity below which nothing is retrieved.
+        """
+        self.embedding = embedding
+        self.centroid = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.retrieve_threshold = retrieve_threshold
+        self.continue_threshold = continue_threshold
+
+    async def aroute(self, messages: Sequence[BaseMessage]) -> RouteDecision:
+        text = last_user_message(messages)
+        vector = np.asarray(await self.embedding.aembed_query(text), dtype=np.float32)
+        similarity = float(vector @ self.centroid / (np.linalg.norm(vector) or 1.0))
+        if similarity >= self.retrieve_threshold:
+            return RouteDecision(RETRIEVE, {"query": text}, confidence=similarity)
+        if similarity <= self.continue_threshold:
+            return RouteDecision(CONTINUE, confidence=1.0 - similarity)
+        return RouteDecision(confidence=similarity)
+
+
+class LogisticRouter(Router):
+    """Logistic regression on question embeddings, trained from logged decisions."""
+
+    name = "logistic"
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        weights: np.ndarray,
+        bias: float,
+        margin: float = 0.2,
+    ) -> None:
+        """
+        Initialize the router.
+
+        Args:
+            embedding (Embeddings): The model embedding questions.
+            weights (np.ndarray): Weights of the model, see `fit`.
+            bias (float): Bias of the model.
+            margin (float): Decisions with a probability within `margin` of 0.5 are
+                deferred to the LLM.
+        """
+        self.embedding = embedding
+        self.weights = weights
+        self.bias = bias
+        self.margin = margin
+
+    @staticmethod
+    def fit(
+        vectors: np.ndarray,
+        labels: np.ndarray,
+        l2: float = 1e-3,
+        learning_rate: float = 0.5,
+        iterations: int = 500,
+    ) -> Tuple[np.ndarray, float]:
+        """
+        Fit logistic regression weights by gradient descent.
+
+        Args:
+            vectors (np.ndarray): Normalized question embeddings, shape (n, dim).
+            labels (np.ndarray): 1 where documents were retrieved, 0 otherwise.
+
+        Returns:
+            Tuple[np.ndarray, float]: The weights and the bias.
+        """
+        weights, bias = np.zeros(vectors.shape[1]), 0.0
+        for _ in range(iterations):
+            probabilities = 1.0 / (1.0 + np.exp(-(vectors @ weights + bias)))
+            error = probabilities - labels
+            weights -= learning_rate * (vectors.T @ error / len(labels) + l2 * weights)
+            bias -= learning_rate * float(error.mean())
+        return weights, bias
+
+    @classmethod
+    def from_decision_log(
+        cls, path: str, embedding: Embeddings, margin: float = 0.2
+    ) -> Optional["LogisticRouter"]:
+        """Train a router from a DecisionLog file, None if it has too few examples."""
+        paths = [p for p in DecisionLog(path).paths if os.path.isfile(p)]
+        if not paths:
+            return None
+        records = []
+        for log_path in paths:
+            with open(log_path, encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+        labels = np.array([record["tool"] == RETRIEVE for record in records], float)
+        if len(records) < 20 or labels.min() == labels.max():
+            logging.info(f"Not enough logged decisions in {path} to train a router")
+            return None
+        vectors = np.asarray(
+            embedding.embed_documents([record["text"] for record in records])
+        )
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True).clip(1e-12)
+        weights, bias = cls.fit(vectors, labels)
+        return cls(embedding, weights, bias, margin)
+
+    def save(self, path: str) -> None:
+        """Write the weights of the model to a .npz file."""
+        with open(path, "wb") as f:
+            np.savez(f, weights=self.weights, bias=self.bias)
+
+    @classmethod
+    def load(
+        cls, path: str, embedding: Embeddings, margin: float = 0.2
+    ) -> "LogisticRouter":
+        """Read a router written by `save`."""
+        with np.load(path) as data:
+            return cls(embedding, data["weights"], float(data["bias"]), margin)
+
+    async def aroute(self, messages: Sequence[BaseMessage]) -> RouteDecision:
+        text = last_user_message(messages)
+        vector = np.asarray(await self.embedding.aembed_query(text))
+        vector /= np.linalg.norm(vector) or 1.0
+        probability = float(1.0 / (1.0 + np.exp(-(vector @ self.weights + self.bias))))
+        if probability >= 0.5 + self.margin:
+            return RouteDecision(RETRIEVE, {"query": text}, confidence=probability)
+        if probability <= 0.5 - self.margin:
+            return RouteDecision(CONTINUE, confidence=1.0 - probability)
+        return RouteDecision(confidence=probability)
+
+
+class ChainedRouter(Router):
+    """Ask routers in order, the first confident decision wins."""
+
+    name = "chained"
+
+    def __init__(self, routers: List[Router]) -> None:
+        self.routers = routers
+
+    async def aroute(self, messages: Sequence[BaseMessage]) -> RouteDecision:
+        for router in self.routers:
+            decision = await router.aroute(messages)
+            if decision.tool is not None:
+                return decision
+        return RouteDecision()
+
+
+class DecisionLog:
+    """
+    JSONL log of the LLM routing decisions, to train a LogisticRouter.
+
+    Once the log exceeds `max_bytes` it is moved to "<path>.1", replacing the
+    previous one, so at most about twice `max_bytes` are kept on disk.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DECISION_LOG_MAX_BYTES) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def paths(self) -> List[str]:
+        """The rotated and the current log files, oldest first."""
+        return [f"{self.path}.1", self.path]
+
+    def append(self, text: str, tool: str) -> None:
+        """Record the tool the LLM chose for a question."""
+        line = json.dumps({"text": text, "tool": tool}) + "\n"
+        with self._lock:
+            if (
+                os.path.isfile(self.path)
+                and os.path.getsize(self.path) >= self.max_bytes
+            ):
+                os.replace(self.path, f"{self.path}.1")
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    async def aappend(self, text: str, tool: str) -> None:
+        """Record a decision without blocking the event loop."""
+        await asyncio.to_thread(self.append, text, tool)
+
+
+def get_router(
+    kind: str,
+    embedding: Embeddings,
+    vector_store: Any = None,
+    model_path: Optional[str] = None,
+) -> Optional[Router]:
+    """
+    Build the local router of a given kind.
+
+    Args:
+        kind (str): "llm" (no local router), "heuristic", "centroid" or "logistic".
+            Embedding based routers are chained after the heuristic one.
+        embedding (Embeddings): The embedding model of the corpus.
+        vector_store (Any): The store providing the corpus centroid (`centroid()`).
+        model_path (Optional[str]): The "logistic" model trained offline, the
+            heuristic router is used alone until it exists.
+    """
+    if kind == "llm":
+        return None
+    routers: List[Router] = [HeuristicRouter()]
+    if kind == "centroid":
+        centroid = vector_store.centroid()
+        if centroid is not None:
+            routers.append(CentroidRouter(embedding, centroid))
+        else:
+            logging.info("No documents to compute the corpus centroid from")
+    elif kind == "logistic":
+        if model_path is not None and os.path.isfile(model_path):
+            routers.append(LogisticRouter.load(model_path, embedding))
+        else:
+            logging.info(f"No logistic router at {model_path}, see `router.main`")
+    elif kind != "heuristic":
+        raise ValueError(f"Unknown router '{kind}'")
+    return routers[0] if len(routers) == 1 else ChainedRouter(routers)
+
+
+def _update_fallback_rate() -> None:
+    local = sum(
+        decisions_total.value(source="local", tool=tool) for tool in (RETRIEVE, CONTINUE)
+    )
+    total = decisions_total.total()
+    fallback_rate.set((total - local) / total if total else 0.0)
+
+
+async def route(
+    router: Optional[Router],
+    inspect_conversation: Runnable,
+    input: Dict[str, Any],
+    decision_log: Optional[DecisionLog] = None,
+    on_fallback: Optional[Callable[[], None]] = None,
+) -> AIMessage:
+    """
+    Decide on the next tool call, locally if the router is confident, otherwise with
+    the inspection LLM.
+
+    Args:
+        router (Optional[Router]): The local router, None to always use the LLM.
+        inspect_conversation (Runnable): The LLM inspection chain.
+        input (Dict[str, Any]): The chain input, with the conversation "messages".
+        decision_log (Optional[DecisionLog]): Where LLM decisions are recorded, None
+            to not record them.
+        on_fallback (Optional[Callable[[], None]]): Called right before the LLM call,
+            e.g. to start work overlapping it.
+
+    Returns:
+        AIMessage: A message with the tool call, as returned by the inspection LLM.
+    """
+    start = time.perf_counter()
+    if router is not None:
+        decision = await router.aroute(input["messages"])
+        if decision.tool is not None:
+            decision_seconds.observe(time.perf_counter() - start, source="local")
+            decisions_total.inc(source="local", tool=decision.tool)
+            _update_fallback_rate()
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {
+                        "name": decision.tool,
+                        "args": decision.args,
+                        "id": f"call_{uuid.uuid4().hex}",
+                    }
+                ],
+            )
+
+    if on_fallback is not None:
+        on_fallback()
+    inspection_result = await inspect_conversation.ainvoke(input)
+    tool = inspection_result.tool_calls[0]["name"]
+    decision_seconds.observe(time.perf_counter() - start, source="llm")
+    decisions_total.inc(source="llm", tool=tool)
+    _update_fallback_rate()
+    if decision_log is not None:
+        await decision_log.aappend(last_user_message(input["messages"]), tool)
+    return inspection_result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Train the logistic router from the decision log, offline."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--decision-log", default=".router_decisions.jsonl")
+    parser.add_argument("--model-path", default=".router_logistic.npz")
+    parser.add_argument("--embedding-model", default="nomic-embed-text")
+    args = parser.parse_args(argv)
+
+    router = LogisticRouter.from_decision_log(
+        args.decision_log, OllamaEmbeddings(model=args.embedding_model)
+    )
+    if router is None:
+        raise SystemExit(f"Cannot train a router from {args.decision_log}")
+    router.save(args.model_path)
+    print(f"Logistic router written to {args.model_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,124 @@
+"""Speculative retrieval overlapping the inspection LLM call.
+
+While the inspection LLM decides on a tool call, documents are already retrieved
+for the last human message. If the LLM then asks to retrieve with a query that
+closely matches it, the speculative result is reused and the retrieval latency is
+hidden behind the inspection. Otherwise the speculative retrieval is cancelled (or
+its result discarded if it already completed). A failed speculative retrieval counts
+as a miss, the tool call then retrieves again.
+
+Metrics:
+    - speculative_retrievals_total{outcome}: "hit", "miss" (another query) or
+      "unused" (no retrieval needed),
+    - speculative_saved_seconds: wall-clock time saved by each hit,
+    - speculative_wasted_ratio: fraction of speculative retrievals not reused.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.patterns.custom_rag_qa.bm25 import tokenize
+from app.utils.metrics import metrics
+from langchain_core.documents import Document
+
+speculations_total = metrics.counter(
+    "speculative_retrievals_total", "Speculative retrievals by outcome"
+)
+saved_seconds = metrics.histogram(
+    "speculative_saved_seconds", "Wall-clock time saved by speculative retrievals"
+)
+wasted_ratio = metrics.gauge(
+    "speculative_wasted_ratio", "Fraction of speculative retrievals not reused"
+)
+
+
+def queries_match(speculative_query: str, query: str, threshold: float) -> bool:
+    """Whether two queries share at least `threshold` of their terms (Jaccard)."""
+    speculative_terms, terms = set(tokenize(speculative_query)), set(tokenize(query))
+    if not speculative_terms or not terms:
+        return speculative_query.strip().lower() == query.strip().lower()
+    overlap = len(speculative_terms & terms) / len(speculative_terms | terms)
+    return overlap >= threshold
+
+
+class SpeculativeRetrieval:
+    """A retrieval started before knowing whether, and with which query, it is needed."""
+
+    def __init__(
+        self,
+        retrieve: Callable[[str], Awaitable[List[Document]]],
+        query: str,
+        threshold: float = 0.8,
+    ) -> None:
+        """
+        Initialize the speculation, `start()` launches it.
+
+        Args:
+            retrieve (Callable[[str], Awaitable[List[Document]]]): The retrieval.
+            query (str): The speculative query, e.g. the last human message.
+            threshold (float): Minimum term overlap for the result to be reused.
+        """
+        self.retrieve = retrieve
+        self.query = query
+        self.threshold = threshold
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = 0.0
+        self._finished_at: Optional[float] = None
+
+    def start(self) -> None:
+        """Start retrieving in the background."""
+        if self._task is None and self.query:
+            self._started_at = time.perf_counter()
+            self._task = asyncio.create_task(self.retrieve(self.query))
+            self._task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._finished_at = time.perf_counter()
+        # Retrieve the exception of a failed speculation that is never awaited, e.g.
+        # after `cancel()`, so that asyncio does not log it as never retrieved
+        if not task.cancelled():
+            task.exception()
+
+    async def resolve(self, tool_call: Dict[str, Any]) -> Optional[List[Document]]:
+        """
+        Return the speculative documents if they answer the tool call, otherwise
+        cancel the speculation and return None. None is also returned if the
+        speculative retrieval failed.
+        """
+        task, self._task = self._task, None
+        if task is None:
+            return None
+        query = tool_call["args"].get("query", "")
+        if tool_call["name"] == "retrieve_docs" and queries_match(
+            self.query, query, self.threshold
+        ):
+            # Time already spent retrieving when the tool call arrived
+            decided_at = time.perf_counter()
+            try:
+                documents = await task
+            except Exception as e:
+                logging.warning(f"Speculative retrieval failed, retrying it: {e}")
+                self._record("miss")
+                return None
+            saved_seconds.observe(
+                min(decided_at, self._finished_at or decided_at) - self._started_at
+            )
+            self._record("hit")
+            return documents
+        task.cancel()
+        self._record("miss" if tool_call["name"] == "retrieve_docs" else "unused")
+        return None
+
+    def cancel(self) -> None:
+        """Cancel a speculation whose result will never be resolved."""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            self._record("unused")
+
+    @staticmethod
+    def _record(outcome: str) -> None:
+        speculations_total.inc(outcome=outcome)
+        total = speculations_total.total()
+        wasted_ratio.set(1.0 - speculations_total.value(outcome="hit") / total)
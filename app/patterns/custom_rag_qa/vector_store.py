@@ -1,39 +1,169 @@
 import logging
 import os
-from typing import List
+from typing import Callable, Dict, List, Optional
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
+from app.patterns.custom_rag_qa.bm25 import BM25Index
+from app.patterns.custom_rag_qa.indexing import COMPACTION_THRESHOLD, reindex
+from app.patterns.custom_rag_qa.ingestion import (
+    default_text_splitter,
+    ingest,
+    iter_chunks,
+    iter_pdf_pages,
+)
+from app.patterns.custom_rag_qa.ivf_store import IVFVectorStore
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore, migrate_sklearn_json
 from langchain_community.vectorstores import SKLearnVectorStore
 from langchain_core.documents import Document
 from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
 
+# Location of the legacy SKLearnVectorStore JSON file
 PERSIST_PATH = ".persist_vector_store"
 URL = "https://services.google.com/fh/files/misc/practitioners_guide_to_mlops_whitepaper.pdf"
 
+# Available index backends. Each one is built with `(embedding=..., persist_path=...)`
+# and must support `persist()` and the `as_retriever(search_type="mmr")` contract.
+VECTOR_STORE_BACKENDS: Dict[str, Callable[..., VectorStore]] = {
+    "numpy": NumpyVectorStore,
+    "ivf": IVFVectorStore,
+    "sklearn": SKLearnVectorStore,
+}
+DEFAULT_BACKEND = "numpy"
+# Backends sharing the memory-mapped NumPy layout (see numpy_store.py)
+MEMMAP_BACKENDS = ("numpy", "ivf")
+
+# BM25 index file, inside the directory of memmap-backed stores
+LEXICAL_INDEX_FILE = "bm25.json"
+
+# Backends persist in different formats, so each one gets its own default location
+DEFAULT_PERSIST_PATHS = {
+    "numpy": f"{PERSIST_PATH}_numpy",
+    "ivf": f"{PERSIST_PATH}_ivf",
+    "sklearn": PERSIST_PATH,
+}
+
 
 def load_and_split_documents(url: str) -> List[Document]:
     """Load and split documents from a given URL."""
-    loader = PyPDFLoader(url)
-    documents = loader.load()
-    logging.info(f"# of documents loaded (pre-chunking) = {len(documents)}")
-
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    doc_splits = text_splitter.split_documents(documents)
+    doc_splits = list(iter_chunks(iter_pdf_pages([url]), default_text_splitter()))
     logging.info(f"# of documents after split = {len(doc_splits)}")
 
     return doc_splits
 
 
+def open_vector_store(
+    embedding: Embeddings,
+    persist_path: Optional[str] = None,
+    backend: str = DEFAULT_BACKEND,
+) -> VectorStore:
+    """
+    Open a (possibly empty) vector store, migrating the legacy JSON store if needed.
+
+    Args:
+        embedding (Embeddings): The embedding model used to index and query documents.
+        persist_path (Optional[str]): Where the store is persisted. Defaults to the
+            backend specific path in DEFAULT_PERSIST_PATHS.
+        backend (str): One of VECTOR_STORE_BACKENDS: "numpy" for exact search over a
+            memory-mapped matrix, "ivf" for an approximate nearest-neighbour index or
+            "sklearn" for the legacy JSON-persisted SKLearnVectorStore.
+
+    Returns:
+        VectorStore: The vector store.
+    """
+    if backend not in VECTOR_STORE_BACKENDS:
+        raise ValueError(
+            f"Unknown vector store backend '{backend}'. "
+            f"Available backends: {', '.join(VECTOR_STORE_BACKENDS)}"
+        )
+    persist_path = persist_path or DEFAULT_PERSIST_PATHS[backend]
+    if (
+        backend in MEMMAP_BACKENDS
+        and not os.path.exists(persist_path)
+        and os.path.isfile(PERSIST_PATH)
+    ):
+        logging.info(f"Migrating {PERSIST_PATH} to {persist_path}")
+        migrate_sklearn_json(PERSIST_PATH, persist_path)
+
+    return VECTOR_STORE_BACKENDS[backend](
+        embedding=embedding, persist_path=persist_path
+    )
+
+
 def get_vector_store(
-    embedding: Embeddings, persist_path: str = PERSIST_PATH, url: str = URL
-) -> SKLearnVectorStore:
-    """Get or create a vector store."""
-    vector_store = SKLearnVectorStore(embedding=embedding, persist_path=persist_path)
-
-    if not os.path.exists(persist_path):
-        doc_splits = load_and_split_documents(url=url)
-        vector_store.add_documents(documents=doc_splits)
+    embedding: Embeddings,
+    persist_path: Optional[str] = None,
+    url: str = URL,
+    backend: str = DEFAULT_BACKEND,
+    refresh: bool = False,
+) -> VectorStore:
+    """
+    Get or create a vector store.
+
+    Memory-mapped backends are built and refreshed incrementally (see indexing.py):
+    with `refresh`, only the chunks of `url` that changed since the last build are
+    embedded, and the chunks that disappeared are removed.
+
+    Args:
+        embedding (Embeddings): The embedding model used to index and query documents.
+        persist_path (Optional[str]): Where the store is persisted. Defaults to the
+            backend specific path in DEFAULT_PERSIST_PATHS.
+        url (str): The PDF to index when no persisted store exists.
+        backend (str): One of VECTOR_STORE_BACKENDS, see `open_vector_store`.
+        refresh (bool): Whether to bring an existing store up to date with `url`.
+
+    Returns:
+        VectorStore: The loaded or newly built vector store.
+    """
+    persist_path = persist_path or DEFAULT_PERSIST_PATHS.get(backend)
+    vector_store = open_vector_store(embedding, persist_path, backend)
+
+    if backend in MEMMAP_BACKENDS:
+        if refresh or not os.path.exists(persist_path):
+            # Compact synchronously, a background compaction would finish after
+            # the store is persisted and leave the tombstones on disk
+            stats = reindex(vector_store, [url], compaction_threshold=None)
+            if stats.sources_changed or stats.sources_removed:
+                if vector_store.tombstone_ratio > COMPACTION_THRESHOLD:
+                    vector_store.compact()
+                vector_store.persist()
+                # Build the lexical index along with the vector index
+                get_lexical_index(vector_store, persist_path, backend)
+    elif not os.path.exists(persist_path):
+        ingest([url], vector_store)
         vector_store.persist()
 
     return vector_store
+
+
+def get_lexical_index(
+    vector_store: NumpyVectorStore,
+    persist_path: Optional[str] = None,
+    backend: str = DEFAULT_BACKEND,
+) -> BM25Index:
+    """
+    Load the BM25 index persisted with a vector store, bringing it up to date with
+    the store (and persisting it) if documents were added or removed since.
+
+    Args:
+        vector_store (NumpyVectorStore): The store whose documents are indexed.
+        persist_path (Optional[str]): Where the store is persisted. Defaults to the
+            backend specific path in DEFAULT_PERSIST_PATHS.
+        backend (str): One of MEMMAP_BACKENDS.
+
+    Returns:
+        BM25Index: The lexical index.
+    """
+    if backend not in MEMMAP_BACKENDS:
+        raise ValueError(
+            f"Lexical indexing requires one of the {', '.join(MEMMAP_BACKENDS)} "
+            f"backends, got '{backend}'"
+        )
+    persist_path = persist_path or DEFAULT_PERSIST_PATHS[backend]
+    index_path = os.path.join(persist_path, LEXICAL_INDEX_FILE)
+    lexical_index = (
+        BM25Index.load(index_path) if os.path.isfile(index_path) else BM25Index()
+    )
+    if lexical_index.sync(vector_store) and os.path.isdir(persist_path):
+        lexical_index.save(index_path)
+        logging.info(f"Indexed {len(lexical_index)} documents in {index_path}")
+    return lexical_index
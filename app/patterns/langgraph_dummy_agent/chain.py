@@ -1,9 +1,9 @@
 from typing import Dict
 
+from app.utils.model_clients import chat_model
 from langchain_core.messages import BaseMessage
-from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.tools import tool
-from langchain_ollama import ChatOllama
 from langgraph.graph import END, MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode
 
@@ -19,9 +19,7 @@ def search(query: str) -> str:
 tools = [search]
 
 # 2. Set up the language model
-llm = ChatOllama(
-    model="llama3-groq-tool-use:latest", temperature=0
-).bind_tools(tools)
+llm = chat_model("llama3-groq-tool-use:latest", temperature=0).bind_tools(tools)
 
 # 3. Define workflow components
 def should_continue(state: MessagesState) -> str:
@@ -39,9 +37,22 @@ def call_model(state: MessagesState, config: RunnableConfig) -> Dict[str, BaseMe
     response = llm.invoke(messages_with_system, config)
     return {"messages": response}
 
+async def acall_model(
+    state: MessagesState, config: RunnableConfig
+) -> Dict[str, BaseMessage]:
+    """Async version of `call_model`, cancelled with the run that awaits it."""
+    system_message = "You are a helpful AI assistant."
+    messages_with_system = [{"type": "system", "content": system_message}] + state[
+        "messages"
+    ]
+    response = await llm.ainvoke(messages_with_system, config)
+    return {"messages": response}
+
 # 4. Create the workflow graph
 workflow = StateGraph(MessagesState)
-workflow.add_node("agent", call_model)
+# Async runs of the graph await the model instead of calling it in a thread, so
+# that cancelling the run stops the model call
+workflow.add_node("agent", RunnableLambda(call_model, afunc=acall_model))
 workflow.add_node("tools", ToolNode(tools))
 workflow.set_entry_point("agent")
 
@@ -1,22 +1,44 @@
-import json
+from contextlib import asynccontextmanager
 import logging
-from typing import AsyncGenerator
+import os
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, Optional
 import uuid
 
-from app import chain
-from app.utils.input_types import Feedback, Input, InputChat, default_serialization
+from app.utils.admission import AdmissionController, AdmissionRejected, Ticket
+from app.utils.chain_registry import ChainRegistry
+from app.utils.chain_run import ChainRun
+from app.utils.coalescing import coalesce_chunks
+from app.utils.compression import compress_stream, negotiate_encoding
+from app.utils.event_projection import SUPPORTED_RUN_TYPES, project_event
+from app.utils.input_types import Feedback, Input, InputChat
+from app.utils.metrics import metrics
+from app.utils.model_clients import model_clients
 from app.utils.output_types import EndEvent, Event
-from fastapi import FastAPI
-from fastapi.responses import RedirectResponse, StreamingResponse
+from app.utils.serialization import get_serializer
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
-# Default chain
-from app.chain import chain
+STARTED_AT = time.perf_counter()
 
-# Custom RAG QA
-# from app.patterns.custom_rag_qa.chain import chain
+# Chains served at /chains/{name}/stream_events, loaded on first request. See
+# CHAINS in chain_registry: "default", "custom_rag_qa" or "langgraph_dummy_agent"
+registry = ChainRegistry()
 
-# LangGraph dummy agent
-# from app.patterns.langgraph_dummy_agent.chain import chain
+# Chain served at /stream_events, loaded at import
+DEFAULT_CHAIN = "default"
+chain = registry.get(DEFAULT_CHAIN)
+
+# Chains whose resources (models, vector stores...) are built at startup rather
+# than on their first request, overridden by the comma separated WARM_UP_CHAINS
+# environment variable (empty to build everything on first request)
+WARM_UP_CHAINS = [
+    name.strip()
+    for name in os.environ.get("WARM_UP_CHAINS", "custom_rag_qa").split(",")
+    if name.strip()
+]
 
 # The events that are supported by the UI Fronted
 SUPPORTED_EVENTS = [
@@ -27,26 +49,111 @@ SUPPORTED_EVENTS = [
     "on_chat_model_stream",
 ]
 
+# Serializer of the streamed events: "auto", "orjson", "msgspec", "pydantic" or "json"
+EVENT_SERIALIZER = "auto"
+serialize = get_serializer(EVENT_SERIALIZER)
+END_EVENT_LINE = serialize(EndEvent())
+
+# Consecutive model chunks are merged for up to COALESCE_WINDOW seconds or until
+# COALESCE_MAX_BYTES of text, a window of 0 streams every chunk on its own
+COALESCE_WINDOW = 0.03
+COALESCE_MAX_BYTES = 1024
+
+# Compress the stream when the client accepts it (zstd, br or gzip), flushed after
+# every event
+STREAM_COMPRESSION = True
+
+# Admission control: streams running at once, streams waiting for a slot (beyond
+# which requests get a 429), and running or queued streams per user and session
+ADMISSION_MAX_CONCURRENCY = 16
+ADMISSION_MAX_QUEUE = 64
+ADMISSION_MAX_PER_USER = 4
+ADMISSION_MAX_PER_SESSION = 2
+admission = AdmissionController(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    max_queue=ADMISSION_MAX_QUEUE,
+    max_per_user=ADMISSION_MAX_PER_USER,
+    max_per_session=ADMISSION_MAX_PER_SESSION,
+)
+
+startup_seconds = metrics.gauge(
+    "server_startup_seconds", "Time from the server import to the app startup"
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Warm up the chains and record the time taken to start the server, then close
+    the model connection pools on shutdown.
+    """
+    for name in WARM_UP_CHAINS:
+        if name not in registry.names():
+            logging.warning(f"Cannot warm up chain '{name}', it is not served")
+            continue
+        try:
+            await run_in_threadpool(registry.warm_up, name)
+        except Exception:
+            # The resources are built on the first request instead
+            logging.exception(f"Failed to warm up chain '{name}'")
+    startup_seconds.set(time.perf_counter() - STARTED_AT)
+    yield
+    await model_clients.aclose()
+
+
 # Initialize FastAPI app and logging
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 logger = logging.basicConfig(level=logging.INFO)
 
 
-async def stream_event_response(input_chat: InputChat) -> AsyncGenerator[str, None]:
-    """"Stream events in response to an input chat."""
+def select_event(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The projected event to stream, None for unsupported events."""
+    return project_event(data) if data["event"] in SUPPORTED_EVENTS else None
+
+
+async def stream_event_response(
+    input_chat: InputChat,
+    runnable: Optional[Any] = None,
+    ticket: Optional[Ticket] = None,
+    run: Optional[ChainRun] = None,
+) -> AsyncGenerator[bytes, None]:
+    """
+    Stream events in response to an input chat, from `runnable` or `chain`. With an
+    admission `ticket`, the chain only runs once it gets a slot, and the slot is
+    released at the end of the stream. The chain `run` is cancelled if the stream
+    is closed before its end, e.g. when the client disconnects.
+    """
+    if runnable is None:
+        runnable = chain
+    if run is None:
+        run = ChainRun(select=select_event)
     run_id = uuid.uuid4()
     input_dict = input_chat.model_dump()
 
-    yield json.dumps(
-        Event(event="metadata", data={"run_id": str(run_id)}),
-        default=default_serialization,
-    ) + "\n"
+    try:
+        metadata: Dict[str, Any] = {"run_id": str(run_id)}
+        if ticket is not None and ticket.queued:
+            metadata["queue_position"] = ticket.position
+        yield serialize(Event(event="metadata", data=metadata))
+        if ticket is not None:
+            await ticket.wait()
 
-    async for data in chain.astream_events(input_dict, version="v2"):
-        if data["event"] in SUPPORTED_EVENTS:
-            yield json.dumps(data, default=default_serialization) + "\n"
+        run.start(
+            runnable.astream_events(
+                input_dict, version="v2", include_types=SUPPORTED_RUN_TYPES
+            )
+        )
+        events = run.events()
+        if COALESCE_WINDOW > 0:
+            events = coalesce_chunks(events, COALESCE_WINDOW, COALESCE_MAX_BYTES)
+        async for event in events:
+            yield serialize(event)
+    finally:
+        run.cancel()
+        if ticket is not None:
+            ticket.release()
 
-    yield json.dumps(EndEvent(), default=default_serialization) + "\n" 
+    yield END_EVENT_LINE
 
 # Routes
 @app.get("/")
@@ -61,11 +168,96 @@ async def collect_feedback(feedback_dict: Feedback) -> None:
     logger.log_struct(feedback_dict.model_dump(), severity="INFO")
 
 
-@app.post("/stream_events")
-async def stream_chat_events(request: Input) -> StreamingResponse:
-    """Stream chat events in response to an input request."""
+@app.get("/metrics")
+async def get_metrics() -> PlainTextResponse:
+    """Expose the in-process metrics in the Prometheus text format."""
+    return PlainTextResponse(metrics.render())
+
+
+@app.get("/health")
+async def health() -> Dict[str, Any]:
+    """Startup time, load statistics of the chains and model client stats."""
+    return {
+        "status": "ok",
+        "startup_seconds": startup_seconds.value(),
+        "chains": registry.status(),
+        "model_clients": model_clients.stats(),
+    }
+
+
+def admit(input_chat: InputChat) -> Ticket:
+    """Admit a stream, or answer with a 429 if a limit is reached."""
+    try:
+        return admission.admit(input_chat.user_id, input_chat.session_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429, detail=str(e), headers={"Retry-After": "1"}
+        ) from e
+
+
+def close_stream(ticket: Ticket, run: ChainRun) -> None:
+    """Release the slot of a stream and cancel its chain run if still going."""
+    run.cancel()
+    ticket.release()
+
+
+def event_stream_response(
+    stream: AsyncGenerator[bytes, None],
+    http_request: Request,
+    ticket: Ticket,
+    run: ChainRun,
+) -> StreamingResponse:
+    """
+    Stream events, compressed if the client accepts it. When the client
+    disconnects, Starlette stops iterating the stream and the chain run is
+    cancelled once the response is closed.
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = None
+    if STREAM_COMPRESSION:
+        encoding = negotiate_encoding(http_request.headers.get("accept-encoding"))
+    if encoding is not None:
+        stream = compress_stream(stream, encoding)
+        headers["Content-Encoding"] = encoding
     return StreamingResponse(
-        stream_event_response(input_chat=request.input), media_type="text/event-stream"
+        stream,
+        media_type="text/event-stream",
+        headers=headers,
+        # Runs once the response is closed, including on client disconnects
+        background=BackgroundTask(close_stream, ticket, run),
+    )
+
+
+@app.post("/stream_events")
+async def stream_chat_events(request: Input, http_request: Request) -> StreamingResponse:
+    """Stream chat events of the default chain in response to an input request."""
+    ticket, run = admit(request.input), ChainRun(select=select_event)
+    return event_stream_response(
+        stream_event_response(input_chat=request.input, ticket=ticket, run=run),
+        http_request,
+        ticket,
+        run,
+    )
+
+
+@app.post("/chains/{name}/stream_events")
+async def stream_named_chain_events(
+    name: str, request: Input, http_request: Request
+) -> StreamingResponse:
+    """Stream chat events of a registered chain, loaded on its first request."""
+    if name not in registry.names():
+        raise HTTPException(status_code=404, detail=f"Unknown chain '{name}'")
+    # Loading imports the chain module and may build its resources, keep it off
+    # the event loop
+    runnable = await run_in_threadpool(registry.get, name)
+    ticket, run = admit(request.input), ChainRun(select=select_event)
+    return event_stream_response(
+        stream_event_response(
+            input_chat=request.input, runnable=runnable, ticket=ticket, run=run
+        ),
+        http_request,
+        ticket,
+        run,
     )
 
 
@@ -0,0 +1,176 @@
+"""Admission control of the chain streams.
+
+At most `max_concurrency` streams run at once, the following ones wait in a bounded
+FIFO queue and are rejected once it is full. Each `user_id` and `session_id` is also
+limited to a number of running or queued streams, so that a single client cannot
+fill the queue. Rejected requests are answered with a 429 by the server.
+
+The controller lives on the event loop of the server and is not thread-safe.
+
+Metrics:
+    - admission_queue_seconds: time spent waiting for a slot,
+    - admission_rejections_total{reason}: "queue_full", "user_limit" or
+      "session_limit",
+    - admission_active_streams and admission_queued_streams.
+"""
+import asyncio
+from collections import Counter as CounterDict
+from collections import deque
+import time
+from typing import Deque, Optional
+
+from app.utils.metrics import metrics
+
+queue_seconds = metrics.histogram("admission_queue_seconds", "Time streams waited")
+rejections_total = metrics.counter(
+    "admission_rejections_total", "Streams rejected by admission control by reason"
+)
+active_streams = metrics.gauge("admission_active_streams", "Streams running")
+queued_streams = metrics.gauge(
+    "admission_queued_streams", "Streams waiting for a slot"
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a stream cannot be admitted."""
+
+    def __init__(self, reason: str, message: str) -> None:
+        super().__init__(message)
+        self.reason = reason
+
+
+class Ticket:
+    """A stream admitted by the controller, running or waiting for a slot."""
+
+    def __init__(
+        self,
+        controller: "AdmissionController",
+        user_id: str,
+        session_id: str,
+        waiter: Optional[asyncio.Future],
+        position: int,
+    ) -> None:
+        self.controller = controller
+        self.user_id = user_id
+        self.session_id = session_id
+        self.position = position
+        self._waiter = waiter
+        self._has_slot = waiter is None
+        self._released = False
+        self._created_at = time.perf_counter()
+
+    @property
+    def queued(self) -> bool:
+        """Whether the stream is still waiting for a slot."""
+        return not self._has_slot
+
+    async def wait(self) -> None:
+        """Wait until the stream gets a slot."""
+        if self._has_slot:
+            return
+        await self._waiter
+        self._has_slot = True
+        queue_seconds.observe(time.perf_counter() - self._created_at)
+
+    def release(self) -> None:
+        """Free the slot, or leave the queue. Safe to call more than once."""
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self)
+
+
+class AdmissionController:
+    """Global concurrency cap with a bounded queue and per user/session limits."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        max_queue: int = 64,
+        max_per_user: int = 4,
+        max_per_session: int = 2,
+    ) -> None:
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrency (int): Streams running at once.
+            max_queue (int): Streams waiting for a slot, beyond which they are
+                rejected.
+            max_per_user (int): Running or queued streams of a `user_id`.
+            max_per_session (int): Running or queued streams of a `session_id`.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_per_user = max_per_user
+        self.max_per_session = max_per_session
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._users: CounterDict = CounterDict()
+        self._sessions: CounterDict = CounterDict()
+
+    @property
+    def queued(self) -> int:
+        """Number of streams waiting for a slot."""
+        return len(self._waiters)
+
+    def admit(self, user_id: str = "", session_id: str = "") -> Ticket:
+        """
+        Admit a stream, giving it a slot or a place in the queue.
+
+        Empty ids are not limited.
+
+        Raises:
+            AdmissionRejected: If a limit is reached or the queue is full.
+        """
+        if user_id and self._users[user_id] >= self.max_per_user:
+            self._reject("user_limit", f"Too many concurrent streams for '{user_id}'")
+        if session_id and self._sessions[session_id] >= self.max_per_session:
+            self._reject(
+                "session_limit", f"Too many concurrent streams for '{session_id}'"
+            )
+        waiter = None
+        if self.active >= self.max_concurrency or self._waiters:
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue_full", "Too many streams waiting")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+        else:
+            self.active += 1
+        self._users[user_id] += 1
+        self._sessions[session_id] += 1
+        self._update_gauges()
+        return Ticket(self, user_id, session_id, waiter, len(self._waiters))
+
+    def _reject(self, reason: str, message: str) -> None:
+        rejections_total.inc(reason=reason)
+        raise AdmissionRejected(reason, message)
+
+    def _release(self, ticket: Ticket) -> None:
+        for counts, key in (
+            (self._users, ticket.user_id),
+            (self._sessions, ticket.session_id),
+        ):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+        waiter = ticket._waiter
+        granted = waiter is None or (waiter.done() and not waiter.cancelled())
+        if not granted:
+            # Left the queue (or was cancelled in it) before getting a slot
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        else:
+            # Hand the slot over to the next stream in the queue
+            self.active -= 1
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    self.active += 1
+                    break
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        active_streams.set(self.active)
+        queued_streams.set(len(self._waiters))
@@ -0,0 +1,77 @@
+"""A long-lived event loop in a background thread, for sync callers of async code.
+
+Running a coroutine from sync code with `asyncio.run` creates and tears down an
+event loop on every call, and async clients bound to a loop (e.g. connection
+pools) cannot be reused across calls. `BackgroundLoop` starts one loop in a daemon
+thread on first use and runs every coroutine on it, from any number of threads.
+"""
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class BackgroundLoop:
+    """An event loop running in a daemon thread, started on first use."""
+
+    def __init__(self, name: str = "background-loop") -> None:
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop, started if needed."""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run() -> None:
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coro: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        """
+        Run a coroutine on the loop and wait for its result.
+
+        Raises:
+            RuntimeError: If called from the loop itself, which would deadlock.
+            concurrent.futures.TimeoutError: If the result is not available within
+                `timeout` seconds, the coroutine is then cancelled.
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError(
+                f"Cannot wait for a coroutine from the '{self.name}' thread itself"
+            )
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            # Also stops the coroutine when the caller is interrupted
+            future.cancel()
+            raise
+
+    def stop(self) -> None:
+        """Stop the loop and wait for its thread, it restarts on next use."""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = self._thread = None
+        if loop is None or thread is None:
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+background_loop = BackgroundLoop()
@@ -0,0 +1,182 @@
+"""Registry of the chains served by the server, loaded on first use.
+
+Each chain is imported the first time it is requested and kept as a singleton, so
+one process can serve several patterns while only paying for the ones in use.
+Heavy resources shared by chains (e.g. vector stores) go through
+`shared_resources`, which creates them on first use and returns the same instance
+afterwards.
+
+Chain modules can define a `warm_up()` function building their resources ahead of
+the first request, called by `ChainRegistry.warm_up` (e.g. at server startup).
+
+The load time, warm-up time and resident memory growth of every chain are recorded
+in the `chain_load_seconds`, `chain_warm_up_seconds` and `chain_memory_bytes`
+metrics.
+"""
+from dataclasses import asdict, dataclass
+import importlib
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from app.utils.metrics import metrics
+
+# Import paths ("module:attribute") of the available chains
+CHAINS = {
+    "default": "app.chain:chain",
+    "custom_rag_qa": "app.patterns.custom_rag_qa.chain:chain",
+    "langgraph_dummy_agent": "app.patterns.langgraph_dummy_agent.chain:chain",
+}
+
+load_seconds = metrics.gauge("chain_load_seconds", "Time taken to load each chain")
+warm_up_seconds = metrics.gauge(
+    "chain_warm_up_seconds", "Time taken to build the resources of each chain"
+)
+memory_bytes = metrics.gauge(
+    "chain_memory_bytes", "Resident memory growth while loading each chain"
+)
+
+
+def rss_bytes() -> int:
+    """Resident set size of the process (peak size where it cannot be read)."""
+    try:
+        with open("/proc/self/statm", encoding="utf-8") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def import_object(path: str) -> Any:
+    """Import an object from a "module:attribute" path."""
+    module_name, _, attribute = path.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+@dataclass
+class ChainStats:
+    """Load statistics of a chain."""
+
+    load_seconds: float
+    memory_bytes: int
+    warm_up_seconds: float = 0.0
+
+
+class SharedResources:
+    """Lazily created resources, shared by key."""
+
+    def __init__(self) -> None:
+        self._resources: Dict[Hashable, Any] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return the resource of `key`, created with `factory` on first use."""
+        if key in self._resources:
+            return self._resources[key]
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        # Resources are created under their own lock, so that a slow factory does
+        # not block other resources
+        with lock:
+            if key not in self._resources:
+                self._resources[key] = factory()
+        return self._resources[key]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._resources
+
+
+shared_resources = SharedResources()
+
+
+class ChainRegistry:
+    """Named chains, loaded on first use and kept as singletons."""
+
+    def __init__(self, chains: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Initialize the registry.
+
+        Args:
+            chains (Optional[Dict[str, Any]]): Chain names mapped to an import path
+                ("module:attribute") or a function building the chain. Defaults to
+                CHAINS.
+        """
+        self._loaders: Dict[str, Any] = dict(CHAINS if chains is None else chains)
+        self._chains: Dict[str, Any] = {}
+        self.stats: Dict[str, ChainStats] = {}
+        # Chains are loaded one at a time so that memory growth is attributed to
+        # the right chain
+        self._lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        """Names of the registered chains."""
+        return list(self._loaders)
+
+    def register(self, name: str, loader: Any) -> None:
+        """Register a chain by import path or function building it."""
+        self._loaders[name] = loader
+
+    def is_loaded(self, name: str) -> bool:
+        """Whether a chain has already been loaded."""
+        return name in self._chains
+
+    def get(self, name: str) -> Any:
+        """
+        Return a chain, loading it on first use.
+
+        Raises:
+            KeyError: If no chain is registered under `name`.
+        """
+        if name in self._chains:
+            return self._chains[name]
+        loader = self._loaders[name]
+        with self._lock:
+            if name not in self._chains:
+                start, rss = time.perf_counter(), rss_bytes()
+                chain = loader() if callable(loader) else import_object(loader)
+                stats = ChainStats(
+                    load_seconds=time.perf_counter() - start,
+                    memory_bytes=max(rss_bytes() - rss, 0),
+                )
+                logging.info(f"Loaded chain '{name}' in {stats.load_seconds:.2f}s")
+                load_seconds.set(stats.load_seconds, chain=name)
+                memory_bytes.set(stats.memory_bytes, chain=name)
+                self.stats[name] = stats
+                self._chains[name] = chain
+        return self._chains[name]
+
+    def warm_up(self, name: str) -> None:
+        """Load a chain and call the `warm_up()` function of its module, if any."""
+        self.get(name)
+        loader = self._loaders[name]
+        if callable(loader):
+            return
+        module = importlib.import_module(loader.partition(":")[0])
+        warm_up = getattr(module, "warm_up", None)
+        if warm_up is None:
+            return
+        with self._lock:
+            start, rss = time.perf_counter(), rss_bytes()
+            warm_up()
+            stats = self.stats[name]
+            stats.warm_up_seconds = time.perf_counter() - start
+            stats.memory_bytes += max(rss_bytes() - rss, 0)
+        logging.info(f"Warmed up chain '{name}' in {stats.warm_up_seconds:.2f}s")
+        warm_up_seconds.set(stats.warm_up_seconds, chain=name)
+        memory_bytes.set(stats.memory_bytes, chain=name)
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        """Load status and statistics of every registered chain."""
+        return {
+            name: {
+                "loaded": name in self._chains,
+                **(asdict(self.stats[name]) if name in self.stats else {}),
+            }
+            for name in self._loaders
+        }
@@ -0,0 +1,110 @@
+"""Chain streams that can be cancelled when the client goes away.
+
+Starlette stops iterating a streaming response when the client disconnects, but
+the chain stream is then left suspended and the model keeps generating until it is
+garbage collected. `ChainRun` drives the stream in its own task, feeding a bounded
+queue, so that `cancel()` stops the run right away from anywhere: the task is
+cancelled and the chain stream closed, which cancels the LangChain run (model
+calls, graph steps, retrievals awaited by the chain).
+
+Tokens that cancelled runs did not generate are estimated from a rolling mean of
+the length of completed runs and counted in `chain_tokens_saved_total`.
+"""
+import asyncio
+from collections import deque
+import logging
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+from app.utils.metrics import metrics
+
+cancellations_total = metrics.counter(
+    "chain_runs_cancelled_total", "Chain runs cancelled before completion"
+)
+tokens_saved_total = metrics.counter(
+    "chain_tokens_saved_total",
+    "Estimated tokens not generated thanks to cancelled chain runs",
+)
+
+# Number of tokens streamed by the latest completed runs
+_completed_lengths: Deque[int] = deque(maxlen=100)
+_END = object()
+
+
+def expected_tokens() -> float:
+    """Mean number of tokens of the latest completed runs, 0 if none completed."""
+    if not _completed_lengths:
+        return 0.0
+    return sum(_completed_lengths) / len(_completed_lengths)
+
+
+class ChainRun:
+    """An `astream_events` stream driven by its own task."""
+
+    def __init__(
+        self,
+        select: Optional[Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = None,
+        max_buffered: int = 64,
+    ) -> None:
+        """
+        Initialize the run, `start()` launches it.
+
+        Args:
+            select (Optional[Callable]): Maps each event to the event to stream, or
+                None to drop it. Defaults to streaming every event.
+            max_buffered (int): Events buffered ahead of the consumer.
+        """
+        self.select = select
+        self.tokens = 0
+        self.completed = False
+        self.cancelled = False
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_buffered)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, stream: AsyncIterator[Dict[str, Any]]) -> None:
+        """Start driving a chain stream."""
+        self._task = asyncio.create_task(self._produce(stream))
+
+    async def _produce(self, stream: AsyncIterator[Dict[str, Any]]) -> None:
+        try:
+            async for event in stream:
+                if event.get("event") == "on_chat_model_stream":
+                    self.tokens += 1
+                if self.select is not None:
+                    event = self.select(event)
+                if event is not None:
+                    await self._queue.put(event)
+            self.completed = True
+            _completed_lengths.append(self.tokens)
+        except Exception as e:
+            await self._queue.put(e)
+            return
+        finally:
+            # Closes the stream if the task was cancelled while the stream was
+            # suspended, which cancels the underlying run
+            aclose = getattr(stream, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        await self._queue.put(_END)
+
+    async def events(self) -> AsyncIterator[Dict[str, Any]]:
+        """The selected events, as they are produced."""
+        while True:
+            event = await self._queue.get()
+            if event is _END:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+    def cancel(self) -> None:
+        """Cancel the run if it is still going. Safe to call more than once."""
+        if self._task is None or self._task.done() or self.cancelled:
+            return
+        self.cancelled = True
+        self._task.cancel()
+        saved = max(expected_tokens() - self.tokens, 0.0)
+        cancellations_total.inc()
+        tokens_saved_total.inc(saved)
+        logging.info(
+            f"Cancelled chain run after {self.tokens} tokens, ~{saved:.0f} tokens saved"
+        )
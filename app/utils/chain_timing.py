@@ -0,0 +1,174 @@
+"""Latency of the custom chain runs and of their stages.
+
+`CustomChain` times every run of its wrapped function: time to first event, time
+to first `on_chat_model_stream` token, generation speed in tokens/s and total
+duration. Chains time their own stages (e.g. inspection, retrieval) with
+`stage(name)`, which is attributed to the run being executed.
+
+Timings are recorded in the in-process histograms exposed by the server at
+`/metrics`, labelled by chain:
+    - chain_time_to_first_event_seconds and chain_time_to_first_token_seconds,
+    - chain_tokens_per_second: from the first to the last token,
+    - chain_run_seconds and chain_stage_seconds{stage}.
+
+When OpenTelemetry is installed they are also exported to its configured
+providers, as the same histograms and as a span per run with a child span per
+stage.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+from typing import Any, Iterator, Optional
+
+from app.utils.metrics import metrics
+
+try:
+    from opentelemetry import metrics as otel_metrics
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover - depends on the environment
+    otel_metrics = None
+    trace = None
+
+TOKENS_PER_SECOND_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+HISTOGRAMS = {
+    "time_to_first_event": (
+        "chain_time_to_first_event_seconds",
+        "Time from the start of a chain run to its first event",
+    ),
+    "time_to_first_token": (
+        "chain_time_to_first_token_seconds",
+        "Time from the start of a chain run to its first streamed token",
+    ),
+    "tokens_per_second": (
+        "chain_tokens_per_second",
+        "Streamed tokens per second, from the first to the last token",
+    ),
+    "run": ("chain_run_seconds", "Duration of the chain runs"),
+    "stage": ("chain_stage_seconds", "Duration of the stages of the chain runs"),
+}
+
+_histograms = {
+    key: metrics.histogram(name, description)
+    for key, (name, description) in HISTOGRAMS.items()
+    if key != "tokens_per_second"
+}
+_histograms["tokens_per_second"] = metrics.histogram(
+    *HISTOGRAMS["tokens_per_second"], buckets=TOKENS_PER_SECOND_BUCKETS
+)
+
+if otel_metrics is not None:
+    _meter = otel_metrics.get_meter(__name__)
+    _otel_histograms = {
+        key: _meter.create_histogram(
+            name,
+            unit="1/s" if key == "tokens_per_second" else "s",
+            description=description,
+        )
+        for key, (name, description) in HISTOGRAMS.items()
+    }
+    _tracer = trace.get_tracer(__name__)
+else:
+    _otel_histograms = {}
+    _tracer = None
+
+_current_run: ContextVar[Optional["RunTimer"]] = ContextVar(
+    "current_chain_run", default=None
+)
+
+
+def _record(key: str, value: float, **labels: str) -> None:
+    _histograms[key].observe(value, **labels)
+    if key in _otel_histograms:
+        _otel_histograms[key].record(value, attributes=labels)
+
+
+class RunTimer:
+    """Timings of one chain run, fed with the events it yields."""
+
+    def __init__(self, chain: str) -> None:
+        self.chain = chain
+        self.started_at = time.perf_counter()
+        self.first_event_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.last_token_at: Optional[float] = None
+        self.tokens = 0
+        self.span = (
+            _tracer.start_span(f"chain {chain}", attributes={"chain": chain})
+            if _tracer is not None
+            else None
+        )
+
+    def on_event(self, event: Any) -> None:
+        """Record an event yielded by the run."""
+        now = time.perf_counter()
+        if self.first_event_at is None:
+            self.first_event_at = now
+            _record("time_to_first_event", now - self.started_at, chain=self.chain)
+            if self.span is not None:
+                self.span.add_event("first_event")
+        if getattr(event, "event", None) != "on_chat_model_stream":
+            return
+        self.tokens += 1
+        self.last_token_at = now
+        if self.first_token_at is None:
+            self.first_token_at = now
+            _record("time_to_first_token", now - self.started_at, chain=self.chain)
+            if self.span is not None:
+                self.span.add_event("first_token")
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Generation speed, None until two tokens were streamed."""
+        if self.tokens < 2 or self.last_token_at == self.first_token_at:
+            return None
+        return (self.tokens - 1) / (self.last_token_at - self.first_token_at)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Record the end of the run."""
+        duration = time.perf_counter() - self.started_at
+        _record("run", duration, chain=self.chain)
+        tokens_per_second = self.tokens_per_second
+        if tokens_per_second is not None:
+            _record("tokens_per_second", tokens_per_second, chain=self.chain)
+        if self.span is not None:
+            self.span.set_attribute("tokens", self.tokens)
+            if tokens_per_second is not None:
+                self.span.set_attribute("tokens_per_second", tokens_per_second)
+            if error is not None:
+                self.span.record_exception(error)
+                self.span.set_status(trace.Status(trace.StatusCode.ERROR))
+            self.span.end()
+
+    @contextmanager
+    def activate(self) -> Iterator[None]:
+        """Attribute the stages timed in this block to the run."""
+        token = _current_run.set(self)
+        try:
+            yield
+        finally:
+            _current_run.reset(token)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a stage of the chain run being executed (sync or async code)."""
+    run = _current_run.get()
+    chain = run.chain if run is not None else ""
+    span = None
+    if _tracer is not None:
+        context = (
+            trace.set_span_in_context(run.span)
+            if run is not None and run.span is not None
+            else None
+        )
+        span = _tracer.start_span(
+            f"stage {name}", context=context, attributes={"stage": name}
+        )
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record("stage", time.perf_counter() - started_at, chain=chain, stage=name)
+        if span is not None:
+            span.end()
@@ -0,0 +1,110 @@
+"""Coalescing of consecutive `on_chat_model_stream` events.
+
+Every token otherwise becomes its own NDJSON line, HTTP chunk and network write,
+and its own re-render in the UI. `coalesce_chunks` merges the text of consecutive
+projected chunks (see `event_projection`) until a time window has elapsed since
+the first one or a byte budget is reached. Any other event, and the end of the
+stream, flushes the pending text first so that tool events are never delayed, and
+the first chunk of the stream is never held back, keeping the time to first token.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.utils.metrics import metrics
+
+coalesced_chunks = metrics.histogram(
+    "stream_coalesced_chunks",
+    "Model chunks merged into each streamed chunk event",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+
+def _mergeable_content(event: Dict[str, Any]) -> Optional[str]:
+    """Text of a projected chunk event that can be merged, None otherwise."""
+    if event.get("event") != "on_chat_model_stream":
+        return None
+    chunk = event.get("data", {}).get("chunk")
+    if not isinstance(chunk, dict) or chunk.get("additional_kwargs"):
+        return None
+    content = chunk.get("content")
+    return content if isinstance(content, str) else None
+
+
+def _chunk_event(contents: List[str]) -> Dict[str, Any]:
+    coalesced_chunks.observe(len(contents))
+    return {
+        "event": "on_chat_model_stream",
+        "data": {"chunk": {"content": "".join(contents), "additional_kwargs": {}}},
+    }
+
+
+async def coalesce_chunks(
+    events: AsyncIterator[Dict[str, Any]],
+    window: float = 0.03,
+    max_bytes: int = 1024,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Merge consecutive chunk events of a stream of projected events.
+
+    Args:
+        events (AsyncIterator[Dict[str, Any]]): The projected events.
+        window (float): Seconds a chunk can be held back waiting for the next ones.
+        max_bytes (int): Size of the merged text that triggers a flush.
+
+    Yields:
+        Dict[str, Any]: The events, with consecutive chunks merged.
+    """
+    iterator = events.__aiter__()
+    loop = asyncio.get_running_loop()
+    contents: List[str] = []
+    size, deadline = 0, 0.0
+    first_chunk = True
+    # Next event, awaited in a task while text is pending so that the window can
+    # expire without cancelling the source
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending is None and not contents:
+                try:
+                    event = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+            else:
+                if pending is None:
+                    pending = asyncio.ensure_future(iterator.__anext__())
+                timeout = max(deadline - loop.time(), 0.0) if contents else None
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield _chunk_event(contents)
+                    contents, size = [], 0
+                    continue
+                future, pending = pending, None
+                try:
+                    event = future.result()
+                except StopAsyncIteration:
+                    break
+
+            content = _mergeable_content(event)
+            if content is not None and first_chunk:
+                first_chunk = False
+                yield event
+                continue
+            if content is not None:
+                if not contents:
+                    deadline = loop.time() + window
+                contents.append(content)
+                size += len(content.encode())
+                if size >= max_bytes:
+                    yield _chunk_event(contents)
+                    contents, size = [], 0
+                continue
+            if contents:
+                yield _chunk_event(contents)
+                contents, size = [], 0
+            yield event
+
+        if contents:
+            yield _chunk_event(contents)
+    finally:
+        if pending is not None:
+            pending.cancel()
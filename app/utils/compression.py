@@ -0,0 +1,150 @@
+"""Streaming compression of the `/stream_events` NDJSON stream.
+
+The encoding is negotiated from the `Accept-Encoding` request header among the
+available ones: zstd (`zstandard`) and br (`brotli`) when installed, and gzip.
+Each event is compressed then flushed, so that the client can decode it as soon
+as it arrives and compression never delays the time to first token.
+"""
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# Encodings in order of preference when the client accepts several
+PREFERRED_ENCODINGS = ("zstd", "br", "gzip")
+
+
+class StreamCompressor(ABC):
+    """Compressor flushing after every block of data."""
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        """Compress a block, returning everything needed to decode it."""
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        """End the compressed stream."""
+
+
+class GzipCompressor(StreamCompressor):
+    """gzip with a sync flush (Z_SYNC_FLUSH) after each block."""
+
+    def __init__(self, level: int = 6) -> None:
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class ZstdCompressor(StreamCompressor):
+    """zstd with a block flush after each block."""
+
+    def __init__(self, level: int = 3) -> None:
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        )
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+class BrotliCompressor(StreamCompressor):
+    """Brotli with a flush after each block."""
+
+    def __init__(self, quality: int = 4) -> None:
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+COMPRESSORS: Dict[str, Optional[type]] = {
+    "zstd": ZstdCompressor if zstandard is not None else None,
+    "br": BrotliCompressor if brotli is not None else None,
+    "gzip": GzipCompressor,
+}
+
+
+def parse_accept_encoding(header: str) -> List[Tuple[str, float]]:
+    """(encoding, q-value) pairs of an `Accept-Encoding` header."""
+    encodings = []
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings.append((name.strip().lower(), q))
+    return encodings
+
+
+def negotiate_encoding(
+    accept_encoding: Optional[str],
+    preferred: Sequence[str] = PREFERRED_ENCODINGS,
+) -> Optional[str]:
+    """
+    Pick the content encoding of a response.
+
+    Args:
+        accept_encoding (Optional[str]): The `Accept-Encoding` request header.
+        preferred (Sequence[str]): Allowed encodings, in order of preference.
+
+    Returns:
+        Optional[str]: The available encoding with the highest q-value (ties are
+            broken by preference), None to send the response uncompressed.
+    """
+    if not accept_encoding:
+        return None
+    accepted = dict(parse_accept_encoding(accept_encoding))
+    wildcard = accepted.get("*", 0.0)
+    candidates = [
+        (accepted.get(encoding, wildcard), -rank, encoding)
+        for rank, encoding in enumerate(preferred)
+        if COMPRESSORS.get(encoding) is not None
+    ]
+    candidates = [candidate for candidate in candidates if candidate[0] > 0]
+    return max(candidates)[2] if candidates else None
+
+
+async def compress_stream(
+    stream: AsyncIterator[bytes], encoding: str
+) -> AsyncIterator[bytes]:
+    """
+    Compress a stream of events, flushing after each one. The inner stream is
+    closed with this one, e.g. when the client disconnects.
+    """
+    compressor: StreamCompressor = COMPRESSORS[encoding]()
+    try:
+        async for data in stream:
+            yield compressor.compress(data)
+        yield compressor.finish()
+    finally:
+        aclose = getattr(stream, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -5,73 +5,305 @@ such as event streaming and tracing.
 
 When using frameworks like LangGraph or CrewAI that provide their own orchestration, this file can be safely removed.
 """
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 import inspect
-from typing import Any, AsyncGenerator, Callable, List, Union
+import logging
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+)
 
+from app.utils.background_loop import background_loop
+from app.utils.chain_timing import RunTimer
+from app.utils.event_projection import matches_filters
 from app.utils.output_types import OnChatModelStreamEvent, OnToolEndEvent
 from langchain_core.messages import AIMessage
 from langchain_core.runnables.utils import Input
 from tqdm import tqdm
 
+# Inputs processed at once by the batch methods. On I/O bound chains, abatch only
+# keeps up with a thread pool at 32, and is ~13% faster at ~20% less CPU per input
+# at 64 (benchmarks/custom_chain_batch.py)
+DEFAULT_MAX_CONCURRENCY = 64
+
+
+class _MessageBuilder:
+    """Accumulates the events of a chain run into an AIMessage."""
+
+    def __init__(self) -> None:
+        self.content = ""
+        self.tool_calls: List[Any] = []
+
+    def add(self, event: Any) -> None:
+        if isinstance(event, OnChatModelStreamEvent):
+            if not isinstance(event.data.chunk.content, str):
+                raise ValueError("Chunk content must be a string")
+            self.content += event.data.chunk.content
+        elif isinstance(event, OnToolEndEvent):
+            self.tool_calls.append(event.data.model_dump())
+
+    def message(self) -> AIMessage:
+        return AIMessage(
+            content=self.content, additional_kwargs={"tool_calls_data": self.tool_calls}
+        )
+
+
 class CustomChain:
     """A custom chain class that wraps a callable function."""
 
-    def __init__(self, func: Callable):
-        """Initialize the CustomChain with a callable function."""
+    def __init__(self, func: Callable, name: Optional[str] = None):
+        """
+        Initialize the CustomChain with a callable function. Its runs are timed
+        under `name`, "module:function" by default.
+        """
         self.func = func
+        self.name = name or f"{func.__module__}:{func.__qualname__}"
+
+    @property
+    def is_async(self) -> bool:
+        """Whether the wrapped function is an async generator function."""
+        func = inspect.unwrap(self.func)
+        return inspect.isasyncgenfunction(func) or inspect.iscoroutinefunction(func)
+
+    async def _aevents(self, async_gen: Any) -> AsyncGenerator:
+        """The events of a call of the wrapped async generator function, timed."""
+        timer = RunTimer(self.name)
+        error = None
+        try:
+            # Traceloop aworkflow decorator returns a co-routine which should be
+            # awaited
+            if inspect.iscoroutine(async_gen):
+                with timer.activate():
+                    async_gen = await async_gen
+            while True:
+                # The stages timed by the chain are attributed to this run
+                with timer.activate():
+                    try:
+                        event = await async_gen.__anext__()
+                    except StopAsyncIteration:
+                        break
+                timer.on_event(event)
+                yield event
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # Stops the wrapped function right away when the stream is closed early
+            if inspect.isasyncgen(async_gen):
+                await async_gen.aclose()
+            timer.finish(error)
 
-    async def astream_events(self, *args: Any, **kwargs: Any) -> AsyncGenerator:
+    async def astream_events(
+        self,
+        *args: Any,
+        include_types: Optional[Sequence[str]] = None,
+        include_names: Optional[Sequence[str]] = None,
+        exclude_types: Optional[Sequence[str]] = None,
+        exclude_names: Optional[Sequence[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncGenerator:
         """
         Asynchronously stream events from the wrapped function.
         Applies Traceloop workflow decorator if Traceloop SDK is initialized.
+        Supports the include/exclude filters of LangChain's `astream_events`,
+        filtered events are never serialized.
         """
-        func = self.func
-
-        async_gen = func(*args, **kwargs)
-
-        # Traceloop aworkflow decorator returns a co-routine which should be awaited
-        if inspect.iscoroutine(async_gen):
-            async_gen = await async_gen
-
-        async for event in async_gen:
-            yield event.model_dump()
+        events = self._aevents(self.func(*args, **kwargs))
+        try:
+            async for event in events:
+                if matches_filters(
+                    {"event": event.event, "name": event.name},
+                    include_types or (),
+                    include_names or (),
+                    exclude_types or (),
+                    exclude_names or (),
+                ):
+                    yield event.model_dump()
+        finally:
+            await events.aclose()
 
     def invoke(self, *args: Any, **kwargs: Any) -> AIMessage:
         """
         Invoke the wrapped function and process its events.
+        Async generator functions run on the shared background event loop.
         Returns an AIMessage with content and relative tool calls.
         """
         events = self.func(*args, **kwargs)
-        response_content = ""
-        tool_calls = []
+        if inspect.isasyncgen(events) or inspect.iscoroutine(events):
+            return background_loop.run(self._acollect(events))
+        builder = _MessageBuilder()
         for event in events:
-            if isinstance(event, OnChatModelStreamEvent):
-                if not isinstance(event.data.chunk.content, str):
-                    raise ValueError("Chunk content must be a string")
-                response_content += event.data.chunk.content
-            elif isinstance(event, OnToolEndEvent):
-                tool_calls.append(event.data.model_dump())
-        return AIMessage(
-            content=response_content, additional_kwargs={"tool_calls_data": tool_calls}
-        )
-    
+            builder.add(event)
+        return builder.message()
+
+    async def ainvoke(self, *args: Any, **kwargs: Any) -> AIMessage:
+        """
+        Asynchronously invoke the wrapped function and process its events.
+        Sync generator functions run in a thread, off the event loop.
+        Returns an AIMessage with content and relative tool calls.
+        """
+        if not self.is_async:
+            return await asyncio.to_thread(self.invoke, *args, **kwargs)
+        return await self._acollect(self.func(*args, **kwargs))
+
+    async def _acollect(self, async_gen: Any) -> AIMessage:
+        builder = _MessageBuilder()
+        async for event in self._aevents(async_gen):
+            builder.add(event)
+        return builder.message()
+
+    async def _ainvoke_with_retries(
+        self,
+        input: Input,
+        *args: Any,
+        retries: int,
+        retry_delay: float,
+        retry_on: Tuple[Type[Exception], ...],
+        **kwargs: Any,
+    ) -> Union[AIMessage, Exception]:
+        attempt = 0
+        while True:
+            try:
+                return await self.ainvoke(input, *args, **kwargs)
+            except retry_on as e:
+                if attempt >= retries:
+                    return e
+                logging.warning(f"Chain run failed ({e!r}), retry {attempt + 1}")
+                await asyncio.sleep(retry_delay * 2**attempt)
+                attempt += 1
+            except Exception as e:
+                return e
+
+    async def astream_batch(
+        self,
+        inputs: Sequence[Input],
+        *args: Any,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        ordered: bool = False,
+        retries: int = 0,
+        retry_delay: float = 0.5,
+        retry_on: Tuple[Type[Exception], ...] = (Exception,),
+        **kwargs: Any,
+    ) -> AsyncIterator[Tuple[int, Union[AIMessage, Exception]]]:
+        """
+        Asynchronously invoke the wrapped function on each input, on the running
+        event loop.
+
+        Args:
+            inputs (Sequence[Input]): Inputs, each one passed as first argument.
+                The other positional and keyword arguments are passed to every
+                call.
+            max_concurrency (int): Inputs processed at once.
+            ordered (bool): Whether to yield the results in the order of the inputs
+                rather than as they complete.
+            retries (int): Extra attempts of a failed input.
+            retry_delay (float): Seconds before the first retry, doubled after each
+                one.
+            retry_on (Tuple[Type[Exception], ...]): Errors that are retried.
+
+        Returns:
+            AsyncIterator[Tuple[int, Union[AIMessage, Exception]]]: (index, result)
+                pairs. A failed input yields its last error instead of an AIMessage
+                and does not affect the others.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(index: int, input: Input) -> Tuple[int, Any]:
+            async with semaphore:
+                return index, await self._ainvoke_with_retries(
+                    input,
+                    *args,
+                    retries=retries,
+                    retry_delay=retry_delay,
+                    retry_on=retry_on,
+                    **kwargs,
+                )
+
+        tasks = [asyncio.create_task(run(i, input)) for i, input in enumerate(inputs)]
+        try:
+            for next_result in tasks if ordered else asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            # Cancels the remaining inputs when the stream is closed early
+            for task in tasks:
+                task.cancel()
+
+    async def abatch(
+        self,
+        inputs: Sequence[Input],
+        *args: Any,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        retries: int = 0,
+        retry_delay: float = 0.5,
+        retry_on: Tuple[Type[Exception], ...] = (Exception,),
+        **kwargs: Any,
+    ) -> List[Union[AIMessage, Exception]]:
+        """
+        Asynchronously invoke the wrapped function in batch, see `astream_batch`.
+        Returns the results in the order of the inputs, with the error of each
+        failed input in place of its AIMessage.
+        """
+        results: List[Any] = [None] * len(inputs)
+        with tqdm(total=len(inputs)) as progress:
+            async for index, result in self.astream_batch(
+                inputs,
+                *args,
+                max_concurrency=max_concurrency,
+                retries=retries,
+                retry_delay=retry_delay,
+                retry_on=retry_on,
+                **kwargs,
+            ):
+                results[index] = result
+                progress.update()
+        return results
+
     def batch(
         self,
         inputs: List[Input],
         *args: Any,
         max_workers: Union[int, None] = None,
+        return_exceptions: bool = False,
         **kwargs: Any,
     ):
         """"
         Invoke the wrapped function and process its events in batch.
-        Returns a List of AIMessage with content and relative tool calls.
+        Async generator functions run through `abatch` on the shared background
+        event loop, `max_workers` being the number of inputs processed at once.
+        Each input is passed as first argument, followed by the same `args` and
+        `kwargs` for every input.
+        Returns a List of AIMessage with content and relative tool calls, raising
+        the first error unless `return_exceptions` is set.
         """
+        if self.is_async:
+            results = background_loop.run(
+                self.abatch(
+                    inputs,
+                    *args,
+                    max_concurrency=max_workers or DEFAULT_MAX_CONCURRENCY,
+                    **kwargs,
+                )
+            )
+            if not return_exceptions:
+                for result in results:
+                    if isinstance(result, Exception):
+                        raise result
+            return results
         predicted_messages = []
         with ThreadPoolExecutor(max_workers) as pool:
             for response in tqdm(
-                pool.map(self.invoke, inputs, *args, **kwargs), total=len(inputs)
+                pool.map(lambda input: self.invoke(input, *args, **kwargs), inputs),
+                total=len(inputs),
             ):
                 predicted_messages.append(response)
         return predicted_messages
@@ -0,0 +1,183 @@
+"""Dynamic micro-batching of concurrent embedding requests.
+
+`BatchedEmbeddings` wraps any LangChain `Embeddings` and can be used wherever one is
+accepted. Concurrent `embed_query`/`embed_documents` calls, from threads or event
+loops, are queued and gathered by worker threads into a single `embed_documents`
+call of the underlying model, then each caller gets its own vectors back.
+
+A worker sends a batch once it holds `max_batch_size` texts or `max_wait` seconds
+after its first request, whichever comes first. Requests arriving while a batch is
+being embedded join the next one, so batches grow with the load even with a
+`max_wait` of 0, which adds no latency to a lone request. A larger `max_wait` trades
+latency for fewer, larger requests.
+
+Queries are batched through `embed_documents`, which requires the model to embed a
+query and a document alike (e.g. `OllamaEmbeddings`). Set `batch_queries=False`
+otherwise.
+
+Metrics:
+    - embedding_batch_size: texts per request to the underlying model,
+    - embedding_batch_wait_seconds: time requests waited before being sent.
+"""
+import asyncio
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from app.utils.metrics import metrics
+from langchain_core.embeddings import Embeddings
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+batch_size = metrics.histogram(
+    "embedding_batch_size",
+    "Texts per batched embedding request",
+    buckets=BATCH_SIZE_BUCKETS,
+)
+batch_wait_seconds = metrics.histogram(
+    "embedding_batch_wait_seconds", "Time embedding requests waited for a batch"
+)
+
+_STOP = object()
+
+
+@dataclass
+class _Request:
+    texts: List[str]
+    future: Future = field(default_factory=Future)
+    queued_at: float = field(default_factory=time.perf_counter)
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeddings wrapper sending concurrent requests as batches."""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        max_batch_size: int = 32,
+        max_wait: float = 0.002,
+        workers: int = 1,
+        batch_queries: bool = True,
+    ) -> None:
+        """
+        Initialize the batcher, its workers are started on first use.
+
+        Args:
+            underlying (Embeddings): The embedding model computing the batches.
+            max_batch_size (int): Texts from which a batch is sent without
+                waiting for more requests.
+            max_wait (float): Seconds a batch waits for more requests after its
+                first one.
+            workers (int): Batches embedded concurrently.
+            batch_queries (bool): Whether to batch queries with `embed_documents`.
+        """
+        self.underlying = underlying
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.workers = workers
+        self.batch_queries = batch_queries
+        self._queue: "queue.Queue" = queue.Queue()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def _submit(self, texts: List[str]) -> Future:
+        with self._lock:
+            if not self._threads:
+                self._threads = [
+                    threading.Thread(
+                        target=self._work, name=f"embedding-batcher-{i}", daemon=True
+                    )
+                    for i in range(self.workers)
+                ]
+                for thread in self._threads:
+                    thread.start()
+        request = _Request(list(texts))
+        self._queue.put(request)
+        return request.future
+
+    def _next_batch(self) -> Optional[List[_Request]]:
+        """Wait for a batch of requests, None when the batcher is closed."""
+        first = self._queue.get()
+        if first is _STOP:
+            # Let the other workers see it too
+            self._queue.put(_STOP)
+            return None
+        batch, size = [first], len(first.texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch_size:
+            try:
+                # Requests already queued join the batch even with max_wait == 0
+                request = self._queue.get(
+                    timeout=max(deadline - time.perf_counter(), 0)
+                )
+            except queue.Empty:
+                break
+            if request is _STOP:
+                # Let the other workers see it too, after sending this batch
+                self._queue.put(_STOP)
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _work(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            texts = [text for request in batch for text in request.texts]
+            sent_at = time.perf_counter()
+            batch_size.observe(len(texts))
+            for request in batch:
+                batch_wait_seconds.observe(sent_at - request.queued_at)
+            try:
+                vectors = self.underlying.embed_documents(texts)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            start = 0
+            for request in batch:
+                end = start + len(request.texts)
+                request.future.set_result(vectors[start:end])
+                start = end
+
+    def close(self) -> None:
+        """Stop the workers once the queued requests are embedded."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if threads:
+            self._queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+            # Drop the stop marker left for the workers
+            self._queue = queue.Queue()
+
+    # Embeddings interface
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, batched with the concurrent requests."""
+        if not texts:
+            return []
+        return self._submit(texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, batched with the concurrent requests."""
+        if not self.batch_queries:
+            return self.underlying.embed_query(text)
+        return self._submit([text]).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronously embed documents, without blocking the event loop."""
+        if not texts:
+            return []
+        return await asyncio.wrap_future(self._submit(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Asynchronously embed a query, without blocking the event loop."""
+        if not self.batch_queries:
+            return await self.underlying.aembed_query(text)
+        return (await asyncio.wrap_future(self._submit([text])))[0]
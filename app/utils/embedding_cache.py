@@ -0,0 +1,315 @@
+"""Two-tier, content-addressed cache for embedding models.
+
+`CachedEmbeddings` wraps any LangChain `Embeddings` and can be used wherever one is
+accepted. Vectors are keyed by the model name, the kind of embedding (query or
+document) and the hash of the normalized text. Lookups go through an in-process LRU
+first and then an on-disk SQLite table shared by all processes on the host. The
+async methods read and write the disk tier in a thread, off the event loop.
+"""
+import asyncio
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import unicodedata
+
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+SQLITE_MAX_PARAMS = 500
+# Access times of disk hits are written once this many are pending or this many
+# seconds after the last write, and before every insertion
+ACCESS_FLUSH_SIZE = 256
+ACCESS_FLUSH_INTERVAL = 30.0
+
+
+def normalize_text(text: str) -> str:
+    """Normalize unicode and whitespace so that trivially different texts share a key."""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+@dataclass
+class EmbeddingCacheStats:
+    """Hit/miss counters of an embedding cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups served from either tier."""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        """Counters and hit rate as a plain dictionary."""
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an LRU memory tier and a size-bounded SQLite disk tier."""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_name: str,
+        path: Optional[str] = None,
+        max_memory_entries: int = 10_000,
+        max_disk_entries: int = 1_000_000,
+    ) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            underlying (Embeddings): The embedding model computing cache misses.
+            model_name (str): Part of the cache key, so that models never share vectors.
+            path (Optional[str]): SQLite database of the disk tier. Memory only if None.
+            max_memory_entries (int): Capacity of the in-process LRU tier.
+            max_disk_entries (int): Capacity of the disk tier. The least recently used
+                tenth of the entries is evicted when it is exceeded.
+        """
+        self.underlying = underlying
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.stats = EmbeddingCacheStats()
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Guards the memory tier and the stats, the disk tier has its own lock so
+        # that memory hits never wait for SQLite
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pending_access: Dict[str, float] = {}
+        self._access_flushed_at = time.time()
+        # Rows of the disk tier, kept up to date so that inserts never count them
+        self._disk_rows = 0
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+                "ON embeddings (last_access)"
+            )
+            self._db.commit()
+            (self._disk_rows,) = self._db.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+
+    def _key(self, text: str, kind: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{kind}:{digest}"
+
+    # Cache tiers
+
+    def _memory_lookup(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Copies of the vectors of the keys found in the memory tier."""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    # Callers may mutate the vectors they get
+                    found[key] = list(self._memory[key])
+            self.stats.memory_hits += len(found)
+        return found
+
+    def _disk_lookup(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Vectors of the keys found in the disk tier, also kept in memory."""
+        if self._db is None or not keys:
+            return {}
+        with self._db_lock:
+            rows = []
+            # Stay below SQLite's limit on the number of bound parameters
+            for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+                block = keys[start : start + SQLITE_MAX_PARAMS]
+                rows += self._db.execute(
+                    "SELECT key, vector FROM embeddings "
+                    f"WHERE key IN ({','.join('?' * len(block))})",
+                    block,
+                ).fetchall()
+            # Access times only order evictions, so they are written in batches
+            # rather than with a write transaction per hit
+            now = time.time()
+            self._pending_access.update((key, now) for key, _ in rows)
+            if (
+                len(self._pending_access) >= ACCESS_FLUSH_SIZE
+                or now - self._access_flushed_at >= ACCESS_FLUSH_INTERVAL
+            ):
+                self._flush_access()
+                self._db.commit()
+        found = {
+            key: np.frombuffer(blob, dtype=np.float32).tolist() for key, blob in rows
+        }
+        with self._lock:
+            for key, vector in found.items():
+                self._remember(key, list(vector))
+            self.stats.disk_hits += len(found)
+        return found
+
+    def _count_misses(self, keys: Sequence[str], found: Dict[str, List[float]]) -> None:
+        with self._lock:
+            self.stats.misses += len([key for key in keys if key not in found])
+
+    def _lookup(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors for the keys found in either tier."""
+        found = self._memory_lookup(keys)
+        found.update(self._disk_lookup([key for key in keys if key not in found]))
+        self._count_misses(keys, found)
+        return found
+
+    async def _alookup(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """`_lookup`, with the disk tier read in a thread."""
+        found = self._memory_lookup(keys)
+        disk_keys = [key for key in keys if key not in found]
+        if self._db is not None and disk_keys:
+            found.update(await asyncio.to_thread(self._disk_lookup, disk_keys))
+        self._count_misses(keys, found)
+        return found
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _memory_store(self, entries: Dict[str, List[float]]) -> None:
+        with self._lock:
+            for key, vector in entries.items():
+                self._remember(key, list(vector))
+
+    def _disk_store(self, entries: Dict[str, List[float]]) -> None:
+        if self._db is None:
+            return
+        with self._db_lock:
+            now = time.time()
+            rows = [
+                (np.asarray(vector, dtype=np.float32).tobytes(), now, key)
+                for key, vector in entries.items()
+            ]
+            inserted = self._db.executemany(
+                "INSERT OR IGNORE INTO embeddings (vector, last_access, key) "
+                "VALUES (?, ?, ?)",
+                rows,
+            ).rowcount
+            # Keys already on disk are replaced and do not grow the table
+            if inserted < len(rows):
+                self._db.executemany(
+                    "UPDATE embeddings SET vector = ?, last_access = ? WHERE key = ?",
+                    rows,
+                )
+            self._disk_rows += inserted
+            for key in entries:
+                self._pending_access.pop(key, None)
+            # Evictions see the latest access times
+            self._flush_access()
+            self._evict()
+            self._db.commit()
+
+    def _store(self, entries: Dict[str, List[float]]) -> None:
+        self._memory_store(entries)
+        self._disk_store(entries)
+
+    async def _astore(self, entries: Dict[str, List[float]]) -> None:
+        """`_store`, with the disk tier written in a thread."""
+        self._memory_store(entries)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_store, entries)
+
+    def _flush_access(self) -> None:
+        """Write the pending access times, in the caller's transaction."""
+        if self._pending_access:
+            self._db.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(at, key) for key, at in self._pending_access.items()],
+            )
+            self._pending_access.clear()
+        self._access_flushed_at = time.time()
+
+    def flush(self) -> None:
+        """Write the access times of the disk hits not persisted yet."""
+        if self._db is None:
+            return
+        with self._db_lock:
+            self._flush_access()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        if self._disk_rows <= self.max_disk_entries:
+            return
+        target = int(self.max_disk_entries * 0.9)
+        evicted = self._db.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (self._disk_rows - target,),
+        ).rowcount
+        self._disk_rows -= evicted
+        self.stats.evictions += evicted
+        logging.info(f"Evicted {evicted} entries from the embedding cache")
+
+    # Embeddings interface
+
+    def _split(
+        self, texts: List[str], kind: str
+    ) -> Tuple[List[str], Dict[str, List[float]], Dict[str, str]]:
+        keys = [self._key(text, kind) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        # Embed each missing text once, even if it appears several times
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, missing
+
+    async def _asplit(
+        self, texts: List[str], kind: str
+    ) -> Tuple[List[str], Dict[str, List[float]], Dict[str, str]]:
+        keys = [self._key(text, kind) for text in texts]
+        found = await self._alookup(list(dict.fromkeys(keys)))
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        return keys, found, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents, computing only the vectors missing from the cache."""
+        keys, found, missing = self._split(texts, "document")
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query, served from the cache when it was seen before."""
+        keys, found, missing = self._split([text], "query")
+        if missing:
+            found[keys[0]] = self.underlying.embed_query(text)
+            self._store({keys[0]: found[keys[0]]})
+        return found[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Asynchronously embed documents, computing only the missing vectors."""
+        keys, found, missing = await self._asplit(texts, "document")
+        if missing:
+            vectors = await self.underlying.aembed_documents(list(missing.values()))
+            computed = dict(zip(missing, vectors))
+            await self._astore(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Asynchronously embed a query, served from the cache when possible."""
+        keys, found, missing = await self._asplit([text], "query")
+        if missing:
+            found[keys[0]] = await self.underlying.aembed_query(text)
+            await self._astore({keys[0]: found[keys[0]]})
+        return found[keys[0]]
@@ -0,0 +1,97 @@
+"""Compact wire schema of the events streamed by `/stream_events`.
+
+LangChain events carry a full envelope (`run_id`, `tags`, `metadata`, `parent_ids`)
+and full message objects, while the UI only reads a few fields of each event type.
+`project_event` keeps only those fields:
+
+    on_chat_model_stream: {"event", "data": {"chunk": {"content", "additional_kwargs"}}}
+    on_tool_start, on_retriever_start: {"event", "name", "data": {"input"}}
+    on_tool_end, on_retriever_end: {"event", "name", "data": {"input", "output"}}
+
+Events of other types, or without the expected fields, are passed through as is.
+"""
+from typing import Any, Dict, Sequence
+
+from pydantic import BaseModel
+
+# Run types of the supported events, pushed down to `astream_events(include_types=)`
+# so that LangChain does not build events of other runs (chains, prompts...)
+SUPPORTED_RUN_TYPES = ["chat_model", "tool", "retriever"]
+
+# Fields of a ToolMessage needed to rebuild it on the client
+TOOL_MESSAGE_FIELDS = ("type", "content", "tool_call_id", "name", "artifact", "status")
+
+
+def run_type(event_name: str) -> str:
+    """Run type of a LangChain event name, e.g. "on_chat_model_stream" -> "chat_model"."""
+    for suffix in ("_start", "_stream", "_end"):
+        if event_name.startswith("on_") and event_name.endswith(suffix):
+            return event_name[3 : -len(suffix)]
+    return event_name
+
+
+def matches_filters(
+    event: Dict[str, Any],
+    include_types: Sequence[str] = (),
+    include_names: Sequence[str] = (),
+    exclude_types: Sequence[str] = (),
+    exclude_names: Sequence[str] = (),
+) -> bool:
+    """Apply the `astream_events` include/exclude filters to an event."""
+    event_type = run_type(event.get("event", ""))
+    name = event.get("name", "")
+    if event_type in exclude_types or name in exclude_names:
+        return False
+    if not include_types and not include_names:
+        return True
+    return event_type in include_types or name in include_names
+
+
+def _dump(value: Any) -> Any:
+    return value.model_dump() if isinstance(value, BaseModel) else value
+
+
+def _project_output(output: Any) -> Any:
+    output = _dump(output)
+    if isinstance(output, dict) and output.get("type") == "tool":
+        return {key: output[key] for key in TOOL_MESSAGE_FIELDS if key in output}
+    if isinstance(output, list):
+        return [_dump(item) for item in output]
+    return output
+
+
+def project_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Project an event onto the compact wire schema of its type."""
+    event_type = event.get("event")
+    data = event.get("data")
+    if not isinstance(data, dict):
+        return event
+
+    if event_type == "on_chat_model_stream" and "chunk" in data:
+        chunk = _dump(data["chunk"])
+        return {
+            "event": event_type,
+            "data": {
+                "chunk": {
+                    "content": chunk.get("content", ""),
+                    "additional_kwargs": chunk.get("additional_kwargs", {}),
+                }
+            },
+        }
+    if event_type in ("on_tool_start", "on_retriever_start") and "input" in data:
+        return {
+            "event": event_type,
+            "name": event.get("name"),
+            "data": {"input": data["input"]},
+        }
+    if event_type in ("on_tool_end", "on_retriever_end") and "output" in data:
+        return {
+            "event": event_type,
+            "name": event.get("name"),
+            "data": {
+                "input": data.get("input", {}),
+                "output": _project_output(data["output"]),
+            },
+        }
+    return event
+
@@ -0,0 +1,200 @@
+"""Minimal in-process metrics: counters, gauges and histograms with labels.
+
+Metrics are registered on the global `metrics` registry and exposed by the server
+at `/metrics`, in the Prometheus text format.
+"""
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+    """Escape a label value as required by the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels)
+    return "{" + pairs + "}"
+
+
+class _ValueMetric:
+    """A single value per label set."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels: str) -> None:
+        """Increment the value of a label set."""
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def value(self, **labels: str) -> float:
+        """Current value of a label set."""
+        return self._values.get(_labels(labels), 0.0)
+
+    def total(self) -> float:
+        """Sum over all label sets."""
+        return sum(self._values.values())
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        """(metric name, labels, value) samples."""
+        return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Counter(_ValueMetric):
+    """A monotonically increasing value per label set."""
+
+    kind = "counter"
+
+
+class Gauge(_ValueMetric):
+    """A value per label set that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        """Set the value of a label set."""
+        with self._lock:
+            self._values[_labels(labels)] = value
+
+    def dec(self, value: float = 1.0, **labels: str) -> None:
+        """Decrement the value of a label set."""
+        self.inc(-value, **labels)
+
+
+class Histogram:
+    """Distribution of observed values per label set, over fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: bucket counts (last one is +Inf), sum and count
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """Record an observation."""
+        key = _labels(labels)
+        with self._lock:
+            counts, total, count = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0.0, 0)
+            )
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels: str) -> int:
+        """Number of observations of a label set."""
+        return self._values.get(_labels(labels), ([], 0.0, 0))[2]
+
+    def sum(self, **labels: str) -> float:
+        """Sum of the observations of a label set."""
+        return self._values.get(_labels(labels), ([], 0.0, 0))[1]
+
+    def quantile(self, q: float, **labels: str) -> float:
+        """Estimate a quantile as the upper bound of the bucket containing it."""
+        counts, _, count = self._values.get(_labels(labels), ([], 0.0, 0))
+        if not count:
+            return 0.0
+        rank, cumulative = q * count, 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        """Cumulative bucket, sum and count samples."""
+        samples = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                samples.append(
+                    (f"{self.name}_bucket", key + (("le", le),), cumulative)
+                )
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Registry of named metrics. Registering an existing name returns the metric."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls: type, name: str, *args: object) -> object:
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args)
+            metric = self._metrics[name]
+        if not isinstance(metric, cls):
+            raise ValueError(
+                f"Metric '{name}' is already registered as a {metric.kind}"
+            )
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        """Get or create a counter."""
+        return self._register(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        """Get or create a gauge."""
+        return self._register(Gauge, name, description)
+
+    def histogram(
+        self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """Get or create a histogram."""
+        return self._register(Histogram, name, description, buckets)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.description}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
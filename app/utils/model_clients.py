@@ -0,0 +1,403 @@
+"""Shared, pooled HTTP clients of the Ollama models.
+
+Every `ChatOllama` and `OllamaEmbeddings` created with `chat_model()` and
+`embedding_model()` talks to its Ollama host through one keep-alive connection pool
+per host (one sync pool, and one async pool per event loop), instead of opening its
+own. The pools live in a `SharedTransport` given to the models through their public
+`client_kwargs`, so the ollama clients are built as usual. HTTP/2 is enabled when
+`h2` is installed, which httpx only negotiates over TLS (e.g. Ollama behind a
+reverse proxy); plain HTTP stays on HTTP/1.1 keep-alive.
+
+Each model also gets at most `max_in_flight` concurrent calls, the following ones
+waiting for a slot, so that a burst on one model cannot take all the connections.
+The limit applies to the sync calls and, separately, to the calls of each event
+loop. A streamed response holds its slot until it is fully read.
+
+Metrics, labelled by model:
+    - model_requests_total and model_request_errors_total,
+    - model_request_seconds: request latency (full response for streams),
+    - model_queue_seconds: time spent waiting for a slot,
+    - model_in_flight_requests and model_queued_requests.
+"""
+import asyncio
+from contextlib import aclosing, asynccontextmanager, contextmanager
+import importlib.util
+import threading
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+import weakref
+
+import httpx
+from app.utils.metrics import metrics
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+from pydantic import PrivateAttr
+
+# Connection pool of each Ollama host
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+KEEPALIVE_EXPIRY = 60.0
+CONNECT_TIMEOUT = 10.0
+HTTP2 = importlib.util.find_spec("h2") is not None
+# Concurrent requests per model, the following ones wait for a slot
+MAX_IN_FLIGHT_PER_MODEL = 8
+
+requests_total = metrics.counter("model_requests_total", "Model requests sent")
+errors_total = metrics.counter("model_request_errors_total", "Model requests failed")
+request_seconds = metrics.histogram(
+    "model_request_seconds", "Latency of the model requests"
+)
+queue_seconds = metrics.histogram(
+    "model_queue_seconds", "Time model requests waited for a slot"
+)
+in_flight_requests = metrics.gauge(
+    "model_in_flight_requests", "Model requests being processed"
+)
+queued_requests = metrics.gauge(
+    "model_queued_requests", "Model requests waiting for a slot"
+)
+
+
+class ModelLimiter:
+    """In-flight limit and statistics of the requests to a model."""
+
+    def __init__(self, model: str, max_in_flight: int) -> None:
+        self.model = model
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.queued = 0
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_in_flight)
+        self._async_semaphores: weakref.WeakKeyDictionary = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _update(self, in_flight: int = 0, queued: int = 0) -> None:
+        with self._lock:
+            self.in_flight += in_flight
+            self.queued += queued
+            in_flight_requests.set(self.in_flight, model=self.model)
+            queued_requests.set(self.queued, model=self.model)
+
+    def _started(self, queued_at: float) -> float:
+        started_at = time.perf_counter()
+        queue_seconds.observe(started_at - queued_at, model=self.model)
+        requests_total.inc(model=self.model)
+        self._update(in_flight=1, queued=-1)
+        return started_at
+
+    def _finished(self, started_at: float) -> None:
+        request_seconds.observe(time.perf_counter() - started_at, model=self.model)
+        self._update(in_flight=-1)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold a slot of the model for a sync request."""
+        self._update(queued=1)
+        queued_at = time.perf_counter()
+        try:
+            self._semaphore.acquire()
+        except BaseException:
+            self._update(queued=-1)
+            raise
+        started_at = self._started(queued_at)
+        try:
+            yield
+        except Exception:
+            # Streams closed early (GeneratorExit, cancellation) are not errors
+            errors_total.inc(model=self.model)
+            raise
+        finally:
+            self._semaphore.release()
+            self._finished(started_at)
+
+    @asynccontextmanager
+    async def aslot(self) -> AsyncIterator[None]:
+        """Hold a slot of the model for a request of the running event loop."""
+        loop = asyncio.get_running_loop()
+        semaphore = self._async_semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._async_semaphores[loop] = asyncio.Semaphore(
+                self.max_in_flight
+            )
+        self._update(queued=1)
+        queued_at = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            self._update(queued=-1)
+            raise
+        started_at = self._started(queued_at)
+        try:
+            yield
+        except Exception:
+            # Streams closed early (GeneratorExit, cancellation) are not errors
+            errors_total.inc(model=self.model)
+            raise
+        finally:
+            semaphore.release()
+            self._finished(started_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """Current load and latency statistics of the model."""
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "requests": requests_total.value(model=self.model),
+            "errors": errors_total.value(model=self.model),
+            "latency_p50": request_seconds.quantile(0.5, model=self.model),
+            "latency_p95": request_seconds.quantile(0.95, model=self.model),
+            "queue_p95": queue_seconds.quantile(0.95, model=self.model),
+        }
+
+
+class LimitedChatOllama(ChatOllama):
+    """`ChatOllama` holding a slot of its model for every generation."""
+
+    _limiter: ModelLimiter = PrivateAttr(default=None)
+
+    def _generate(self, *args: Any, **kwargs: Any) -> ChatResult:
+        with self._limiter.slot():
+            return super()._generate(*args, **kwargs)
+
+    async def _agenerate(self, *args: Any, **kwargs: Any) -> ChatResult:
+        async with self._limiter.aslot():
+            return await super()._agenerate(*args, **kwargs)
+
+    def _stream(self, *args: Any, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        with self._limiter.slot():
+            yield from super()._stream(*args, **kwargs)
+
+    async def _astream(
+        self, *args: Any, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async with self._limiter.aslot():
+            # Releases the connection when the stream is closed early
+            async with aclosing(super()._astream(*args, **kwargs)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+
+
+class LimitedOllamaEmbeddings(OllamaEmbeddings):
+    """`OllamaEmbeddings` holding a slot of its model for every embedding call."""
+
+    _limiter: ModelLimiter = PrivateAttr(default=None)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._limiter.slot():
+            return super().embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        async with self._limiter.aslot():
+            return await super().aembed_documents(texts)
+
+
+def pool_stats(transport: Any) -> Dict[str, int]:
+    """Open and idle connections of an httpx transport."""
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    return {
+        "connections": len(connections),
+        "idle_connections": sum(connection.is_idle() for connection in connections),
+    }
+
+
+class SharedTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport sharing the connection pools of a host between clients.
+
+    Sync requests go through one pool and async requests through one pool per event
+    loop, as async connections cannot be shared across loops. The pools are created
+    on first use, and again after `close_pools`. Closing a client leaves them open.
+    """
+
+    def __init__(
+        self,
+        transport_factory: Callable[[], httpx.BaseTransport],
+        async_transport_factory: Callable[[], httpx.AsyncBaseTransport],
+    ) -> None:
+        self._transport_factory = transport_factory
+        self._async_transport_factory = async_transport_factory
+        self._transport: Optional[httpx.BaseTransport] = None
+        self._async_transports: Dict[
+            asyncio.AbstractEventLoop, httpx.AsyncBaseTransport
+        ] = {}
+        self._lock = threading.Lock()
+
+    def _sync_transport(self) -> httpx.BaseTransport:
+        with self._lock:
+            if self._transport is None:
+                self._transport = self._transport_factory()
+            return self._transport
+
+    def _loop_transport(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_transports:
+                # Drop the pools of closed event loops
+                for closed in [k for k in self._async_transports if k.is_closed()]:
+                    del self._async_transports[closed]
+                self._async_transports[loop] = self._async_transport_factory()
+            return self._async_transports[loop]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return self._sync_transport().handle_request(request)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._loop_transport().handle_async_request(request)
+
+    def close(self) -> None:
+        """Called by the clients on close, the shared pools stay open."""
+
+    async def aclose(self) -> None:
+        """Called by the clients on close, the shared pools stay open."""
+
+    async def aclose_pools(self) -> None:
+        """Close the sync pool and the async pool of the running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport, self._transport = self._transport, None
+            async_transport = self._async_transports.pop(loop, None)
+        if transport is not None:
+            transport.close()
+        if async_transport is not None:
+            await async_transport.aclose()
+
+    def stats(self) -> Dict[str, int]:
+        """Open and idle connections of all the pools."""
+        with self._lock:
+            transports = [self._transport, *self._async_transports.values()]
+        totals = {"connections": 0, "idle_connections": 0}
+        for transport in transports:
+            for key, value in pool_stats(transport).items():
+                totals[key] += value
+        return totals
+
+
+class ModelClients:
+    """Model clients sharing one connection pool per Ollama host."""
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = KEEPALIVE_EXPIRY,
+        max_in_flight_per_model: int = MAX_IN_FLIGHT_PER_MODEL,
+        http2: bool = HTTP2,
+        transport_factory: Optional[Callable[[], Any]] = None,
+    ) -> None:
+        """
+        Initialize the pools, created on first use.
+
+        Args:
+            max_connections (int): Connections of each pool.
+            max_keepalive_connections (int): Idle connections kept open per pool.
+            keepalive_expiry (float): Seconds an idle connection is kept open.
+            max_in_flight_per_model (int): Concurrent requests per model.
+            http2 (bool): Whether to enable HTTP/2, requires `h2`.
+            transport_factory (Optional[Callable[[], Any]]): Builds the sync and
+                async transports of the pools instead of `httpx.HTTPTransport` and
+                `httpx.AsyncHTTPTransport`, e.g. an `httpx.MockTransport`.
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.max_in_flight_per_model = max_in_flight_per_model
+        self.http2 = http2
+        self.transport_factory = transport_factory
+        self._transports: Dict[str, SharedTransport] = {}
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+
+    def _new_transport(self) -> httpx.BaseTransport:
+        if self.transport_factory is not None:
+            return self.transport_factory()
+        return httpx.HTTPTransport(limits=self.limits, http2=self.http2)
+
+    def _new_async_transport(self) -> httpx.AsyncBaseTransport:
+        if self.transport_factory is not None:
+            return self.transport_factory()
+        return httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+
+    def transport(self, host: str) -> SharedTransport:
+        """The transport holding the pools of a host."""
+        with self._lock:
+            if host not in self._transports:
+                self._transports[host] = SharedTransport(
+                    self._new_transport, self._new_async_transport
+                )
+            return self._transports[host]
+
+    def client_kwargs(self, host: str) -> Dict[str, Any]:
+        """
+        Keyword arguments of `ollama.Client` and `ollama.AsyncClient` (also the
+        `client_kwargs` of the LangChain models) to use the pools of a host.
+        """
+        return {
+            "transport": self.transport(host),
+            "timeout": httpx.Timeout(None, connect=CONNECT_TIMEOUT),
+        }
+
+    def limiter(self, model: str) -> ModelLimiter:
+        """The in-flight limit of a model."""
+        with self._lock:
+            if model not in self._limiters:
+                self._limiters[model] = ModelLimiter(
+                    model, self.max_in_flight_per_model
+                )
+            return self._limiters[model]
+
+    def _build(self, model_class: type, model: str, **kwargs: Any) -> Any:
+        client_kwargs = {
+            **self.client_kwargs(kwargs.get("base_url") or ""),
+            **(kwargs.pop("client_kwargs", None) or {}),
+        }
+        instance = model_class(model=model, client_kwargs=client_kwargs, **kwargs)
+        instance._limiter = self.limiter(model)
+        return instance
+
+    def chat_model(self, model: str, **kwargs: Any) -> ChatOllama:
+        """A `ChatOllama` using the shared pool of its host."""
+        return self._build(LimitedChatOllama, model, **kwargs)
+
+    def embedding_model(self, model: str, **kwargs: Any) -> OllamaEmbeddings:
+        """An `OllamaEmbeddings` using the shared pool of its host."""
+        return self._build(LimitedOllamaEmbeddings, model, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Connections of each pool and load statistics of each model."""
+        with self._lock:
+            transports = dict(self._transports)
+            limiters = dict(self._limiters)
+        return {
+            "pools": {
+                host or "default": transport.stats()
+                for host, transport in transports.items()
+            },
+            "models": {model: limiter.stats() for model, limiter in limiters.items()},
+        }
+
+    async def aclose(self) -> None:
+        """
+        Close the pools (the async ones of the running event loop). Models keep
+        working, with new pools created on their next request.
+        """
+        with self._lock:
+            transports = list(self._transports.values())
+        for transport in transports:
+            await transport.aclose_pools()
+
+
+model_clients = ModelClients()
+
+
+def chat_model(model: str, **kwargs: Any) -> ChatOllama:
+    """A `ChatOllama` using the shared connection pool, see `ModelClients`."""
+    return model_clients.chat_model(model, **kwargs)
+
+
+def embedding_model(model: str, **kwargs: Any) -> OllamaEmbeddings:
+    """An `OllamaEmbeddings` using the shared connection pool, see `ModelClients`."""
+    return model_clients.embedding_model(model, **kwargs)
@@ -0,0 +1,235 @@
+"""Semantic answer cache replaying previous answers to near-identical conversations.
+
+Entries are keyed by the embedding of the normalized tail of the conversation and,
+for RAG chains, by the ids of the documents the answer was generated from. A lookup
+hits when the cosine similarity to a stored conversation is above a threshold, the
+entry has not expired and, if document ids are given, they are the same.
+
+Cached answers are replayed as `OnChatModelStreamEvent` chunks, so clients of
+`/stream_events` cannot tell a replayed answer from a generated one.
+"""
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+import itertools
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.utils.embedding_cache import normalize_text
+from app.utils.output_types import OnChatModelStreamEvent
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import (
+    AIMessageChunk,
+    convert_to_messages,
+    get_buffer_string,
+)
+from langchain_core.runnables import Runnable
+import numpy as np
+
+
+@dataclass
+class SemanticCacheStats:
+    """Hit/miss counters of a semantic cache."""
+
+    hits: int = 0
+    misses: int = 0
+    expirations: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        """Counters and hit rate as a plain dictionary."""
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+
+@dataclass
+class SemanticCacheEntry:
+    """A cached answer and what it was generated from."""
+
+    vector: np.ndarray
+    chunks: List[str]
+    doc_ids: Tuple[str, ...] = ()
+    # The tool call that produced the context of the answer, if any
+    tool_call: Optional[Dict[str, Any]] = None
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class SemanticCache:
+    """In-process semantic cache with a similarity threshold, TTL and LRU eviction."""
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries: int = 1000,
+        tail_messages: int = 3,
+    ) -> None:
+        """
+        Initialize the cache.
+
+        Args:
+            embedding (Embeddings): The model embedding conversation tails.
+            threshold (float): Minimum cosine similarity between conversations.
+            ttl (float): Seconds an entry can be served for after its creation.
+            max_entries (int): Capacity, the least recently used entries are evicted.
+            tail_messages (int): Number of trailing messages identifying a conversation.
+        """
+        self.embedding = embedding
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.tail_messages = tail_messages
+        self.stats = SemanticCacheStats()
+
+        self._entries: "OrderedDict[int, SemanticCacheEntry]" = OrderedDict()
+        self._keys = itertools.count()
+        self._lock = threading.Lock()
+        # Stacked vectors of the entries, rebuilt lazily after changes
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[int] = []
+
+    def __len__(self) -> int:
+        """Number of cached answers."""
+        return len(self._entries)
+
+    def conversation_text(self, messages: Sequence[Any]) -> str:
+        """Normalized text of the tail of a conversation (messages or message dicts)."""
+        tail = convert_to_messages(list(messages)[-self.tail_messages :])
+        return normalize_text(get_buffer_string(tail)).lower()
+
+    async def aembed(self, messages: Sequence[Any]) -> np.ndarray:
+        """Normalized embedding of the tail of a conversation."""
+        vector = np.asarray(
+            await self.embedding.aembed_query(self.conversation_text(messages)),
+            dtype=np.float32,
+        )
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(
+        self,
+        vector: np.ndarray,
+        doc_ids: Optional[Sequence[str]] = None,
+        record: bool = True,
+    ) -> Optional[SemanticCacheEntry]:
+        """
+        Return the most similar live entry above the threshold, or None.
+
+        Args:
+            vector (np.ndarray): Normalized conversation embedding, see `aembed`.
+            doc_ids (Optional[Sequence[str]]): If given, only entries generated from
+                exactly these documents match.
+            record (bool): Whether to count the lookup as a hit or a miss. Callers
+                validating the entry further count it with `record` instead.
+        """
+        with self._lock:
+            self._expire()
+            if self._matrix is None and self._entries:
+                self._matrix_keys = list(self._entries)
+                self._matrix = np.stack(
+                    [self._entries[key].vector for key in self._matrix_keys]
+                )
+            entry = None
+            if self._matrix is not None:
+                scores = self._matrix @ vector
+                for i in np.argsort(-scores):
+                    if scores[i] < self.threshold:
+                        break
+                    key = self._matrix_keys[i]
+                    candidate = self._entries[key]
+                    if doc_ids is None or candidate.doc_ids == tuple(doc_ids):
+                        self._entries.move_to_end(key)
+                        entry = candidate
+                        break
+            if record:
+                self._record(entry is not None)
+            return entry
+
+    def record(self, hit: bool) -> None:
+        """Count a lookup made with `record=False`, once validated."""
+        with self._lock:
+            self._record(hit)
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.stats.hits += 1
+        else:
+            self.stats.misses += 1
+
+    def add(
+        self,
+        vector: np.ndarray,
+        chunks: List[str],
+        doc_ids: Sequence[str] = (),
+        tool_call: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Cache an answer, evicting the least recently used entries if full."""
+        with self._lock:
+            self._entries[next(self._keys)] = SemanticCacheEntry(
+                vector=vector,
+                chunks=chunks,
+                doc_ids=tuple(doc_ids),
+                tool_call=tool_call,
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+            self._matrix = None
+
+    def _expire(self) -> None:
+        deadline = time.monotonic() - self.ttl
+        expired = [
+            key for key, entry in self._entries.items() if entry.created_at < deadline
+        ]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self.stats.expirations += len(expired)
+            self._matrix = None
+
+
+def replay(entry: SemanticCacheEntry) -> Iterator[OnChatModelStreamEvent]:
+    """Stream a cached answer with the chunking of the original generation."""
+    for content in entry.chunks:
+        yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content=content)})
+
+
+class SemanticCacheRunnable:
+    """
+    Put a semantic cache in front of a chat chain (e.g. `prompt | llm`) streamed with
+    `astream_events`. Misses are streamed from the chain and cached once complete.
+    """
+
+    def __init__(self, runnable: Runnable, cache: SemanticCache) -> None:
+        """Wrap `runnable`, which takes a {"messages": [...]} input."""
+        self.runnable = runnable
+        self.cache = cache
+
+    async def astream_events(
+        self, input: Dict[str, Any], *args: Any, **kwargs: Any
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream the events of the chain, or replay a cached answer."""
+        vector = await self.cache.aembed(input["messages"])
+        entry = self.cache.lookup(vector, doc_ids=())
+        if entry is not None:
+            logging.info("Replaying answer from the semantic cache")
+            for event in replay(entry):
+                yield event.model_dump()
+            return
+
+        chunks: List[str] = []
+        async for event in self.runnable.astream_events(input, *args, **kwargs):
+            if event["event"] == "on_chat_model_stream":
+                chunks.append(event["data"]["chunk"].content)
+            yield event
+        self.cache.add(vector, chunks)
+
+    def __getattr__(self, name: str) -> Any:
+        """Delegate everything else (invoke, batch...) to the wrapped chain."""
+        return getattr(self.runnable, name)
@@ -0,0 +1,94 @@
+"""Serializers of the NDJSON lines streamed by `/stream_events`.
+
+Every serializer turns an event (a dict or a pydantic model) into one line of
+UTF-8 JSON bytes, ready to be written to a `StreamingResponse` without another
+encoding step:
+    - "orjson" and "msgspec": native encoders, used when installed,
+    - "pydantic": top-level models (e.g. the `output_types` events) are encoded
+      by the core serializer pydantic precomputes for their class, dicts by the
+      standard library,
+    - "json": the standard library with `default_serialization`.
+
+`get_serializer("auto")` picks the fastest one available.
+"""
+import json
+from typing import Any, Callable, Dict, Optional
+
+from app.utils.input_types import default_serialization
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover - depends on the environment
+    msgspec = None
+
+Serializer = Callable[[Any], bytes]
+
+
+def _to_python(obj: Any) -> Any:
+    """Fallback of the native encoders: pydantic models as JSON compatible dicts."""
+    if isinstance(obj, BaseModel):
+        return obj.__pydantic_serializer__.to_python(obj, mode="json")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def json_serializer(obj: Any) -> bytes:
+    """Standard library serialization, the reference format."""
+    return (json.dumps(obj, default=default_serialization) + "\n").encode()
+
+
+def pydantic_serializer(obj: Any) -> bytes:
+    """Precomputed pydantic encoders for models, the standard library for dicts."""
+    if isinstance(obj, BaseModel):
+        return obj.__pydantic_serializer__.to_json(obj) + b"\n"
+    return json_serializer(obj)
+
+
+def orjson_serializer(obj: Any) -> bytes:
+    """orjson serialization, with the newline appended by the encoder."""
+    return orjson.dumps(obj, default=_to_python, option=orjson.OPT_APPEND_NEWLINE)
+
+
+if msgspec is not None:
+    _msgspec_encoder = msgspec.json.Encoder(enc_hook=_to_python)
+
+
+def msgspec_serializer(obj: Any) -> bytes:
+    """msgspec serialization."""
+    return _msgspec_encoder.encode(obj) + b"\n"
+
+
+SERIALIZERS: Dict[str, Optional[Serializer]] = {
+    "orjson": orjson_serializer if orjson is not None else None,
+    "msgspec": msgspec_serializer if msgspec is not None else None,
+    "pydantic": pydantic_serializer,
+    "json": json_serializer,
+}
+
+
+def get_serializer(name: str = "auto") -> Serializer:
+    """
+    Get a serializer by name.
+
+    Args:
+        name (str): "auto" (the first available of orjson, msgspec and pydantic),
+            "orjson", "msgspec", "pydantic" or "json".
+
+    Returns:
+        Serializer: A function serializing an event to a line of JSON bytes.
+    """
+    if name == "auto":
+        return next(
+            serializer for serializer in SERIALIZERS.values() if serializer is not None
+        )
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown serializer '{name}'")
+    serializer = SERIALIZERS[name]
+    if serializer is None:
+        raise ValueError(f"Serializer '{name}' is not installed")
+    return serializer
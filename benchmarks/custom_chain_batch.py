@@ -0,0 +1,73 @@
+"""Throughput of batch runs of a `custom_chain`, thread pool vs native async.
+
+The chain waits `--latency` seconds (uniformly spread by +/- `--jitter`), like a
+model server before its first token, then streams the answer of a fake LLM.
+Compares the throughput and CPU time per input for each `--concurrency` value:
+    - threads: a ThreadPoolExecutor running each input on its own event loop
+      (`asyncio.run(chain.ainvoke(...))`), what a thread-based batch has to do for
+      an async generator chain,
+    - abatch: `CustomChain.abatch` on a single event loop.
+
+Usage:
+    poetry run python -m benchmarks.custom_chain_batch --inputs 200
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+import time
+from typing import Any, AsyncGenerator, Dict, List
+
+from app.utils.decorators import CustomChain, custom_chain
+from app.utils.output_types import OnChatModelStreamEvent
+from langchain_core.language_models import FakeListChatModel
+
+
+def make_chain(answer_length: int, latency: float, jitter: float) -> CustomChain:
+    llm = FakeListChatModel(responses=["x" * answer_length])
+
+    @custom_chain
+    async def chain(input: Dict[str, Any], **kwargs: Any) -> AsyncGenerator:
+        await asyncio.sleep(latency * random.uniform(1 - jitter, 1 + jitter))
+        async for chunk in llm.astream(input["messages"]):
+            yield OnChatModelStreamEvent(data={"chunk": chunk})
+
+    return chain
+
+
+def thread_pool_batch(
+    chain: CustomChain, inputs: List[Dict[str, Any]], max_workers: int
+) -> List[Any]:
+    with ThreadPoolExecutor(max_workers) as pool:
+        return list(pool.map(lambda x: asyncio.run(chain.ainvoke(x)), inputs))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inputs", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--answer-length", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds")
+    parser.add_argument("--jitter", type=float, default=0.5)
+    args = parser.parse_args()
+
+    chain = make_chain(args.answer_length, args.latency, args.jitter)
+    inputs = [{"messages": f"question {i}"} for i in range(args.inputs)]
+    runs = {
+        "threads": lambda n: thread_pool_batch(chain, inputs, n),
+        "abatch": lambda n: asyncio.run(chain.abatch(inputs, max_concurrency=n)),
+    }
+    for concurrency in args.concurrency:
+        for name, run in runs.items():
+            start, cpu = time.perf_counter(), time.process_time()
+            run(concurrency)
+            elapsed = time.perf_counter() - start
+            cpu_ms = (time.process_time() - cpu) / args.inputs * 1000
+            print(
+                f"concurrency {concurrency:4d} {name:>8}: "
+                f"{args.inputs / elapsed:8.1f} inputs/s   {cpu_ms:6.2f} ms CPU/input"
+            )
+
+
+if __name__ == "__main__":
+    main()
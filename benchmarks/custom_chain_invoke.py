@@ -0,0 +1,78 @@
+"""Per-call overhead of running an async `custom_chain` from sync and async code.
+
+The chain yields a single chunk, so the timings are the cost of the call itself:
+    - asyncio.run: a new event loop per call, the only option without a runner,
+    - invoke: `CustomChain.invoke`, dispatched onto the shared background loop,
+    - invoke xN: the same from `--threads` threads at once, per call,
+    - ainvoke: `await CustomChain.ainvoke` on a running loop, the lower bound.
+
+Usage:
+    poetry run python -m benchmarks.custom_chain_invoke --calls 5000
+"""
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Any, AsyncGenerator, Callable, Dict
+
+from app.utils.decorators import custom_chain
+from app.utils.output_types import OnChatModelStreamEvent
+from langchain_core.messages import AIMessageChunk
+
+CHUNK = OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content="Hi")})
+
+
+@custom_chain
+async def chain(input: Dict[str, Any], **kwargs: Any) -> AsyncGenerator:
+    yield CHUNK
+
+
+def per_call_us(run: Callable[[int], None], n_calls: int) -> float:
+    """Best of 3 runs, in microseconds per call."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        run(n_calls)
+        best = min(best, time.perf_counter() - start)
+    return best / n_calls * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    input: Dict[str, Any] = {"messages": []}
+
+    def new_loop(n: int) -> None:
+        for _ in range(n):
+            asyncio.run(chain.ainvoke(input))
+
+    def invoke(n: int) -> None:
+        for _ in range(n):
+            chain.invoke(input)
+
+    def invoke_threads(n: int) -> None:
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(lambda _: chain.invoke(input), range(n)))
+
+    def ainvoke(n: int) -> None:
+        async def run() -> None:
+            for _ in range(n):
+                await chain.ainvoke(input)
+
+        asyncio.run(run())
+
+    runs = {
+        "asyncio.run": new_loop,
+        "invoke": invoke,
+        f"invoke x{args.threads}": invoke_threads,
+        "ainvoke": ainvoke,
+    }
+    for name, run in runs.items():
+        print(f"{name:>12}: {per_call_us(run, args.calls):8.1f} us/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Throughput and latency of query embeddings, direct vs dynamically batched.
+
+Concurrent clients, one thread each, embed queries in a closed loop through:
+    - direct: one `embed_query` request per query,
+    - batched: a `BatchedEmbeddings` for each `--waits` value.
+
+By default the model is simulated: each request costs a fixed overhead plus a cost
+per text, and the server processes `--parallel` requests at a time, like an
+Ollama server with OLLAMA_NUM_PARALLEL. `--model` uses a running Ollama server.
+
+Usage:
+    poetry run python -m benchmarks.embedding_batching --clients 32
+    poetry run python -m benchmarks.embedding_batching --model nomic-embed-text
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import List
+
+from app.utils.embedding_batcher import BatchedEmbeddings
+from app.utils.model_clients import embedding_model
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+
+class SimulatedEmbeddings(Embeddings):
+    """Embedding server with a per-request overhead and limited parallelism."""
+
+    def __init__(
+        self, overhead: float, per_text: float, parallel: int, dimensions: int = 768
+    ) -> None:
+        self.overhead = overhead
+        self.per_text = per_text
+        self.dimensions = dimensions
+        self._slots = threading.Semaphore(parallel)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._slots:
+            time.sleep(self.overhead + self.per_text * len(texts))
+        return [[0.0] * self.dimensions for _ in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def run_load(
+    embedding: Embeddings, n_clients: int, queries_per_client: int
+) -> str:
+    """Run the clients, returning a result line."""
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def client(i: int) -> None:
+        for j in range(queries_per_client):
+            start = time.perf_counter()
+            embedding.embed_query(f"query {i} {j}")
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as executor:
+        list(executor.map(client, range(n_clients)))
+    elapsed = time.perf_counter() - start
+    p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+    return (
+        f"{len(latencies) / elapsed:9.0f} queries/s   "
+        f"p50 {p50:7.1f} ms   p95 {p95:7.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=20, help="Per client")
+    parser.add_argument("--waits", type=float, nargs="+", default=[0.0, 0.002, 0.01])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--model", help="Ollama embedding model, simulated if unset")
+    parser.add_argument("--overhead", type=float, default=0.01, help="Seconds")
+    parser.add_argument("--per-text", type=float, default=0.0005, help="Seconds")
+    parser.add_argument("--parallel", type=int, default=1)
+    args = parser.parse_args()
+
+    underlying: Embeddings = (
+        embedding_model(args.model)
+        if args.model
+        else SimulatedEmbeddings(args.overhead, args.per_text, args.parallel)
+    )
+    print(f"{args.clients} clients x {args.queries} queries")
+    print(f"{'direct':>16}: {run_load(underlying, args.clients, args.queries)}")
+    for wait in args.waits:
+        batcher = BatchedEmbeddings(
+            underlying, max_batch_size=args.batch_size, max_wait=wait
+        )
+        result = run_load(batcher, args.clients, args.queries)
+        batcher.close()
+        print(f"{f'batched {wait * 1000:g} ms':>16}: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Bytes per token and CPU per stream of the `/stream_events` wire format.
+
+Streams a fake chat model answer through `prompt | llm`, like `app/chain.py`, and
+serializes the events like `stream_event_response`:
+    - full: every event built, filtered after the fact, full envelope serialized,
+    - projected: run types pushed down to `astream_events(include_types=)` and
+      events projected onto the compact wire schema.
+
+Usage:
+    poetry run python -m benchmarks.event_wire --tokens 50 500
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, Tuple
+
+from app.server import SUPPORTED_EVENTS
+from app.utils.event_projection import SUPPORTED_RUN_TYPES, project_event
+from app.utils.input_types import default_serialization
+from langchain_core.language_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+
+async def stream(n_tokens: int, projected: bool) -> Tuple[int, float, float]:
+    """
+    Serialize one stream.
+
+    Returns:
+        Tuple[int, float, float]: The stream size in bytes, its CPU seconds and the
+            CPU seconds spent projecting and serializing events.
+    """
+    answer = " ".join(f"token{i}" for i in range(n_tokens))
+    llm = GenericFakeChatModel(messages=iter([AIMessage(content=answer)]))
+    chain = ChatPromptTemplate.from_messages(
+        [("system", "You are a helpful assistant."), MessagesPlaceholder("messages")]
+    ) | llm
+    input_dict: Dict[str, Any] = {"messages": [("human", "Hello")]}
+    kwargs: Dict[str, Any] = {"version": "v2"}
+    if projected:
+        kwargs["include_types"] = SUPPORTED_RUN_TYPES
+
+    size, serialization, start = 0, 0.0, time.process_time()
+    async for data in chain.astream_events(input_dict, **kwargs):
+        if data["event"] in SUPPORTED_EVENTS:
+            serialization_start = time.process_time()
+            if projected:
+                data = project_event(data)
+            size += len(json.dumps(data, default=default_serialization)) + 1
+            serialization += time.process_time() - serialization_start
+    return size, time.process_time() - start, serialization
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        f"{'tokens':>7} {'format':>10} {'bytes/token':>12} {'cpu_ms/stream':>14} "
+        f"{'serialize_ms':>13}"
+    )
+    for n_tokens in args.tokens:
+        for projected in (False, True):
+            runs = [
+                asyncio.run(stream(n_tokens, projected)) for _ in range(args.repeat)
+            ]
+            size = runs[0][0]
+            cpu_ms = 1000 * min(cpu for _, cpu, _ in runs)
+            serialize_ms = 1000 * min(serialization for _, _, serialization in runs)
+            print(
+                f"{n_tokens:>7} {'projected' if projected else 'full':>10} "
+                f"{size / n_tokens:>12.1f} {cpu_ms:>14.2f} {serialize_ms:>13.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Latency and recall of vector, lexical, hybrid and auto retrieval on a PDF corpus.
+
+Known-item evaluation: queries are derived from sampled chunks and a query hits when
+its chunk is among the k retrieved documents. Two kinds of queries are generated:
+    - keyword: the rarest terms of the chunk, like a lookup of a name or error code,
+    - sentence: the first sentence of the chunk, like a natural language question.
+
+The results are written to a JSON report, read by the RAG chain to decide whether
+RETRIEVAL_MODE="auto" may be served: it is only enabled when "auto" keeps the
+recall@k of "hybrid" for both kinds of queries. Run it on the served corpus (by
+default the MLOps whitepaper) with the served embedding model and TOP_K.
+
+Requires a running Ollama server for the embeddings.
+
+Usage:
+    poetry run python -m benchmarks.hybrid_retrieval --queries 100
+"""
+import argparse
+import json
+import re
+import time
+from typing import Any, Dict, List, Tuple
+
+from app.patterns.custom_rag_qa.bm25 import BM25Index, tokenize
+from app.patterns.custom_rag_qa.chain import RETRIEVAL_BENCHMARK_PATH, TOP_K
+from app.patterns.custom_rag_qa.hybrid_retriever import (
+    HybridRetriever,
+    auto_mode_keeps_recall,
+)
+from app.patterns.custom_rag_qa.indexing import chunk_id
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from app.patterns.custom_rag_qa.vector_store import URL, load_and_split_documents
+from langchain_core.documents import Document
+from langchain_ollama import OllamaEmbeddings
+import numpy as np
+
+MODES = ("vector", "lexical", "hybrid", "auto")
+
+
+def make_queries(
+    chunks: List[Document], n_queries: int, seed: int
+) -> Dict[str, List[Tuple[str, str]]]:
+    """Sample (query, expected chunk id) pairs of each kind."""
+    document_frequency: Dict[str, int] = {}
+    for chunk in chunks:
+        for term in set(tokenize(chunk.page_content)):
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(chunks), size=min(n_queries, len(chunks)), replace=False)
+    queries: Dict[str, List[Tuple[str, str]]] = {"keyword": [], "sentence": []}
+    for i in sample:
+        chunk = chunks[i]
+        terms = sorted(
+            {term for term in tokenize(chunk.page_content) if len(term) > 3},
+            key=lambda term: document_frequency[term],
+        )
+        if terms:
+            queries["keyword"].append((" ".join(terms[:2]), chunk.id))
+        sentence = re.split(r"(?<=[.!?])\s+", chunk.page_content.strip())[0]
+        queries["sentence"].append((" ".join(sentence.split()[:30]), chunk.id))
+    return queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--embedding-model", default="nomic-embed-text")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=TOP_K)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=RETRIEVAL_BENCHMARK_PATH)
+    args = parser.parse_args()
+
+    chunks = load_and_split_documents(args.url)
+    for chunk in chunks:
+        chunk.id = chunk_id(chunk.metadata["source"], chunk.page_content)
+    chunks = list({chunk.id: chunk for chunk in chunks}.values())
+
+    vector_store = NumpyVectorStore(OllamaEmbeddings(model=args.embedding_model))
+    vector_store.add_documents(chunks, ids=[chunk.id for chunk in chunks])
+    lexical_index = BM25Index()
+    lexical_index.sync(vector_store)
+    queries = make_queries(chunks, args.queries, args.seed)
+    print(f"{len(chunks)} chunks, k={args.k}")
+
+    print(f"{'queries':>8} {'mode':>8} {'recall':>7} {'p50_ms':>8} {'p95_ms':>8}")
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+    for kind, pairs in queries.items():
+        results[kind] = {}
+        for mode in MODES:
+            retriever = HybridRetriever(
+                vector_store=vector_store,
+                lexical_index=lexical_index,
+                mode=mode,
+                k=args.k,
+            )
+            latencies, hits = [], 0
+            for query, expected in pairs:
+                start = time.perf_counter()
+                docs = retriever.invoke(query)
+                latencies.append(time.perf_counter() - start)
+                hits += expected in {doc.id for doc in docs}
+            result = results[kind][mode] = {
+                "recall": hits / len(pairs),
+                "p50_ms": 1000 * float(np.percentile(latencies, 50)),
+                "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+            }
+            print(
+                f"{kind:>8} {mode:>8} {result['recall']:>7.3f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}"
+            )
+
+    report: Dict[str, Any] = {
+        "corpus": args.url,
+        "embedding_model": args.embedding_model,
+        "k": args.k,
+        "queries": args.queries,
+        "results": results,
+    }
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    enabled = "enabled" if auto_mode_keeps_recall(report) else "disabled"
+    print(f"Report written to {args.report}, retrieval mode 'auto' is {enabled}")
+
+
+if __name__ == "__main__":
+    main()
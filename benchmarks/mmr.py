@@ -0,0 +1,71 @@
+"""Latency benchmark of MMR re-ranking: stock iterative loop vs vectorized vs batched.
+
+Candidates are random unit vectors, so the selection itself (not the candidate
+search) is measured, for several `fetch_k` values.
+
+Usage:
+    poetry run python -m benchmarks.mmr --fetch-k 20 200 2000
+"""
+import argparse
+import time
+from typing import Callable
+
+from app.patterns.custom_rag_qa.mmr import batched_mmr, mmr
+from app.patterns.custom_rag_qa.numpy_store import normalize
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+import numpy as np
+
+
+def per_query_ms(fn: Callable[[], object], n_queries: int, repeat: int) -> float:
+    """Best wall-clock time of `repeat` runs of fn, in ms per query."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best / n_queries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[20, 200, 2000])
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--lambda-mult", type=float, default=0.5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(
+        f"{'fetch_k':>8} {'stock_ms':>9} {'vectorized_ms':>14} "
+        f"{'batched_ms':>11} {'speedup':>8}"
+    )
+    for fetch_k in args.fetch_k:
+        queries = normalize(rng.normal(size=(args.batch_size, args.dim)))
+        candidates = normalize(rng.normal(size=(args.batch_size, fetch_k, args.dim)))
+
+        def stock() -> None:
+            for query, query_candidates in zip(queries, candidates):
+                maximal_marginal_relevance(
+                    query, query_candidates, lambda_mult=args.lambda_mult, k=args.k
+                )
+
+        def vectorized() -> None:
+            for query, query_candidates in zip(queries, candidates):
+                mmr(query, query_candidates, k=args.k, lambda_mult=args.lambda_mult)
+
+        def batched() -> None:
+            batched_mmr(queries, candidates, k=args.k, lambda_mult=args.lambda_mult)
+
+        stock_ms = per_query_ms(stock, args.batch_size, args.repeat)
+        vectorized_ms = per_query_ms(vectorized, args.batch_size, args.repeat)
+        batched_ms = per_query_ms(batched, args.batch_size, args.repeat)
+        print(
+            f"{fetch_k:>8} {stock_ms:>9.3f} {vectorized_ms:>14.3f} "
+            f"{batched_ms:>11.3f} {stock_ms / batched_ms:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
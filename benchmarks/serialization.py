@@ -0,0 +1,91 @@
+"""Events/s per core of the `/stream_events` serializers.
+
+Serializes the kinds of events streamed by the server, each one on a single core:
+    - chunk: a projected `on_chat_model_stream` event (the bulk of a stream),
+    - raw_chunk: an unprojected one, holding an AIMessageChunk,
+    - tool_end: an `OnToolEndEvent` model holding a ToolMessage with documents.
+
+"json" is the previous `json.dumps(..., default=default_serialization)` path.
+
+Usage:
+    poetry run python -m benchmarks.serialization --events 20000
+"""
+import argparse
+import time
+from typing import Any, Dict
+
+from app.utils.event_projection import project_event
+from app.utils.output_types import OnToolEndEvent
+from app.utils.serialization import SERIALIZERS, Serializer
+from langchain_core.messages import AIMessageChunk, ToolMessage
+
+
+def make_events() -> Dict[str, Any]:
+    raw_chunk = {
+        "event": "on_chat_model_stream",
+        "name": "ChatVertexAI",
+        "run_id": "0b1c6f36-6d4c-4a3e-9b9c-1c2f3e4d5a6b",
+        "tags": ["seq:step:2"],
+        "metadata": {"ls_provider": "google_vertexai", "ls_model_type": "chat"},
+        "parent_ids": ["5f0e6c0d-8f1a-4f47-a8a4-3b2b7f1d2c3e"],
+        "data": {"chunk": AIMessageChunk(content=" token", id="run-0b1c6f36")},
+    }
+    documents = "\n\n".join(f"## Document {i}\n" + "MLOps " * 150 for i in range(4))
+    tool_end = OnToolEndEvent(
+        data={
+            "input": {"query": "What is MLOps?"},
+            "output": ToolMessage(
+                content=documents, tool_call_id="call_1", name="retrieve_docs"
+            ),
+        }
+    )
+    return {
+        "chunk": project_event(raw_chunk),
+        "raw_chunk": raw_chunk,
+        "tool_end": tool_end,
+    }
+
+
+def events_per_second(serialize: Serializer, event: Any, n_events: int) -> float:
+    """Best of 3 runs, in events serialized per second."""
+    best = float("inf")
+    for _ in range(3):
+        start = time.process_time()
+        for _ in range(n_events):
+            serialize(event)
+        best = min(best, time.process_time() - start)
+    return n_events / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+    events = make_events()
+
+    print(f"{'serializer':>10} " + " ".join(f"{kind:>12}" for kind in events))
+    reference = {
+        kind: events_per_second(SERIALIZERS["json"], event, args.events)
+        for kind, event in events.items()
+    }
+    for name, serializer in SERIALIZERS.items():
+        if serializer is None:
+            print(f"{name:>10} (not installed)")
+            continue
+        rates = [
+            events_per_second(serializer, event, args.events)
+            if name != "json"
+            else reference[kind]
+            for kind, event in events.items()
+        ]
+        print(
+            f"{name:>10} "
+            + " ".join(
+                f"{rate / 1000:>6.0f}k {rate / reference[kind]:>4.1f}x"
+                for rate, kind in zip(rates, events)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Recall vs latency benchmark of the vector store backends on synthetic vectors.
+
+Compares the exact `SKLearnVectorStore` against the IVF approximate nearest-neighbour
+index for several corpus sizes and `n_probe` settings. Vectors are drawn from a
+gaussian mixture so that they have cluster structure similar to text embeddings.
+
+Usage:
+    poetry run python -m benchmarks.vector_index --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+from typing import Dict, List
+
+from app.patterns.custom_rag_qa.ivf_store import IVFVectorStore
+from langchain_community.vectorstores import SKLearnVectorStore
+from langchain_core.embeddings import Embeddings
+import numpy as np
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """Embeds "d<i>" as corpus row i and "q<i>" as query row i."""
+
+    def __init__(self, corpus: np.ndarray, queries: np.ndarray) -> None:
+        self.vectors = {"d": corpus, "q": queries}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.vectors["d"][[int(text[1:]) for text in texts]].tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.vectors[text[0]][int(text[1:])].tolist()
+
+
+def make_vectors(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    """Sample n vectors from a mixture of sqrt(n) gaussian clusters."""
+    n_clusters = max(1, int(np.sqrt(n)))
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, n_clusters, size=n)
+    noise = rng.normal(scale=1.0, size=(n, dim)).astype(np.float32)
+    return centers[labels] + noise
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ground truth top-k by cosine similarity."""
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def measure(store: object, n_queries: int, truth: np.ndarray, k: int) -> Dict[str, float]:
+    """Run every query through `similarity_search` and report recall@k and latency."""
+    latencies, hits = [], 0
+    for i in range(n_queries):
+        start = time.perf_counter()
+        docs = store.similarity_search(f"q{i}", k=k)
+        latencies.append(time.perf_counter() - start)
+        hits += len({int(doc.page_content[1:]) for doc in docs} & set(truth[i]))
+    return {
+        "recall": hits / (n_queries * k),
+        "p50_ms": 1000 * float(np.percentile(latencies, 50)),
+        "p95_ms": 1000 * float(np.percentile(latencies, 95)),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument(
+        "--max-sklearn-size",
+        type=int,
+        default=1_000_000,
+        help="Skip the sklearn baseline above this size (it keeps embeddings as Python lists).",
+    )
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    print(f"{'size':>9} {'backend':>14} {'build_s':>8} {'recall':>7} {'p50_ms':>8} {'p95_ms':>8}")
+    for size in args.sizes:
+        corpus = make_vectors(size, args.dim, rng)
+        queries = corpus[rng.choice(size, args.queries)] + rng.normal(
+            scale=0.1, size=(args.queries, args.dim)
+        ).astype(np.float32)
+        truth = exact_neighbours(corpus, queries, args.k)
+        embedding = PrecomputedEmbeddings(corpus, queries)
+        texts = [f"d{i}" for i in range(size)]
+
+        if size <= args.max_sklearn_size:
+            start = time.perf_counter()
+            sklearn_store = SKLearnVectorStore(embedding=embedding)
+            sklearn_store.add_texts(texts)
+            build = time.perf_counter() - start
+            result = measure(sklearn_store, args.queries, truth, args.k)
+            print(
+                f"{size:>9} {'sklearn':>14} {build:>8.1f} {result['recall']:>7.3f} "
+                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}"
+            )
+            del sklearn_store
+
+        start = time.perf_counter()
+        ivf_store = IVFVectorStore(embedding)
+        ivf_store.add_texts(texts)
+        build = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            ivf_store.n_probe = n_probe
+            result = measure(ivf_store, args.queries, truth, args.k)
+            print(
+                f"{size:>9} {f'ivf/probe={n_probe}':>14} {build:>8.1f} "
+                f"{result['recall']:>7.3f} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
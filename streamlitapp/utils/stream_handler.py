@@ -8,6 +8,25 @@ from langchain_core.messages import AIMessage, ToolMessage
 import requests
 import streamlit as st
 from streamlitapp.utils.multimodal_utils import format_content
+from urllib3.util.request import ACCEPT_ENCODING
+
+
+def request_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    The conversation as sent to the server. Tool messages referring to their
+    documents by id are sent without their content, the server resolves the
+    documents again. The stored messages keep their content for display.
+    """
+    return [
+        (
+            {**message, "content": ""}
+            if message.get("type") == "tool"
+            and isinstance(message.get("artifact"), dict)
+            and "doc_refs" in message["artifact"]
+            else message
+        )
+        for message in messages
+    ]
 
 
 @st.cache_resource()
@@ -44,12 +63,27 @@ class Client:
     def stream_events(
         self, data: Dict[str, Any]
     ) -> Generator[Dict[str, Any], None, None]:
-        """Stream events from the server, yielding parsed event data."""
-        headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+        """
+        Stream events from the server, yielding parsed event data.
+        The stream is requested compressed with the encodings urllib3 can decode
+        (gzip, plus br and zstd when installed), and decoded chunk by chunk.
+        """
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        }
         with requests.post(
             self.url, json={"input": data}, headers=headers, stream=True
         ) as response:
-            for line in response.iter_lines():
+            if response.status_code == 429:
+                st.warning(
+                    f"The server is busy: {response.json().get('detail')}. "
+                    "Please retry in a moment."
+                )
+                return
+            # chunk_size=None yields each HTTP chunk, i.e. each event, on arrival
+            for line in response.iter_lines(chunk_size=None):
                 if line:
                     try:
                         event = json.loads(line.decode("utf-8"))
@@ -100,7 +134,7 @@ class EventProcessor:
         ]["messages"]
         stream = self.client.stream_events(
             data={
-                "messages": messages,
+                "messages": request_messages(messages),
                 "user_id": self.st.session_state["user_id"],
                 "session_id": self.st.session_state["session_id"],
             }
@@ -125,6 +159,11 @@ class EventProcessor:
     def handle_metadata(self, event: Dict[str, Any]) -> None:
         """Handle metadata events."""
         self.current_run_id = event["data"].get("run_id")
+        queue_position = event["data"].get("queue_position")
+        if queue_position:
+            self.stream_handler.container.markdown(
+                f"Waiting for the server (position {queue_position} in the queue)..."
+            )
 
     def handle_tool_start(self, event: Dict[str, Any]) -> None:
         """Handle the start of a tool or retriever execution."""
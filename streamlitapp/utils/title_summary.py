@@ -3,10 +3,10 @@
 # flake8: noqa: W291
 
 
+from app.utils.model_clients import chat_model
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_ollama import ChatOllama
 
-llm = ChatOllama(model="llama3-groq-tool-use:latest", temperature=0)
+llm = chat_model("llama3-groq-tool-use:latest", temperature=0)
 
 title_template = ChatPromptTemplate.from_messages(
     [("system", """Given a list of messages between a human and AI, come up with a short and relevant title for the conversation. Use up to 10 words. The title needs to be concise.
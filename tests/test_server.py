@@ -102,3 +102,167 @@ async def test_stream_chat_events() -> None:
         assert events[2]["event"] == "on_chat_model_stream"
         assert events[2]["data"]["content"] == "Additional response"
         assert events[3]["event"] == "end"
+
+
+def test_metrics_endpoint() -> None:
+    """
+    Test that the /metrics endpoint exposes registered metrics in text format.
+    """
+    from app.server import app
+    from app.utils.metrics import metrics
+    from fastapi.testclient import TestClient
+
+    metrics.counter("test_requests_total", "Requests seen by the test").inc(route="/")
+
+    client = TestClient(app)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "# TYPE test_requests_total counter" in response.text
+    assert 'test_requests_total{route="/"} 1.0' in response.text
+
+
+@pytest.mark.asyncio
+async def test_stream_chat_events_compression() -> None:
+    """
+    Test that the stream is compressed when the client accepts it, and sent as is
+    otherwise.
+    """
+    from app.server import app
+
+    input_data = {
+        "input": {"messages": [{"type": "human", "content": "Hello, AI!"}]}
+    }
+    mock_events = [
+        {"event": "on_chat_model_stream", "data": {"content": "Mocked response"}}
+    ]
+
+    for accept_encoding, content_encoding in [("gzip", "gzip"), ("identity", None)]:
+        with patch("app.server.chain") as mock_chain:
+            mock_chain.astream_events.return_value = AsyncIterator(mock_events)
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                response = await ac.post(
+                    "/stream_events",
+                    json=input_data,
+                    headers={"Accept-Encoding": accept_encoding},
+                )
+
+        assert response.headers.get("content-encoding") == content_encoding
+        events = [json.loads(line) for line in response.iter_lines()]
+        assert [event["event"] for event in events] == [
+            "metadata",
+            "on_chat_model_stream",
+            "end",
+        ]
+
+
+@pytest.mark.asyncio
+async def test_named_chain_stream_and_health() -> None:
+    """
+    Test that registered chains are served at /chains/{name}/stream_events, loaded
+    on their first request and reported at /health.
+    """
+    from app.server import app, registry
+
+    mock_chain = MagicMock()
+    mock_chain.astream_events.return_value = AsyncIterator(
+        [{"event": "on_chat_model_stream", "data": {"content": "From test chain"}}]
+    )
+    registry.register("test_server_chain", lambda: mock_chain)
+    input_data = {"input": {"messages": [{"type": "human", "content": "Hello"}]}}
+
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        health = (await ac.get("/health")).json()
+        assert health["chains"]["test_server_chain"] == {"loaded": False}
+
+        response = await ac.post(
+            "/chains/test_server_chain/stream_events", json=input_data
+        )
+        events = [json.loads(line) for line in response.iter_lines()]
+        assert events[1]["data"]["content"] == "From test chain"
+
+        health = (await ac.get("/health")).json()
+        assert health["chains"]["test_server_chain"]["loaded"]
+        assert health["chains"]["default"]["loaded"]
+
+        response = await ac.post("/chains/unknown/stream_events", json=input_data)
+        assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_stream_admission_control() -> None:
+    """
+    Test that streams over the session limit get a 429, and that queued streams
+    start with their queue position.
+    """
+    import asyncio
+
+    from app.server import app
+    from app.utils.admission import AdmissionController
+
+    controller = AdmissionController(max_concurrency=1, max_per_session=1)
+    input_data = {
+        "input": {
+            "session_id": "session",
+            "messages": [{"type": "human", "content": "Hello, AI!"}],
+        }
+    }
+    mock_events = [
+        {"event": "on_chat_model_stream", "data": {"content": "Mocked response"}}
+    ]
+
+    with patch("app.server.admission", controller), patch(
+        "app.server.chain"
+    ) as mock_chain:
+        mock_chain.astream_events.return_value = AsyncIterator(mock_events)
+        async with AsyncClient(app=app, base_url="http://test") as ac:
+            ticket = controller.admit(session_id="session")
+            response = await ac.post("/stream_events", json=input_data)
+            assert response.status_code == 429
+            ticket.release()
+
+            # Another session holds the only slot for a moment
+            ticket = controller.admit(session_id="other")
+            asyncio.get_running_loop().call_later(0.05, ticket.release)
+            response = await ac.post("/stream_events", json=input_data)
+
+    events = [json.loads(line) for line in response.iter_lines()]
+    assert events[0]["data"]["queue_position"] == 1
+    assert [event["event"] for event in events] == [
+        "metadata",
+        "on_chat_model_stream",
+        "end",
+    ]
+    assert controller.active == 0
+
+
+@pytest.mark.asyncio
+async def test_closed_stream_cancels_chain_run(sample_input_chat: InputChat) -> None:
+    """
+    Test that closing the event stream early, as Starlette does when the client
+    disconnects, cancels the chain run and closes the chain stream.
+    """
+    import asyncio
+
+    from app.server import select_event, stream_event_response
+    from app.utils.chain_run import ChainRun
+
+    closed = asyncio.Event()
+
+    async def slow_events(*args: Any, **kwargs: Any) -> Any:
+        try:
+            while True:
+                yield {"event": "on_chat_model_stream", "data": {"content": "a"}}
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    runnable = MagicMock()
+    runnable.astream_events.side_effect = slow_events
+    run = ChainRun(select=select_event)
+    with patch("app.server.COALESCE_WINDOW", 0):
+        stream = stream_event_response(sample_input_chat, runnable=runnable, run=run)
+        await stream.__anext__()
+        await stream.__anext__()
+        await stream.aclose()
+    await asyncio.wait_for(closed.wait(), 1)
+    assert run.cancelled and not run.completed
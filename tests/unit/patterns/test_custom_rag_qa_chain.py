@@ -0,0 +1,307 @@
+import asyncio
+import importlib
+import os
+import time
+from types import ModuleType
+from typing import Any, AsyncIterator, Dict, List
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.patterns.custom_rag_qa.bm25 import BM25Index
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from app.patterns.custom_rag_qa.router import HeuristicRouter
+from app.utils.semantic_cache import SemanticCache
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.runnables import RunnableLambda
+import pytest
+
+LATENCY = 0.2
+
+
+async def fake_inspection(_: Dict[str, Any]) -> AIMessage:
+    """Simulate the inspection LLM round-trip deciding to retrieve documents."""
+    await asyncio.sleep(LATENCY)
+    return AIMessage(
+        content="",
+        tool_calls=[
+            {"name": "retrieve_docs", "args": {"query": "MLOps"}, "id": "call_1"}
+        ],
+    )
+
+
+class FakeRetriever:
+    """A retriever whose vector search blocks the calling thread."""
+
+    def invoke(self, query: str) -> List[Document]:
+        time.sleep(LATENCY)
+        return [Document(page_content=f"Context for {query}")]
+
+
+class FakeResponseChain:
+    """A response chain streaming a few tokens with model-like latency."""
+
+    async def astream(self, input: Dict[str, Any]) -> AsyncIterator[AIMessageChunk]:
+        for token in ["MLOps ", "is ", "great."]:
+            await asyncio.sleep(LATENCY / 3)
+            yield AIMessageChunk(content=token)
+
+
+@pytest.fixture
+def rag_chain_module(tmp_path: str, monkeypatch: pytest.MonkeyPatch) -> ModuleType:
+    """Import the custom RAG chain with a fake vector store and fake models."""
+    # Keep files created at import time (e.g. the embedding cache) out of the repo
+    monkeypatch.chdir(tmp_path)
+    with patch(
+        "app.patterns.custom_rag_qa.vector_store.get_vector_store",
+        return_value=MagicMock(spec=NumpyVectorStore),
+    ), patch(
+        "app.patterns.custom_rag_qa.vector_store.get_lexical_index",
+        return_value=BM25Index(),
+    ):
+        module = importlib.import_module("app.patterns.custom_rag_qa.chain")
+
+    with patch.object(
+        module, "inspect_conversation", RunnableLambda(fake_inspection)
+    ), patch.object(module, "retriever", FakeRetriever()), patch.object(
+        module, "response_chain", FakeResponseChain()
+    ), patch.object(
+        module, "router", None
+    ):
+        yield module
+
+
+async def _run_stream(module: ModuleType) -> List[Dict[str, Any]]:
+    input_dict = {"messages": [HumanMessage("What is MLOps?")]}
+    return [event async for event in module.chain.astream_events(input_dict)]
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_streams_tool_and_model_events(
+    rag_chain_module: ModuleType,
+) -> None:
+    """The async path yields the retrieval result followed by the streamed answer."""
+    events = await _run_stream(rag_chain_module)
+
+    assert events[0]["event"] == "on_tool_end"
+    assert events[0]["data"]["output"]["artifact"][0]["page_content"] == (
+        "Context for MLOps"
+    )
+    tokens = [e["data"]["chunk"]["content"] for e in events[1:]]
+    assert "".join(tokens) == "MLOps is great."
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_parallel_streams_do_not_block(
+    rag_chain_module: ModuleType,
+) -> None:
+    """N parallel streams finish in about the time of a single one."""
+    start = time.perf_counter()
+    await _run_stream(rag_chain_module)
+    single_duration = time.perf_counter() - start
+
+    n_streams = rag_chain_module.RETRIEVAL_MAX_WORKERS
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[_run_stream(rag_chain_module) for _ in range(n_streams)]
+    )
+    parallel_duration = time.perf_counter() - start
+
+    assert all(len(events) == 4 for events in results)
+    assert parallel_duration < single_duration * 1.5, (
+        f"{n_streams} parallel streams took {parallel_duration:.2f}s, "
+        f"a single stream took {single_duration:.2f}s"
+    )
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_replays_semantic_cache_hits(
+    rag_chain_module: ModuleType,
+) -> None:
+    """A repeated question skips the inspection and response LLM calls."""
+    inspection = AsyncMock(side_effect=fake_inspection)
+    cache = SemanticCache(DeterministicFakeEmbedding(size=16))
+    with patch.object(rag_chain_module, "semantic_cache", cache), patch.object(
+        rag_chain_module, "inspect_conversation", RunnableLambda(inspection)
+    ):
+        first = await _run_stream(rag_chain_module)
+        start = time.perf_counter()
+        second = await _run_stream(rag_chain_module)
+        replay_duration = time.perf_counter() - start
+
+    assert inspection.call_count == 1
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    assert second == [
+        {**event, "id": second[i]["id"]} if "id" in event else event
+        for i, event in enumerate(first)
+    ]
+    # Only the retrieval is re-run to check the documents did not change
+    assert replay_duration < 2 * LATENCY
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_semantic_cache_misses_on_changed_documents(
+    rag_chain_module: ModuleType,
+) -> None:
+    """A similar conversation whose documents changed is a miss, not a hit."""
+    inspection = AsyncMock(side_effect=fake_inspection)
+    cache = SemanticCache(DeterministicFakeEmbedding(size=16))
+    with patch.object(rag_chain_module, "semantic_cache", cache), patch.object(
+        rag_chain_module, "inspect_conversation", RunnableLambda(inspection)
+    ):
+        await _run_stream(rag_chain_module)
+        retriever = MagicMock()
+        retriever.invoke.return_value = [Document(page_content="Updated", id="new")]
+        with patch.object(rag_chain_module, "retriever", retriever):
+            await _run_stream(rag_chain_module)
+
+    assert inspection.call_count == 2
+    assert (cache.stats.hits, cache.stats.misses) == (0, 2)
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_local_router_skips_inspection(
+    rag_chain_module: ModuleType,
+) -> None:
+    """A confident local routing decision replaces the inspection LLM round-trip."""
+    inspection = AsyncMock(side_effect=fake_inspection)
+    with patch.object(rag_chain_module, "router", HeuristicRouter()), patch.object(
+        rag_chain_module, "inspect_conversation", RunnableLambda(inspection)
+    ):
+        events = await _run_stream(rag_chain_module)
+
+    assert inspection.call_count == 0
+    assert events[0]["data"]["input"] == {"query": "What is MLOps?"}
+    assert events[0]["data"]["output"]["artifact"][0]["page_content"] == (
+        "Context for What is MLOps?"
+    )
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_speculative_retrieval(rag_chain_module: ModuleType) -> None:
+    """Speculative retrieval hides the retrieval latency behind the inspection."""
+    start = time.perf_counter()
+    baseline = await _run_stream(rag_chain_module)
+    baseline_duration = time.perf_counter() - start
+
+    async def inspect_with_user_query(input: Dict[str, Any]) -> AIMessage:
+        message = await fake_inspection(input)
+        message.tool_calls[0]["args"] = {"query": "What is MLOps?"}
+        return message
+
+    with patch.object(rag_chain_module, "SPECULATIVE_RETRIEVAL", True), patch.object(
+        rag_chain_module, "inspect_conversation", RunnableLambda(inspect_with_user_query)
+    ):
+        start = time.perf_counter()
+        events = await _run_stream(rag_chain_module)
+        duration = time.perf_counter() - start
+
+    assert [event["event"] for event in events] == [
+        event["event"] for event in baseline
+    ]
+    assert baseline_duration - duration > LATENCY / 2
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_refers_to_documents_by_id(
+    rag_chain_module: ModuleType,
+) -> None:
+    """Documents are sent once, and resolved from their ids on the next turn."""
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=8))
+    store.add_texts(["MLOps is DevOps for ML."], ids=["doc-1"])
+    retriever = MagicMock()
+    retriever.invoke.return_value = store.get_by_ids(["doc-1"])
+    response_inputs: List[Dict[str, Any]] = []
+
+    class RecordingResponseChain(FakeResponseChain):
+        async def astream(
+            self, input: Dict[str, Any]
+        ) -> AsyncIterator[AIMessageChunk]:
+            response_inputs.append(input)
+            async for chunk in super().astream(input):
+                yield chunk
+
+    with patch.object(rag_chain_module, "vector_store", store), patch.object(
+        rag_chain_module, "retriever", retriever
+    ), patch.object(rag_chain_module, "response_chain", RecordingResponseChain()):
+        events = await _run_stream(rag_chain_module)
+        tool_message = events[0]["data"]["output"]
+        assert tool_message["artifact"] == {"doc_refs": ["doc-1"]}
+        assert "MLOps is DevOps for ML." in tool_message["content"]
+
+        # The client sends the tool message back with the ids only
+        history = [
+            HumanMessage("What is MLOps?").model_dump(),
+            {**tool_message, "content": ""},
+            AIMessage("MLOps is great.").model_dump(),
+            HumanMessage("Tell me more").model_dump(),
+        ]
+        await _alist(rag_chain_module.chain.astream_events({"messages": history}))
+
+    assert response_inputs[1]["messages"][1]["content"] == tool_message["content"]
+
+
+async def _alist(events: AsyncIterator[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [event async for event in events]
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_loads_resources_off_the_event_loop(
+    rag_chain_module: ModuleType,
+) -> None:
+    """Building a resource on first use does not block the other streams."""
+
+    def slow_router(*args: Any, **kwargs: Any) -> None:
+        time.sleep(LATENCY)
+
+    max_gap = 0.0
+
+    async def tick() -> None:
+        nonlocal max_gap
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LATENCY / 10)
+            max_gap = max(max_gap, time.perf_counter() - start)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0)
+    with patch.object(
+        rag_chain_module, "router", rag_chain_module.NOT_LOADED
+    ), patch.object(rag_chain_module, "get_router", slow_router):
+        events = await _run_stream(rag_chain_module)
+        assert rag_chain_module.router is None
+    ticker.cancel()
+
+    assert len(events) == 4
+    # The event loop kept running while the router was built
+    assert max_gap < LATENCY / 2
+
+
+@pytest.mark.asyncio
+async def test_rag_chain_reloads_new_vector_store_generations(
+    rag_chain_module: ModuleType, tmp_path: str
+) -> None:
+    """A generation persisted by another process is served without a restart."""
+    embedding = DeterministicFakeEmbedding(size=16)
+    persist_path = os.path.join(tmp_path, "store")
+    served = NumpyVectorStore.from_texts(
+        ["MLOps basics"], embedding, ids=["a"], persist_path=persist_path
+    )
+    served.persist()
+    lexical_index = BM25Index()
+    lexical_index.sync(served)
+
+    writer = NumpyVectorStore(embedding, persist_path=persist_path)
+    writer.add_texts(["Continuous training"], ids=["b"])
+    writer.persist()
+
+    with patch.object(rag_chain_module, "vector_store", served), patch.object(
+        rag_chain_module, "lexical_index", lexical_index
+    ), patch.object(rag_chain_module, "_reload_checked_at", 0.0):
+        await _run_stream(rag_chain_module)
+        assert set(served.ids) == lexical_index.ids == {"a", "b"}
+        # Checked again only after VECTOR_STORE_RELOAD_INTERVAL
+        writer.delete(["b"])
+        writer.persist()
+        assert not rag_chain_module.reload_vector_store()
+        assert "b" in served.ids
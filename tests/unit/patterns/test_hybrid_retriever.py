@@ -0,0 +1,171 @@
+import json
+import os
+import sys
+import threading
+from typing import List
+
+from app.patterns.custom_rag_qa.bm25 import BM25Index, tokenize
+from app.patterns.custom_rag_qa.hybrid_retriever import (
+    HybridRetriever,
+    is_keyword_query,
+    reciprocal_rank_fusion,
+    resolve_retrieval_mode,
+)
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from app.patterns.custom_rag_qa.vector_store import get_lexical_index
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import pytest
+
+TEXTS = [
+    "Model monitoring detects data drift and training-serving skew.",
+    "Deployment failed with error ERR-4042 when the model registry was unreachable.",
+    "Continuous training pipelines retrain models on fresh data.",
+    "Feature stores share features between training and serving.",
+]
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings recording the number of query embeddings."""
+
+    queries: int = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queries += 1
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def store() -> NumpyVectorStore:
+    store = NumpyVectorStore(CountingEmbeddings(size=16))
+    store.add_texts(TEXTS, ids=[f"doc{i}" for i in range(len(TEXTS))])
+    return store
+
+
+def test_tokenize_keeps_compound_terms() -> None:
+    assert tokenize("The ERR-4042 of tf.keras") == [
+        "err-4042",
+        "err",
+        "4042",
+        "tf.keras",
+        "tf",
+        "keras",
+    ]
+
+
+def test_bm25_ranks_exact_terms_and_stays_in_sync(
+    store: NumpyVectorStore, tmp_path: str
+) -> None:
+    index = BM25Index()
+    assert index.sync(store)
+    assert index.search("ERR-4042", k=2)[0][0] == "doc1"
+    assert index.search("serving", k=4)[0][0] in {"doc0", "doc3"}
+
+    store.delete(["doc1"])
+    store.add_texts(["ERR-4042 was fixed in release 2.1"], ids=["doc4"])
+    assert index.sync(store)
+    assert not index.sync(store)
+    assert [id_ for id_, _ in index.search("ERR-4042")] == ["doc4"]
+
+    path = os.path.join(tmp_path, "bm25.json")
+    index.save(path)
+    loaded = BM25Index.load(path)
+    assert loaded.search("training serving") == index.search("training serving")
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("ERR-4042", True),
+        ('"model registry"', True),
+        ("feature store", True),
+        ("What is continuous training?", False),
+        ("How do I monitor drift in production models", False),
+        ("monitoring drift of deployed production models over time", False),
+    ],
+)
+def test_is_keyword_query(query: str, expected: bool) -> None:
+    assert is_keyword_query(query) == expected
+
+
+def test_reciprocal_rank_fusion() -> None:
+    assert reciprocal_rank_fusion([["a", "b"], ["b", "c"]]) == ["b", "a", "c"]
+
+
+def test_lexical_mode_skips_the_embedding_call(store: NumpyVectorStore) -> None:
+    retriever = HybridRetriever(
+        vector_store=store, lexical_index=BM25Index(), mode="auto", k=2
+    )
+    retriever.lexical_index.sync(store)
+
+    docs = retriever.invoke("ERR-4042")
+    assert docs[0].id == "doc1"
+    assert store.embeddings.queries == 0
+
+    docs = retriever.invoke("What keeps training and serving features consistent?")
+    assert len(docs) == 2
+    assert store.embeddings.queries == 1
+
+
+def test_get_lexical_index_is_persisted(tmp_path: str) -> None:
+    persist_path = os.path.join(tmp_path, "store")
+    store = NumpyVectorStore(CountingEmbeddings(size=16), persist_path=persist_path)
+    store.add_texts(TEXTS)
+    store.persist()
+
+    index = get_lexical_index(store, persist_path)
+    assert os.path.isfile(os.path.join(persist_path, "bm25.json"))
+    assert len(get_lexical_index(store, persist_path)) == len(index) == len(TEXTS)
+    with pytest.raises(ValueError, match="backends"):
+        get_lexical_index(store, persist_path, backend="sklearn")
+
+
+def test_auto_mode_needs_measured_recall(tmp_path: str) -> None:
+    report_path = os.path.join(tmp_path, "retrieval_benchmark.json")
+    assert resolve_retrieval_mode("lexical", report_path) == "lexical"
+    assert resolve_retrieval_mode("auto", report_path) == "vector"
+
+    def write_report(auto_recall: float) -> None:
+        results = {
+            kind: {"hybrid": {"recall": 0.9}, "auto": {"recall": auto_recall}}
+            for kind in ("keyword", "sentence")
+        }
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump({"results": results}, f)
+
+    write_report(0.8)
+    assert resolve_retrieval_mode("auto", report_path) == "vector"
+    write_report(0.9)
+    assert resolve_retrieval_mode("auto", report_path) == "auto"
+
+
+def test_bm25_search_during_sync(store: NumpyVectorStore) -> None:
+    index = BM25Index()
+    store.add_texts([f"release notes {i} for ERR-4042" for i in range(200)])
+    index.sync(store)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def search() -> None:
+        while not stop.is_set():
+            try:
+                index.search("ERR-4042 release notes", k=4)
+            except BaseException as e:  # pragma: no cover - the failure being tested
+                errors.append(e)
+                return
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    searcher = threading.Thread(target=search)
+    searcher.start()
+    try:
+        for i in range(20):
+            texts = [f"release {i}.{j} fixes ERR-4042" for j in range(50)]
+            ids = store.add_texts(texts)
+            index.sync(store)
+            store.delete(ids)
+            index.sync(store)
+    finally:
+        stop.set()
+        searcher.join()
+        sys.setswitchinterval(switch_interval)
+    assert not errors
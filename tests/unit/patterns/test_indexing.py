@@ -0,0 +1,106 @@
+import os
+import threading
+from typing import Callable, List
+
+from app.patterns.custom_rag_qa.indexing import reindex
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from langchain.text_splitter import CharacterTextSplitter
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import pytest
+
+# One chunk per page
+SPLITTER = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings recording how many documents were embedded."""
+
+    embedded: int = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+@pytest.fixture
+def write_source(write_pdf: Callable[[str, List[str]], None]) -> Callable[..., str]:
+    """Writes a PDF source with one "Document <name> page <page>" line per page."""
+
+    def write(path: str, name: str, pages: range) -> str:
+        write_pdf(path, [f"Document {name} page {page} about MLOps" for page in pages])
+        return path
+
+    return write
+
+
+def test_reindex_only_embeds_changes(
+    tmp_path: str, write_source: Callable[..., str]
+) -> None:
+    """Unchanged sources are skipped and changed sources only embed their new chunks."""
+    a = write_source(os.path.join(tmp_path, "a.pdf"), "a", range(5))
+    b = write_source(os.path.join(tmp_path, "b.pdf"), "b", range(5))
+    embedding = CountingEmbeddings(size=16)
+    store = NumpyVectorStore(embedding, persist_path=os.path.join(tmp_path, "store"))
+
+    stats = reindex(store, [a, b], text_splitter=SPLITTER, max_workers=1)
+    assert (stats.sources_changed, stats.chunks_added) == (2, 10)
+    assert embedding.embedded == 10
+    store.persist()
+
+    # Reload from disk: the manifest is persisted with the store
+    store = NumpyVectorStore(embedding, persist_path=os.path.join(tmp_path, "store"))
+    stats = reindex(store, [a, b], text_splitter=SPLITTER, max_workers=1)
+    assert (stats.sources_unchanged, stats.sources_changed) == (2, 0)
+    assert embedding.embedded == 10
+
+    # Page 4 removed, pages 5 and 6 added
+    write_source(a, "a", [0, 1, 2, 3, 5, 6])
+    stats = reindex(store, [a, b], text_splitter=SPLITTER, max_workers=1)
+    assert stats.sources_changed == 1
+    assert (stats.chunks_added, stats.chunks_unchanged, stats.chunks_removed) == (
+        2,
+        4,
+        1,
+    )
+    assert embedding.embedded == 12
+    assert len(store) == 11
+
+    stats = reindex(store, [b], text_splitter=SPLITTER, max_workers=1)
+    assert (stats.sources_removed, stats.chunks_removed) == (1, 6)
+    assert len(store) == 5
+    assert {doc.metadata["source"] for doc in store.similarity_search("MLOps", k=10)} == {
+        b
+    }
+
+
+def test_compaction_while_serving(tmp_path: str) -> None:
+    """Queries keep returning live documents while a background compaction runs."""
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=16))
+    ids = store.add_texts([f"text {i}" for i in range(2000)])
+    store.delete(ids[:1500])
+    assert store.tombstone_ratio == 0.75
+
+    errors: List[Exception] = []
+    done = threading.Event()
+
+    def serve() -> None:
+        while not done.is_set():
+            try:
+                docs = store.similarity_search("text 1999", k=5)
+                assert len(docs) == 5
+                assert all(int(doc.page_content.split()[1]) >= 1500 for doc in docs)
+            except Exception as e:  # noqa: BLE001
+                errors.append(e)
+
+    readers = [threading.Thread(target=serve) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    store.compact_in_background().join()
+    done.set()
+    for reader in readers:
+        reader.join()
+
+    assert not errors
+    assert store.tombstone_ratio == 0.0
+    assert len(store) == 500
+    assert store.get_by_ids([ids[1999]])[0].page_content == "text 1999"
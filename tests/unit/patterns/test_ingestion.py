@@ -0,0 +1,47 @@
+import os
+from typing import Callable, List
+
+from app.patterns.custom_rag_qa.ingestion import ingest, iter_pdf_pages, resolve_sources
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import pytest
+
+
+@pytest.fixture
+def pdf_dir(tmp_path: str, write_pdf: Callable[[str, List[str]], None]) -> str:
+    for name in ("a", "b"):
+        write_pdf(
+            os.path.join(tmp_path, f"{name}.pdf"),
+            [f"Document {name} page {page} about MLOps" for page in range(5)],
+        )
+    return str(tmp_path)
+
+
+def test_iter_pdf_pages_preserves_order(pdf_dir: str) -> None:
+    """Pages parsed across the process pool come back in source and page order."""
+    sources = resolve_sources([pdf_dir])
+    pages = list(iter_pdf_pages(sources, max_workers=2, pages_per_task=2))
+
+    assert [(os.path.basename(p.metadata["source"]), p.metadata["page"]) for p in pages] == [
+        (name, page) for name in ("a.pdf", "b.pdf") for page in range(5)
+    ]
+    assert pages[7].page_content.strip() == "Document b page 2 about MLOps"
+
+
+def test_ingest_appends_batches_to_the_index(pdf_dir: str) -> None:
+    """All chunks are embedded in batches and appended to the store."""
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=16))
+
+    stats = ingest(
+        resolve_sources([os.path.join(pdf_dir, "*.pdf")]),
+        store,
+        batch_size=3,
+        max_concurrency=2,
+        max_workers=2,
+    )
+
+    assert stats.pages == 10
+    assert stats.chunks == len(store) == 10
+    assert stats.pages_per_second > 0
+    docs = store.similarity_search("Document a page 4 about MLOps", k=1)
+    assert docs[0].metadata["page"] == 4
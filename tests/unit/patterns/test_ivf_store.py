@@ -0,0 +1,100 @@
+import os
+from typing import List
+
+from app.patterns.custom_rag_qa.ivf_store import IVFVectorStore
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from app.patterns.custom_rag_qa.vector_store import get_vector_store
+from langchain_core.embeddings import Embeddings
+import numpy as np
+import pytest
+
+
+class LookupEmbeddings(Embeddings):
+    """Embeds the text "<i>" as row i of a fixed matrix, other texts as a seeded vector."""
+
+    def __init__(self, matrix: np.ndarray) -> None:
+        self.matrix = matrix
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        if text.isdigit():
+            return self.matrix[int(text)].tolist()
+        rng = np.random.default_rng(abs(hash(text)) % 2**32)
+        return rng.normal(size=self.matrix.shape[1]).tolist()
+
+
+@pytest.fixture
+def clustered_vectors() -> np.ndarray:
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(32, 16))
+    labels = rng.integers(0, 32, size=5000)
+    return (centers[labels] + 0.1 * rng.normal(size=(5000, 16))).astype(np.float32)
+
+
+def test_ivf_store_recall_against_exact_search(clustered_vectors: np.ndarray) -> None:
+    """The ANN index finds nearly all exact nearest neighbours."""
+    embedding = LookupEmbeddings(clustered_vectors)
+    store = IVFVectorStore(embedding, n_probe=4, min_train_size=1000)
+    store.add_texts([str(i) for i in range(len(clustered_vectors))])
+    assert store._centroids is not None
+
+    normalized = clustered_vectors / np.linalg.norm(
+        clustered_vectors, axis=1, keepdims=True
+    )
+    hits = 0
+    for query_row in range(0, 5000, 100):
+        exact = np.argsort(-(normalized @ normalized[query_row]))[:10]
+        docs = store.similarity_search(str(query_row), k=10)
+        hits += len({int(doc.page_content) for doc in docs} & set(exact.tolist()))
+    assert hits / (50 * 10) >= 0.9
+
+
+def test_ivf_store_mmr_retriever_and_persistence(
+    tmp_path: str, clustered_vectors: np.ndarray
+) -> None:
+    """The store honours the MMR retriever contract and survives a persist/load cycle."""
+    embedding = LookupEmbeddings(clustered_vectors)
+    persist_path = os.path.join(tmp_path, "store.ivf")
+    store = IVFVectorStore(embedding, persist_path=persist_path, min_train_size=1000)
+    store.add_texts(
+        [str(i) for i in range(2000)], metadatas=[{"row": i} for i in range(2000)]
+    )
+    store.persist()
+
+    reloaded = get_vector_store(embedding, persist_path=persist_path, backend="ivf")
+    retriever = reloaded.as_retriever(
+        search_type="mmr", search_kwargs={"k": 5, "fetch_k": 20, "lambda_mult": 0.5}
+    )
+    docs = retriever.invoke("7")
+
+    assert len(docs) == 5
+    assert docs[0].page_content == "7"
+    assert docs[0].metadata["row"] == 7
+    assert docs[0].id == docs[0].metadata["id"]
+
+
+def test_get_vector_store_rejects_unknown_backend() -> None:
+    with pytest.raises(ValueError, match="Unknown vector store backend"):
+        get_vector_store(LookupEmbeddings(np.eye(2)), backend="annoy")
+
+
+def test_ivf_store_reloads_a_generation_without_index(
+    tmp_path: str, clustered_vectors: np.ndarray
+) -> None:
+    """A generation persisted without an IVF index is indexed from scratch."""
+    embedding = LookupEmbeddings(clustered_vectors)
+    persist_path = os.path.join(tmp_path, "store.ivf")
+    store = IVFVectorStore(embedding, persist_path=persist_path, min_train_size=1000)
+    store.add_texts([str(i) for i in range(2000)])
+    store.persist()
+
+    # Another writer persists the next generation without an IVF index
+    writer = NumpyVectorStore(embedding, persist_path=persist_path)
+    writer.add_texts([str(i) for i in range(2000, 2500)])
+    writer.persist()
+
+    assert store.reload()
+    assert len(store._assignments) == store._size == 2500
+    assert store.similarity_search("2100", k=1)[0].page_content == "2100"
@@ -0,0 +1,52 @@
+from app.patterns.custom_rag_qa.mmr import batched_mmr, mmr
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore, normalize
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("n_candidates", [20, 300])
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.5, 1.0])
+def test_mmr_matches_reference(n_candidates: int, lambda_mult: float) -> None:
+    """The vectorized selection matches the stock iterative implementation."""
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        query = normalize(rng.normal(size=32))
+        candidates = normalize(rng.normal(size=(n_candidates, 32)))
+        expected = maximal_marginal_relevance(
+            query, candidates, lambda_mult=lambda_mult, k=8
+        )
+        assert mmr(query, candidates, k=8, lambda_mult=lambda_mult) == expected
+
+
+def test_batched_mmr_with_padding() -> None:
+    """Queries of a batch with fewer candidates than others never select padding."""
+    rng = np.random.default_rng(1)
+    queries = normalize(rng.normal(size=(3, 16)))
+    candidates = normalize(rng.normal(size=(3, 10, 16)))
+    mask = np.ones((3, 10), dtype=bool)
+    mask[1, 4:] = False
+    mask[2, 2:] = False
+
+    selected = batched_mmr(queries, candidates, k=4, mask=mask)
+
+    for i, n_valid in enumerate([10, 4, 2]):
+        expected = maximal_marginal_relevance(
+            queries[i], candidates[i, :n_valid], k=4
+        )
+        assert [j for j in selected[i].tolist() if j >= 0] == expected
+
+
+def test_store_batch_search_matches_single() -> None:
+    """Batched store searches return the same documents as one query at a time."""
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=16))
+    store.add_texts([f"text {i}" for i in range(100)])
+    queries = ["text 1", "text 50", "other"]
+
+    batch = store.max_marginal_relevance_search_batch(queries, k=4, fetch_k=20)
+
+    for query, docs in zip(queries, batch):
+        single = store.max_marginal_relevance_search(query, k=4, fetch_k=20)
+        assert [doc.id for doc in docs] == [doc.id for doc in single]
+        assert len(docs) == 4
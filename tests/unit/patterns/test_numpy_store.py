@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from typing import Any, Dict, List
+
+from app.patterns.custom_rag_qa import vector_store as vector_store_module
+from app.patterns.custom_rag_qa.indexing import ReindexStats
+from app.patterns.custom_rag_qa.numpy_store import (
+    NumpyVectorStore,
+    read_generation,
+    write_store_files,
+)
+from langchain_community.vectorstores import SKLearnVectorStore
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import numpy as np
+import pytest
+
+TEXTS = [f"Document about topic {i}" for i in range(50)]
+
+
+def test_numpy_store_loads_embeddings_as_memmap(tmp_path: str) -> None:
+    """A persisted store is memory-mapped on load and still accepts appends."""
+    embedding = DeterministicFakeEmbedding(size=32)
+    persist_path = os.path.join(tmp_path, "store")
+    store = NumpyVectorStore.from_texts(
+        TEXTS, embedding, metadatas=[{"i": i} for i in range(50)], persist_path=persist_path
+    )
+    store.persist()
+
+    reloaded = NumpyVectorStore(embedding, persist_path=persist_path)
+    assert isinstance(reloaded._buffer, np.memmap)
+    assert reloaded._buffer.dtype == np.float32
+    docs = reloaded.similarity_search(TEXTS[3], k=1)
+    assert docs[0].page_content == TEXTS[3]
+    assert docs[0].metadata["i"] == 3
+
+    reloaded.add_texts(["A brand new document"])
+    assert len(reloaded) == 51
+    assert reloaded.similarity_search("A brand new document", k=1)[0].page_content == (
+        "A brand new document"
+    )
+
+
+def test_get_vector_store_migrates_sklearn_json(
+    tmp_path: str, monkeypatch: object
+) -> None:
+    """The legacy JSON store is migrated once and returns the same results."""
+    embedding = DeterministicFakeEmbedding(size=32)
+    json_path = os.path.join(tmp_path, "legacy.json")
+    legacy = SKLearnVectorStore(embedding=embedding, persist_path=json_path)
+    legacy.add_texts(TEXTS)
+    legacy.persist()
+    monkeypatch.setattr(vector_store_module, "PERSIST_PATH", json_path)
+
+    persist_path = os.path.join(tmp_path, "migrated")
+    migrated = vector_store_module.get_vector_store(
+        embedding, persist_path=persist_path, backend="numpy"
+    )
+
+    assert os.path.isfile(os.path.join(persist_path, "embeddings-1.npy"))
+    for query in TEXTS[:5]:
+        expected: List[str] = [d.page_content for d in legacy.similarity_search(query, k=3)]
+        assert [d.page_content for d in migrated.similarity_search(query, k=3)] == expected
+
+
+def test_concurrent_writers_publish_distinct_generations(tmp_path: str) -> None:
+    """Writers serialize on the lock file, a reader reloads the latest generation."""
+    embedding = DeterministicFakeEmbedding(size=32)
+    persist_path = os.path.join(tmp_path, "store")
+    reader = NumpyVectorStore.from_texts(TEXTS[:1], embedding, persist_path=persist_path)
+    reader.persist()
+    assert not reader.reload()
+
+    # Number of documents written by each generation
+    generations: Dict[int, int] = {}
+
+    def write(i: int) -> None:
+        generation = write_store_files(
+            persist_path,
+            np.asarray(embedding.embed_documents(TEXTS[: i + 2])),
+            ids=[str(j) for j in range(i + 2)],
+            texts=TEXTS[: i + 2],
+            metadatas=[{}] * (i + 2),
+        )
+        generations[generation] = i + 2
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(generations) == list(range(2, 10))
+    assert read_generation(persist_path) == 9
+    assert reader.reload()
+    assert len(reader) == generations[9]
+
+
+def test_get_vector_store_compacts_before_persisting(
+    tmp_path: str, monkeypatch: object
+) -> None:
+    """Documents removed by the initial indexing are not persisted as tombstones."""
+    embedding = DeterministicFakeEmbedding(size=32)
+
+    def fake_reindex(store: NumpyVectorStore, *args: Any, **kwargs: Any) -> Any:
+        ids = store.add_texts(TEXTS)
+        store.delete(ids[:20])
+        return ReindexStats(sources_changed=1)
+
+    monkeypatch.setattr(vector_store_module, "reindex", fake_reindex)
+    persist_path = os.path.join(tmp_path, "store")
+    vector_store_module.get_vector_store(
+        embedding, persist_path=persist_path, backend="numpy"
+    )
+
+    with open(os.path.join(persist_path, "documents-1.json")) as f:
+        documents = json.load(f)
+    assert documents["deleted_rows"] == [] and len(documents["ids"]) == 30
+
+
+def test_rejected_replacement_keeps_the_documents() -> None:
+    """An append with the wrong dimension fails before replacing any document."""
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=32))
+    assert store.centroid() is None
+    store.add_texts(TEXTS[:2], ids=["a", "b"])
+    with pytest.raises(ValueError, match="dimension"):
+        store.add_embeddings(["replacement"], [[1.0] * 16], ids=["a"])
+    assert [doc.page_content for doc in store.get_by_ids(["a", "b"])] == TEXTS[:2]
+    assert store.centroid().shape == (32,)
+
+    store.delete(["a", "b"])
+    assert store.centroid() is None
@@ -0,0 +1,43 @@
+from typing import List
+
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from app.patterns.custom_rag_qa.references import (
+    reference_artifact,
+    referenced_ids,
+    resolve_references,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.messages import HumanMessage, ToolMessage
+
+
+def format_docs(docs: List[Document]) -> str:
+    return "|".join(doc.page_content for doc in docs)
+
+
+def test_reference_artifact() -> None:
+    docs = [Document("a", id="1"), Document("b", id="2")]
+    assert reference_artifact(docs) == {"doc_refs": ["1", "2"]}
+    assert referenced_ids(reference_artifact(docs)) == ["1", "2"]
+    assert reference_artifact([Document("a", id="1"), Document("b")]) is None
+    assert referenced_ids(docs) is None
+
+
+def test_resolve_references() -> None:
+    store = NumpyVectorStore(DeterministicFakeEmbedding(size=8))
+    store.add_texts(["first", "second"], ids=["1", "2"])
+    artifact = {"doc_refs": ["2", "1", "deleted"]}
+    messages = [
+        HumanMessage("question").model_dump(),
+        ToolMessage(content="", tool_call_id="call_1", artifact=artifact).model_dump(),
+        ToolMessage(content="", tool_call_id="call_2", artifact=artifact),
+        ToolMessage(content="kept", tool_call_id="call_3", artifact=artifact),
+    ]
+
+    resolved = resolve_references(messages, store.get_by_ids, format_docs)
+
+    assert resolved[0] is messages[0] and resolved[3] is messages[3]
+    assert resolved[1]["content"] == "second|first"
+    assert resolved[1]["artifact"] == artifact
+    assert resolved[2].content == "second|first"
+    assert messages[1]["content"] == ""
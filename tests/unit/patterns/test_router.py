@@ -0,0 +1,162 @@
+import os
+from typing import Any, Dict, List
+from unittest.mock import AsyncMock, patch
+
+from app.patterns.custom_rag_qa.numpy_store import NumpyVectorStore
+from app.patterns.custom_rag_qa.router import (
+    CONTINUE,
+    RETRIEVE,
+    CentroidRouter,
+    DecisionLog,
+    HeuristicRouter,
+    ChainedRouter,
+    LogisticRouter,
+    Router,
+    decisions_total,
+    fallback_rate,
+    get_router,
+    main,
+    route,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+import numpy as np
+import pytest
+
+
+class TopicEmbeddings(Embeddings):
+    """2-d embeddings: MLOps questions point along x, anything else along y."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        on_topic = any(word in text.lower() for word in ["mlops", "model", "pipeline"])
+        return [1.0, 0.1] if on_topic else [0.1, 1.0]
+
+
+def conversation(*texts: str) -> List[HumanMessage]:
+    return [HumanMessage(text) for text in texts]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "messages, tool",
+    [
+        (conversation("Thanks!"), CONTINUE),
+        (conversation("hello"), CONTINUE),
+        (conversation("What is MLOps?"), RETRIEVE),
+        (conversation("Explain continuous training"), RETRIEVE),
+        (conversation("What is MLOps?", "Why does it matter?"), None),
+        (conversation("I deploy models weekly"), None),
+    ],
+)
+async def test_heuristic_router(messages: List[HumanMessage], tool: str) -> None:
+    decision = await HeuristicRouter().aroute(messages)
+    assert decision.tool == tool
+    if tool == RETRIEVE:
+        assert decision.args == {"query": messages[-1].content}
+
+
+@pytest.mark.asyncio
+async def test_centroid_router() -> None:
+    router = CentroidRouter(TopicEmbeddings(), centroid=np.array([1.0, 0.0]))
+    assert (await router.aroute(conversation("MLOps pipelines"))).tool == RETRIEVE
+    assert (await router.aroute(conversation("Nice weather"))).tool == CONTINUE
+
+    # Without documents there is no centroid, the heuristic router is used alone
+    empty_store = NumpyVectorStore(TopicEmbeddings())
+    router = get_router("centroid", TopicEmbeddings(), empty_store)
+    assert isinstance(router, HeuristicRouter)
+
+
+@pytest.mark.asyncio
+async def test_logistic_router_from_decision_log(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, "decisions.jsonl")
+    log = DecisionLog(path)
+    for i in range(15):
+        log.append(f"model question {i}", RETRIEVE)
+        log.append(f"chit chat {i}", CONTINUE)
+
+    router = LogisticRouter.from_decision_log(path, TopicEmbeddings())
+    assert (await router.aroute(conversation("pipeline failure"))).tool == RETRIEVE
+    assert (await router.aroute(conversation("good day"))).tool == CONTINUE
+    assert LogisticRouter.from_decision_log("missing.jsonl", TopicEmbeddings()) is None
+
+    # Trained offline and loaded by the chain, without embedding the log
+    model_path = os.path.join(tmp_path, "logistic.npz")
+    assert get_router("logistic", TopicEmbeddings(), model_path=model_path) is not None
+    with patch.object(LogisticRouter, "from_decision_log", return_value=router):
+        main(["--decision-log", path, "--model-path", model_path])
+    chained = get_router("logistic", TopicEmbeddings(), model_path=model_path)
+    assert isinstance(chained, ChainedRouter)
+    loaded = chained.routers[1]
+    np.testing.assert_allclose(loaded.weights, router.weights)
+    assert (await loaded.aroute(conversation("pipeline failure"))).tool == RETRIEVE
+
+
+@pytest.mark.asyncio
+async def test_decision_log_is_rotated(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, "decisions.jsonl")
+    log = DecisionLog(path, max_bytes=1000)
+    for i in range(30):
+        await log.aappend(f"model question {i}", RETRIEVE)
+        await log.aappend(f"chit chat {i}", CONTINUE)
+
+    assert all(os.path.getsize(log_path) < 1100 for log_path in log.paths)
+    # Training reads the rotated log too, only the oldest decisions are dropped
+    records = 0
+    for log_path in log.paths:
+        with open(log_path) as f:
+            records += len(f.readlines())
+    assert 20 <= records < 60
+    with patch.object(LogisticRouter, "fit", return_value=(np.zeros(2), 0.0)) as fit:
+        LogisticRouter.from_decision_log(path, TopicEmbeddings())
+    assert len(fit.call_args.args[1]) == records
+
+
+def test_routers_implement_aroute() -> None:
+    class IncompleteRouter(Router):
+        pass
+
+    with pytest.raises(TypeError):
+        IncompleteRouter()
+
+
+@pytest.mark.asyncio
+async def test_route_falls_back_to_the_llm(tmp_path: str) -> None:
+    async def inspect(_: Dict[str, Any]) -> AIMessage:
+        return AIMessage(
+            content="",
+            tool_calls=[{"name": RETRIEVE, "args": {"query": "q"}, "id": "call_1"}],
+        )
+
+    inspection = AsyncMock(side_effect=inspect)
+    log = DecisionLog(os.path.join(tmp_path, "decisions.jsonl"))
+    llm_before = decisions_total.value(source="llm", tool=RETRIEVE)
+    local_before = decisions_total.value(source="local", tool=RETRIEVE)
+
+    result = await route(
+        HeuristicRouter(),
+        RunnableLambda(inspection),
+        {"messages": conversation("What is MLOps?")},
+        log,
+    )
+    assert result.tool_calls[0]["args"] == {"query": "What is MLOps?"}
+    assert inspection.call_count == 0
+
+    result = await route(
+        HeuristicRouter(),
+        RunnableLambda(inspection),
+        {"messages": conversation("I deploy models weekly")},
+        log,
+    )
+    assert result.tool_calls[0]["id"] == "call_1"
+    assert inspection.call_count == 1
+
+    assert decisions_total.value(source="local", tool=RETRIEVE) == local_before + 1
+    assert decisions_total.value(source="llm", tool=RETRIEVE) == llm_before + 1
+    assert 0 < fallback_rate.value() < 1
+    with open(log.path) as f:
+        assert f.read().count(RETRIEVE) == 1
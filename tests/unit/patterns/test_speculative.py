@@ -0,0 +1,104 @@
+import asyncio
+import gc
+import time
+from typing import List
+
+from app.patterns.custom_rag_qa.speculative import (
+    SpeculativeRetrieval,
+    queries_match,
+    saved_seconds,
+    speculations_total,
+)
+from langchain_core.documents import Document
+import pytest
+
+LATENCY = 0.2
+
+
+async def slow_retrieve(query: str) -> List[Document]:
+    await asyncio.sleep(LATENCY)
+    return [Document(page_content=f"Context for {query}")]
+
+
+def test_queries_match() -> None:
+    assert queries_match("What is MLOps?", "what is mlops", 0.8)
+    assert not queries_match("What is MLOps?", "continuous training pipelines", 0.8)
+
+
+@pytest.mark.asyncio
+async def test_hit_overlaps_retrieval_with_inspection() -> None:
+    hits = speculations_total.value(outcome="hit")
+    observations = saved_seconds.count()
+    speculation = SpeculativeRetrieval(slow_retrieve, "What is MLOps?")
+
+    start = time.perf_counter()
+    speculation.start()
+    await asyncio.sleep(LATENCY)  # The inspection LLM call
+    docs = await speculation.resolve(
+        {"name": "retrieve_docs", "args": {"query": "What is MLOps"}}
+    )
+    elapsed = time.perf_counter() - start
+
+    assert docs[0].page_content == "Context for What is MLOps?"
+    assert elapsed < 1.5 * LATENCY
+    assert speculations_total.value(outcome="hit") == hits + 1
+    assert saved_seconds.count() == observations + 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "tool_call, outcome",
+    [
+        ({"name": "retrieve_docs", "args": {"query": "feature stores"}}, "miss"),
+        ({"name": "should_continue", "args": {}}, "unused"),
+    ],
+)
+async def test_mismatch_cancels_the_speculation(tool_call: dict, outcome: str) -> None:
+    before = speculations_total.value(outcome=outcome)
+    speculation = SpeculativeRetrieval(slow_retrieve, "What is MLOps?")
+    speculation.start()
+    task = speculation._task
+
+    assert await speculation.resolve(tool_call) is None
+    await asyncio.sleep(0)
+    assert task.cancelled()
+    assert speculations_total.value(outcome=outcome) == before + 1
+
+
+@pytest.mark.asyncio
+async def test_failed_speculation_is_a_miss() -> None:
+    async def failing_retrieve(query: str) -> List[Document]:
+        raise ConnectionError("vector store unavailable")
+
+    before = speculations_total.value(outcome="miss")
+    speculation = SpeculativeRetrieval(failing_retrieve, "What is MLOps?")
+    speculation.start()
+    await asyncio.sleep(0)
+    assert (
+        await speculation.resolve(
+            {"name": "retrieve_docs", "args": {"query": "What is MLOps"}}
+        )
+        is None
+    )
+    assert speculations_total.value(outcome="miss") == before + 1
+
+
+@pytest.mark.asyncio
+async def test_failed_speculation_exception_is_retrieved() -> None:
+    async def failing_retrieve(query: str) -> List[Document]:
+        raise ConnectionError("vector store unavailable")
+
+    unhandled = []
+    loop = asyncio.get_running_loop()
+    loop.set_exception_handler(lambda _, context: unhandled.append(context))
+    try:
+        speculation = SpeculativeRetrieval(failing_retrieve, "What is MLOps?")
+        speculation.start()
+        for _ in range(3):  # Fails, then runs its done callbacks
+            await asyncio.sleep(0)
+        # E.g. the request failed before resolving the speculation
+        del speculation
+        gc.collect()
+    finally:
+        loop.set_exception_handler(None)
+    assert not unhandled
@@ -0,0 +1,115 @@
+"""Startup benchmarks: import time of the chains and time to first request.
+
+Both run in a fresh interpreter, so that nothing is already imported. Run with
+`-s` to see the timings.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, Optional
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+# Generous upper bounds, the point is that no model or corpus is loaded at import
+MAX_IMPORT_SECONDS = 15.0
+MAX_FIRST_REQUEST_SECONDS = 30.0
+
+
+def run_python(
+    tmp_path: str, *args: str, env: Optional[Dict[str, str]] = None
+) -> subprocess.CompletedProcess:
+    """Run a fresh interpreter outside of the repo, with the repo importable."""
+    env = {**os.environ, **(env or {}), "PYTHONPATH": REPO_ROOT}
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+        check=True,
+    )
+
+
+def cumulative_import_seconds(importtime_output: str) -> Dict[str, float]:
+    """Cumulative import time of each module in a `-X importtime` report."""
+    times = {}
+    for line in importtime_output.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)", line.strip())
+        if match:
+            times[match.group(2)] = int(match.group(1)) / 1e6
+    return times
+
+
+def test_rag_chain_import_does_not_build_resources(tmp_path: str) -> None:
+    result = run_python(
+        tmp_path,
+        "-X",
+        "importtime",
+        "-c",
+        "import app.patterns.custom_rag_qa.chain as c; "
+        "assert c.vector_store is c.NOT_LOADED and c.llm is c.NOT_LOADED",
+    )
+    seconds = cumulative_import_seconds(result.stderr)[
+        "app.patterns.custom_rag_qa.chain"
+    ]
+    print(f"\nimport app.patterns.custom_rag_qa.chain: {seconds:.2f}s")
+    assert seconds < MAX_IMPORT_SECONDS
+    # Neither the embedding cache nor the vector store were created
+    assert os.listdir(tmp_path) == []
+
+
+TIME_TO_FIRST_REQUEST_SCRIPT = """
+import json
+import time
+
+start = time.perf_counter()
+from fastapi.testclient import TestClient
+import app.server as server
+
+with TestClient(server.app) as client:
+    health = client.get("/health").json()
+first_request = time.perf_counter() - start
+
+start = time.perf_counter()
+rag_chain = server.registry.get("custom_rag_qa")
+print(json.dumps({
+    "first_request": first_request,
+    "health": health,
+    "rag_chain_load": time.perf_counter() - start,
+}))
+"""
+
+
+def time_to_first_request(tmp_path: str, warm_up_chains: str) -> Dict:
+    """Startup timings and health of the server, warming up `warm_up_chains`."""
+    result = run_python(
+        tmp_path,
+        "-c",
+        TIME_TO_FIRST_REQUEST_SCRIPT,
+        env={"WARM_UP_CHAINS": warm_up_chains},
+    )
+    timings = json.loads(result.stdout.splitlines()[-1])
+    print(
+        f"\nWARM_UP_CHAINS={warm_up_chains!r}: "
+        f"time to first request: {timings['first_request']:.2f}s, "
+        f"custom_rag_qa load: {timings['rag_chain_load']:.2f}s"
+    )
+    assert timings["health"]["chains"]["default"]["loaded"]
+    assert timings["first_request"] < MAX_FIRST_REQUEST_SECONDS
+    assert timings["rag_chain_load"] < MAX_IMPORT_SECONDS
+    return timings
+
+
+def test_time_to_first_request(tmp_path: str) -> None:
+    # The RAG chain is warmed up at startup by default. Without Ollama or the
+    # corpus its resources fail to build and are built on first request instead,
+    # but the chain itself is loaded
+    timings = time_to_first_request(tmp_path, "custom_rag_qa")
+    assert timings["health"]["chains"]["custom_rag_qa"]["loaded"]
+
+
+def test_time_to_first_request_without_warm_up(tmp_path: str) -> None:
+    timings = time_to_first_request(tmp_path, "")
+    assert not timings["health"]["chains"]["custom_rag_qa"]["loaded"]
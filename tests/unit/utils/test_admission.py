@@ -0,0 +1,75 @@
+import asyncio
+
+from app.utils.admission import AdmissionController, AdmissionRejected, Ticket
+from app.utils.metrics import metrics
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_queue_is_fifo_and_bounded() -> None:
+    controller = AdmissionController(max_concurrency=1, max_queue=2)
+    running = controller.admit()
+    first, second = controller.admit(), controller.admit()
+    assert not running.queued and running.position == 0
+    assert (first.position, second.position) == (1, 2)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit()
+    assert rejected.value.reason == "queue_full"
+
+    order = []
+
+    async def run(name: str, ticket: Ticket) -> None:
+        await ticket.wait()
+        order.append(name)
+        ticket.release()
+
+    tasks = [
+        asyncio.create_task(run("2", second)),
+        asyncio.create_task(run("1", first)),
+    ]
+    await asyncio.sleep(0.01)
+    assert order == [] and controller.queued == 2
+    running.release()
+    running.release()
+    await asyncio.gather(*tasks)
+    assert order == ["1", "2"]
+    assert (controller.active, controller.queued) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_per_user_and_session_limits() -> None:
+    controller = AdmissionController(max_per_user=2, max_per_session=1)
+    rejections = metrics.counter("admission_rejections_total", "")
+    before = rejections.value(reason="session_limit")
+
+    ticket = controller.admit("user", "session-1")
+    with pytest.raises(AdmissionRejected):
+        controller.admit("user", "session-1")
+    controller.admit("user", "session-2")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.admit("user", "session-3")
+    assert rejected.value.reason == "user_limit"
+    assert rejections.value(reason="session_limit") == before + 1
+
+    ticket.release()
+    controller.admit("other-user", "session-1")
+    # Empty ids are not limited
+    for _ in range(3):
+        controller.admit()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue() -> None:
+    controller = AdmissionController(max_concurrency=1)
+    running, queued = controller.admit(), controller.admit()
+    waiting = asyncio.create_task(queued.wait())
+    await asyncio.sleep(0.01)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    queued.release()
+    assert (controller.active, controller.queued) == (1, 0)
+
+    running.release()
+    assert controller.active == 0
+    assert not controller.admit().queued
@@ -0,0 +1,44 @@
+import asyncio
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils.background_loop import BackgroundLoop
+import pytest
+
+
+async def current_loop() -> asyncio.AbstractEventLoop:
+    await asyncio.sleep(0)
+    return asyncio.get_running_loop()
+
+
+def test_coroutines_share_one_loop_across_threads() -> None:
+    runner = BackgroundLoop()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        loops = set(executor.map(lambda _: runner.run(current_loop()), range(8)))
+    assert loops == {runner.loop}
+    runner.stop()
+    assert runner.run(current_loop()) is not loops.pop()
+    runner.stop()
+
+
+def test_timeout_cancels_and_reentrant_calls_fail() -> None:
+    runner = BackgroundLoop()
+    cancelled = asyncio.Event()
+
+    async def slow() -> None:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(concurrent.futures.TimeoutError):
+        runner.run(slow(), timeout=0.05)
+    assert runner.run(asyncio.wait_for(cancelled.wait(), 1)) is True
+
+    async def reentrant() -> None:
+        runner.run(current_loop())
+
+    with pytest.raises(RuntimeError, match="thread itself"):
+        runner.run(reentrant())
+    runner.stop()
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import time
+from types import ModuleType
+from unittest.mock import MagicMock, patch
+
+from app.utils.chain_registry import ChainRegistry, SharedResources, import_object
+from app.utils.metrics import metrics
+import pytest
+
+
+def test_import_object() -> None:
+    assert import_object("app.utils.chain_registry:ChainRegistry") is ChainRegistry
+
+
+def test_chains_are_loaded_once_on_first_use() -> None:
+    loader = MagicMock(side_effect=lambda: object())
+    registry = ChainRegistry({"test_chain": loader})
+    assert registry.status() == {"test_chain": {"loaded": False}}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        chains = list(executor.map(lambda _: registry.get("test_chain"), range(8)))
+
+    assert loader.call_count == 1
+    assert all(chain is chains[0] for chain in chains)
+    status = registry.status()["test_chain"]
+    assert status["loaded"] and status["load_seconds"] >= 0
+    assert status["memory_bytes"] >= 0
+    assert metrics.gauge("chain_load_seconds", "").value(chain="test_chain") >= 0
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+
+def test_shared_resources_are_created_once() -> None:
+    resources = SharedResources()
+    calls = []
+    lock = threading.Lock()
+
+    def factory() -> object:
+        with lock:
+            calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        values = list(executor.map(lambda _: resources.get("store", factory), range(8)))
+
+    assert len(calls) == 1
+    assert all(value is values[0] for value in values)
+    assert "store" in resources and "other" not in resources
+
+
+def test_warm_up_calls_the_chain_module_hook() -> None:
+    module = ModuleType("warm_up_test_chain")
+    module.chain = object()  # type: ignore[attr-defined]
+    module.warm_up = MagicMock()  # type: ignore[attr-defined]
+    registry = ChainRegistry({"test_chain": "warm_up_test_chain:chain"})
+
+    with patch.dict(sys.modules, {"warm_up_test_chain": module}):
+        registry.warm_up("test_chain")
+
+    module.warm_up.assert_called_once_with()
+    assert registry.get("test_chain") is module.chain
+    assert registry.status()["test_chain"]["warm_up_seconds"] >= 0
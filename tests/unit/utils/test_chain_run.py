@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List
+
+from app.utils import chain_run
+from app.utils.chain_run import ChainRun
+import pytest
+
+
+def token(content: str) -> Dict[str, Any]:
+    return {"event": "on_chat_model_stream", "data": {"content": content}}
+
+
+async def stream(events: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    for event in events:
+        yield event
+
+
+@pytest.mark.asyncio
+async def test_events_are_selected_in_order() -> None:
+    events = [{"event": "on_chain_start"}, token("a"), token("b")]
+    run = ChainRun(
+        select=lambda event: event if event["event"] != "on_chain_start" else None
+    )
+    run.start(stream(events))
+    assert [event async for event in run.events()] == events[1:]
+    assert run.completed and run.tokens == 2
+    run.cancel()
+    assert not run.cancelled
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_the_consumer() -> None:
+    async def failing() -> AsyncIterator[Dict[str, Any]]:
+        yield token("a")
+        raise ValueError("model error")
+
+    run = ChainRun()
+    run.start(failing())
+    received = []
+    with pytest.raises(ValueError, match="model error"):
+        async for event in run.events():
+            received.append(event)
+    assert received == [token("a")] and not run.completed
+
+
+@pytest.mark.asyncio
+async def test_cancel_closes_the_stream_and_counts_saved_tokens() -> None:
+    chain_run._completed_lengths.clear()
+    chain_run._completed_lengths.extend([10, 20])
+    closed = asyncio.Event()
+
+    async def slow() -> AsyncIterator[Dict[str, Any]]:
+        try:
+            for i in range(100):
+                yield token(str(i))
+                await asyncio.sleep(0.01)
+        finally:
+            closed.set()
+
+    cancelled = chain_run.cancellations_total.value()
+    saved = chain_run.tokens_saved_total.value()
+    run = ChainRun()
+    run.start(slow())
+    events = run.events()
+    for _ in range(3):
+        await events.__anext__()
+    run.cancel()
+    run.cancel()
+    await asyncio.wait_for(closed.wait(), 1)
+    assert run.cancelled and not run.completed
+    assert chain_run.cancellations_total.value() == cancelled + 1
+    assert chain_run.tokens_saved_total.value() == saved + 15 - run.tokens
+    chain_run._completed_lengths.clear()
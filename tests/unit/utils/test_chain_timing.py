@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, AsyncGenerator, Dict
+
+from app.utils import chain_timing
+from app.utils.chain_timing import stage
+from app.utils.decorators import custom_chain
+from app.utils.output_types import OnChatModelStreamEvent, OnToolEndEvent
+from langchain_core.messages import AIMessageChunk, ToolMessage
+import pytest
+
+histograms = chain_timing._histograms
+
+
+@custom_chain
+async def timed_chain(input: Dict[str, Any], **kwargs: Any) -> AsyncGenerator:
+    with stage("retrieval"):
+        await asyncio.sleep(0.02)
+    yield OnToolEndEvent(
+        data={"input": {}, "output": ToolMessage(content="docs", tool_call_id="1")}
+    )
+    for _ in range(input["tokens"]):
+        await asyncio.sleep(0.01)
+        yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content="a")})
+
+
+@pytest.mark.asyncio
+async def test_runs_and_stages_are_timed() -> None:
+    name = timed_chain.name
+    assert name.endswith(":timed_chain")
+    runs = histograms["run"].count(chain=name)
+
+    await timed_chain.ainvoke({"tokens": 5})
+    assert histograms["run"].count(chain=name) == runs + 1
+    assert histograms["stage"].count(chain=name, stage="retrieval") >= 1
+    assert histograms["time_to_first_event"].sum(chain=name) >= 0.02
+    assert histograms["time_to_first_token"].sum(chain=name) >= 0.03
+    tokens_per_second = histograms["tokens_per_second"]
+    assert 0 < tokens_per_second.sum(chain=name) <= 100 * tokens_per_second.count(
+        chain=name
+    )
+
+    # Runs closed early are timed too, and stages outside runs have no chain
+    events = timed_chain.astream_events({"tokens": 100})
+    await events.__anext__()
+    await events.aclose()
+    assert histograms["run"].count(chain=name) == runs + 2
+    with stage("standalone"):
+        pass
+    assert histograms["stage"].count(chain="", stage="standalone") >= 1
+
+
+def test_tokens_per_second() -> None:
+    timer = chain_timing.RunTimer("test")
+    token = OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content="a")})
+    timer.on_event(token)
+    assert timer.tokens_per_second is None
+    timer.first_token_at, timer.last_token_at, timer.tokens = 1.0, 3.0, 11
+    assert timer.tokens_per_second == 5.0
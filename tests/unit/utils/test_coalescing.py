@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from app.utils.coalescing import coalesce_chunks
+import pytest
+
+
+def chunk(content: str) -> Dict[str, Any]:
+    return {
+        "event": "on_chat_model_stream",
+        "data": {"chunk": {"content": content, "additional_kwargs": {}}},
+    }
+
+
+TOOL_END = {"event": "on_tool_end", "name": "retrieve_docs", "data": {}}
+
+
+async def source(items: List[Tuple[float, Dict[str, Any]]]) -> AsyncIterator[Dict]:
+    for delay, event in items:
+        await asyncio.sleep(delay)
+        yield event
+
+
+def contents(events: List[Dict[str, Any]]) -> List[Any]:
+    return [
+        event["data"]["chunk"]["content"]
+        if event["event"] == "on_chat_model_stream"
+        else event["event"]
+        for event in events
+    ]
+
+
+async def collect(items: List[Tuple[float, Dict]], **kwargs: Any) -> List[Any]:
+    return contents([event async for event in coalesce_chunks(source(items), **kwargs)])
+
+
+@pytest.mark.asyncio
+async def test_merges_chunks_and_flushes_on_tool_events() -> None:
+    items = [(0, chunk("a")), (0, chunk("b")), (0, chunk("c")), (0, TOOL_END)]
+    items += [(0, chunk("d")), (0, chunk("e"))]
+    # The first chunk is never held back
+    assert await collect(items, window=1.0) == ["a", "bc", "on_tool_end", "de"]
+
+
+@pytest.mark.asyncio
+async def test_flushes_when_window_expires() -> None:
+    items = [(0, chunk("a")), (0, chunk("b")), (0, chunk("c")), (0.2, chunk("d"))]
+    assert await collect(items, window=0.05) == ["a", "bc", "d"]
+
+
+@pytest.mark.asyncio
+async def test_flushes_on_byte_budget() -> None:
+    items = [(0, chunk(text)) for text in ["a", "bb", "cc", "dd", "e"]]
+    assert await collect(items, window=1.0, max_bytes=4) == ["a", "bbcc", "dde"]
+
+
+@pytest.mark.asyncio
+async def test_passes_other_chunks_through() -> None:
+    tool_call = chunk("")
+    tool_call["data"]["chunk"]["additional_kwargs"] = {"function_call": {}}
+    unprojected = {"event": "on_chat_model_stream", "data": {"content": "x"}}
+    events = [
+        event
+        async for event in coalesce_chunks(
+            source([(0, chunk("a")), (0, chunk("b")), (0, tool_call), (0, unprojected)])
+        )
+    ]
+    assert events[1:] == [chunk("b"), tool_call, unprojected]
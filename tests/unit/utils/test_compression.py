@@ -0,0 +1,70 @@
+from typing import AsyncIterator, List
+import zlib
+
+from app.utils.compression import (
+    COMPRESSORS,
+    StreamCompressor,
+    compress_stream,
+    negotiate_encoding,
+    parse_accept_encoding,
+)
+import pytest
+
+
+def test_parse_accept_encoding() -> None:
+    assert parse_accept_encoding("gzip, br;q=0.5 , zstd;q=0") == [
+        ("gzip", 1.0),
+        ("br", 0.5),
+        ("zstd", 0.0),
+    ]
+
+
+def test_negotiate_encoding() -> None:
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0, deflate") is None
+    assert negotiate_encoding("*") == next(
+        name for name, compressor in COMPRESSORS.items() if compressor
+    )
+    assert negotiate_encoding("gzip, br", preferred=("gzip",)) == "gzip"
+
+
+@pytest.mark.asyncio
+async def test_gzip_stream_is_decodable_event_by_event() -> None:
+    lines = [b'{"event": "metadata"}\n', b'{"event": "on_tool_end"}\n' * 20]
+
+    async def stream() -> AsyncIterator[bytes]:
+        for line in lines:
+            yield line
+
+    blocks: List[bytes] = [block async for block in compress_stream(stream(), "gzip")]
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # Every event is decoded from its own block, without waiting for the next one
+    assert [decompressor.decompress(block) for block in blocks[:2]] == lines
+    decompressor.decompress(blocks[2])
+    assert decompressor.eof
+    assert len(blocks[1]) < len(lines[1])
+
+
+@pytest.mark.asyncio
+async def test_closing_the_compressed_stream_closes_the_inner_one() -> None:
+    closed = False
+
+    async def stream() -> AsyncIterator[bytes]:
+        nonlocal closed
+        try:
+            while True:
+                yield b'{"event": "on_chat_model_stream"}\n'
+        finally:
+            closed = True
+
+    compressed = compress_stream(stream(), "gzip")
+    await compressed.__anext__()
+    await compressed.aclose()
+    assert closed
+
+
+def test_stream_compressors_are_abstract() -> None:
+    with pytest.raises(TypeError):
+        StreamCompressor()
@@ -0,0 +1,132 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import Any, AsyncGenerator, Dict, Iterator, List
+
+from app.utils.decorators import custom_chain
+from app.utils.output_types import OnChatModelStreamEvent, OnToolEndEvent
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+import pytest
+
+attempts: Dict[str, int] = {}
+
+
+@custom_chain
+async def echo_chain(input: Dict[str, Any], **kwargs: Any) -> AsyncGenerator:
+    """Streams the text of the input back, word by word."""
+    text = input["text"]
+    attempts[text] = attempts.get(text, 0) + 1
+    if text == "fail" or (text == "flaky" and attempts[text] < 3):
+        raise RuntimeError(f"{text} failed")
+    await asyncio.sleep(input.get("delay", 0.01))
+    yield OnToolEndEvent(
+        data={"input": {}, "output": ToolMessage(content="docs", tool_call_id="1")}
+    )
+    for word in text.split(" "):
+        yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content=word)})
+
+
+@pytest.mark.asyncio
+async def test_ainvoke_builds_the_message() -> None:
+    message = await echo_chain.ainvoke({"text": "a b"})
+    assert isinstance(message, AIMessage) and message.content == "ab"
+    assert len(message.additional_kwargs["tool_calls_data"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_abatch_isolates_errors_and_retries() -> None:
+    attempts.clear()
+    results = await echo_chain.abatch(
+        [{"text": "one"}, {"text": "fail"}, {"text": "flaky"}],
+        retries=2,
+        retry_delay=0.001,
+    )
+    assert results[0].content == "one"
+    assert isinstance(results[1], RuntimeError) and attempts["fail"] == 3
+    assert results[2].content == "flaky" and attempts["flaky"] == 3
+
+    results = await echo_chain.abatch(
+        [{"text": "fail"}], retries=2, retry_on=(ValueError,)
+    )
+    assert isinstance(results[0], RuntimeError) and attempts["fail"] == 4
+
+
+@pytest.mark.asyncio
+async def test_astream_batch_bounds_concurrency() -> None:
+    inputs = [{"text": str(i), "delay": 0.05 - i * 0.01} for i in range(4)]
+    completed = [
+        index async for index, _ in echo_chain.astream_batch(inputs, max_concurrency=4)
+    ]
+    assert completed == [3, 2, 1, 0]
+    ordered: List[int] = [
+        index
+        async for index, _ in echo_chain.astream_batch(
+            inputs, max_concurrency=4, ordered=True
+        )
+    ]
+    assert ordered == [0, 1, 2, 3]
+
+    inputs = [{"text": str(i), "delay": 0.05} for i in range(4)]
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    await echo_chain.abatch(inputs, max_concurrency=2)
+    assert loop.time() - start >= 0.1
+
+
+def test_sync_calls_run_on_the_background_loop() -> None:
+    attempts.clear()
+    assert echo_chain.is_async
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        messages = list(
+            executor.map(echo_chain.invoke, [{"text": f"t{i}"} for i in range(8)])
+        )
+    assert [message.content for message in messages] == [f"t{i}" for i in range(8)]
+
+    inputs = [{"text": "one"}, {"text": "fail"}]
+    results = echo_chain.batch(inputs, return_exceptions=True)
+    assert results[0].content == "one" and isinstance(results[1], RuntimeError)
+    with pytest.raises(RuntimeError, match="fail failed"):
+        echo_chain.batch(inputs)
+
+
+@custom_chain
+def sync_echo_chain(input: Dict[str, Any], **kwargs: Any) -> Iterator[Any]:
+    """Streams the text of the input back, from a sync generator."""
+    if input["text"] == "fail":
+        raise RuntimeError("fail failed")
+    time.sleep(0.01)
+    content = f"{input['text']}@{threading.get_ident()}"
+    yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content=content)})
+
+
+@pytest.mark.asyncio
+async def test_async_calls_of_sync_chains_run_in_threads() -> None:
+    assert not sync_echo_chain.is_async
+    message = await sync_echo_chain.ainvoke({"text": "a"})
+    text, thread = message.content.split("@")
+    assert text == "a" and int(thread) != threading.get_ident()
+
+    results = await sync_echo_chain.abatch([{"text": "b"}, {"text": "fail"}])
+    assert results[0].content.startswith("b@")
+    assert isinstance(results[1], RuntimeError)
+
+
+@custom_chain
+def sync_tag_chain(input: Dict[str, Any], tag: str, **kwargs: Any) -> Iterator[Any]:
+    content = f"{input['text']}:{tag}:{kwargs['n']}"
+    yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content=content)})
+
+
+@custom_chain
+async def async_tag_chain(
+    input: Dict[str, Any], tag: str, **kwargs: Any
+) -> AsyncGenerator:
+    content = f"{input['text']}:{tag}:{kwargs['n']}"
+    yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content=content)})
+
+
+@pytest.mark.parametrize("chain", [sync_tag_chain, async_tag_chain])
+def test_batch_passes_the_same_arguments_to_every_input(chain: Any) -> None:
+    results = chain.batch([{"text": "a"}, {"text": "b"}], "tag", n=1)
+    assert [result.content for result in results] == ["a:tag:1", "b:tag:1"]
@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import List
+
+from app.utils.embedding_batcher import BatchedEmbeddings
+from langchain_core.embeddings import Embeddings
+import pytest
+
+
+class RecordingEmbeddings(Embeddings):
+    """Embeds a text as [length], recording the batches it receives."""
+
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.batches: List[List[str]] = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.batches.append(list(texts))
+        if "fail" in texts:
+            raise ValueError("embedding failed")
+        time.sleep(self.delay)
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_concurrent_requests_share_a_batch() -> None:
+    underlying = RecordingEmbeddings(delay=0.02)
+    batcher = BatchedEmbeddings(underlying, max_batch_size=64, max_wait=0.05)
+    texts = ["a" * i for i in range(1, 21)]
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        vectors = list(executor.map(batcher.embed_query, texts))
+    assert vectors == [[float(i)] for i in range(1, 21)]
+    assert len(underlying.batches) < len(texts)
+    assert sorted(text for batch in underlying.batches for text in batch) == sorted(
+        texts
+    )
+    batcher.close()
+
+
+def test_batches_are_capped_and_errors_reach_their_callers() -> None:
+    underlying = RecordingEmbeddings(delay=0.02)
+    batcher = BatchedEmbeddings(underlying, max_batch_size=2, max_wait=0.05)
+    assert batcher.embed_documents(["ab", "abc", "abcd"]) == [[2.0], [3.0], [4.0]]
+    assert batcher.embed_documents([]) == []
+    with pytest.raises(ValueError, match="embedding failed"):
+        batcher.embed_query("fail")
+    assert batcher.embed_query("ok") == [2.0]
+    batcher.close()
+
+
+@pytest.mark.asyncio
+async def test_async_requests_are_batched() -> None:
+    underlying = RecordingEmbeddings(delay=0.02)
+    batcher = BatchedEmbeddings(underlying, max_batch_size=8, max_wait=0.02)
+    vectors = await asyncio.gather(
+        *(batcher.aembed_query("a" * i) for i in range(1, 9)),
+        batcher.aembed_documents(["xy", "xyz"]),
+    )
+    assert vectors[:8] == [[float(i)] for i in range(1, 9)]
+    assert vectors[8] == [[2.0], [3.0]]
+    assert len(underlying.batches) <= 3
+    batcher.close()
+
+
+def test_queries_do_not_wait_behind_a_slow_batch() -> None:
+    class SlowBatchEmbeddings(RecordingEmbeddings):
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            if "slow" in texts:
+                time.sleep(0.3)
+            return super().embed_documents(texts)
+
+    batcher = BatchedEmbeddings(SlowBatchEmbeddings(), max_wait=0, workers=2)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        ingestion = executor.submit(batcher.embed_documents, ["slow"] * 32)
+        time.sleep(0.05)
+        start = time.perf_counter()
+        assert batcher.embed_query("query") == [5.0]
+        assert time.perf_counter() - start < 0.2
+        assert not ingestion.done()
+        assert ingestion.result() == [[4.0]] * 32
+    batcher.close()
@@ -0,0 +1,147 @@
+import os
+import threading
+from typing import Dict, List
+from unittest.mock import patch
+
+from app.utils.embedding_cache import CachedEmbeddings
+from langchain_core.embeddings import DeterministicFakeEmbedding
+import pytest
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Deterministic fake embeddings recording every text sent to the model."""
+
+    calls: List[str] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.extend(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls.append(text)
+        return super().embed_query(text)
+
+
+@pytest.fixture
+def underlying() -> CountingEmbeddings:
+    return CountingEmbeddings(size=8, calls=[])
+
+
+def test_cache_only_embeds_new_texts(underlying: CountingEmbeddings) -> None:
+    """Cached and duplicated texts are embedded once, results keep input order."""
+    cache = CachedEmbeddings(underlying, model_name="fake")
+
+    first = cache.embed_documents(["a", "b", "a"])
+    second = cache.embed_documents(["b", "c", "  a \n"])
+
+    assert underlying.calls == ["a", "b", "c"]
+    assert first[0] == first[2] == second[2]
+    assert second[0] == first[1]
+    assert cache.stats.memory_hits == 2
+    assert cache.stats.misses == 3
+
+
+def test_disk_tier_survives_restart(tmp_path: str, underlying: CountingEmbeddings) -> None:
+    """A new process reuses vectors stored on disk by a previous one."""
+    path = os.path.join(tmp_path, "cache.sqlite")
+    vector = CachedEmbeddings(underlying, model_name="fake", path=path).embed_query("q")
+
+    restarted = CachedEmbeddings(underlying, model_name="fake", path=path)
+    assert restarted.embed_query("q") == pytest.approx(vector)
+    assert underlying.calls == ["q"]
+    assert restarted.stats.disk_hits == 1
+
+    other_model = CachedEmbeddings(underlying, model_name="other", path=path)
+    other_model.embed_query("q")
+    assert underlying.calls == ["q", "q"]
+
+
+def test_disk_tier_is_size_bounded(tmp_path: str, underlying: CountingEmbeddings) -> None:
+    cache = CachedEmbeddings(
+        underlying,
+        model_name="fake",
+        path=os.path.join(tmp_path, "cache.sqlite"),
+        max_memory_entries=2,
+        max_disk_entries=10,
+    )
+    cache.embed_documents([str(i) for i in range(25)])
+
+    (count,) = cache._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    assert count <= 10
+    assert len(cache._memory) == 2
+    assert cache.stats.evictions == 25 - count
+
+
+def test_disk_row_count_ignores_replaced_keys(
+    tmp_path: str, underlying: CountingEmbeddings
+) -> None:
+    path = os.path.join(tmp_path, "cache.sqlite")
+    cache = CachedEmbeddings(underlying, model_name="fake", path=path)
+    cache.embed_documents([str(i) for i in range(5)])
+    entries = {key: [1.0] * 8 for key in list(cache._memory)[:3]}
+    cache._disk_store(entries)
+    assert cache._disk_rows == 5
+
+    reopened = CachedEmbeddings(
+        underlying, model_name="fake", path=path, max_disk_entries=5
+    )
+    assert reopened._disk_rows == 5
+    reopened._disk_store(entries)
+    assert reopened.stats.evictions == 0
+    (count,) = reopened._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+    assert count == 5
+
+
+def test_memory_tier_returns_copies(underlying: CountingEmbeddings) -> None:
+    cache = CachedEmbeddings(underlying, model_name="fake")
+    vector = cache.embed_query("q")
+    vector[0] = 42.0
+    assert cache.embed_query("q")[0] != 42.0
+    assert underlying.calls == ["q"]
+
+
+def test_disk_hits_defer_access_updates(
+    tmp_path: str, underlying: CountingEmbeddings
+) -> None:
+    path = os.path.join(tmp_path, "cache.sqlite")
+    CachedEmbeddings(underlying, model_name="fake", path=path).embed_query("q")
+
+    def last_access(cache: CachedEmbeddings) -> float:
+        (value,) = cache._db.execute("SELECT last_access FROM embeddings").fetchone()
+        return value
+
+    restarted = CachedEmbeddings(underlying, model_name="fake", path=path)
+    stored_at = last_access(restarted)
+    restarted.embed_query("q")
+    assert restarted.stats.disk_hits == 1
+    assert last_access(restarted) == stored_at
+    restarted.flush()
+    assert last_access(restarted) > stored_at
+
+
+@pytest.mark.asyncio
+async def test_async_disk_tier_runs_off_the_event_loop(
+    tmp_path: str, underlying: CountingEmbeddings
+) -> None:
+    path = os.path.join(tmp_path, "cache.sqlite")
+    cache = CachedEmbeddings(underlying, model_name="fake", path=path)
+    loop_thread = threading.get_ident()
+    threads: List[int] = []
+    execute = cache._disk_lookup
+
+    def disk_lookup(keys: List[str]) -> Dict[str, List[float]]:
+        threads.append(threading.get_ident())
+        return execute(keys)
+
+    with patch.object(cache, "_disk_lookup", disk_lookup):
+        vectors = await cache.aembed_documents(["a", "b"])
+        assert await cache.aembed_documents(["a", "b"]) == vectors
+
+    # Only the first call, with nothing in memory, went to the disk tier
+    assert len(threads) == 1 and threads[0] != loop_thread
+    assert underlying.calls == ["a", "b"]
+    assert cache.stats.memory_hits == 2
+    restarted = CachedEmbeddings(underlying, model_name="fake", path=path)
+    (vector,) = await restarted.aembed_documents(["b"])
+    assert vector == pytest.approx(vectors[1])
+    assert restarted.stats.disk_hits == 1
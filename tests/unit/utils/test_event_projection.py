@@ -0,0 +1,102 @@
+from typing import Any, AsyncGenerator, Dict, List
+
+from app.utils.decorators import custom_chain
+from app.utils.event_projection import (
+    SUPPORTED_RUN_TYPES,
+    matches_filters,
+    project_event,
+    run_type,
+)
+from app.utils.output_types import OnChatModelStreamEvent, OnToolEndEvent
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk, ToolMessage
+import pytest
+
+
+def test_run_type() -> None:
+    assert run_type("on_chat_model_stream") == "chat_model"
+    assert run_type("on_tool_end") == "tool"
+    assert run_type("on_retriever_start") == "retriever"
+    assert run_type("metadata") == "metadata"
+
+
+def test_matches_filters() -> None:
+    event = {"event": "on_chain_stream", "name": "RunnableSequence"}
+    assert matches_filters(event)
+    assert not matches_filters(event, include_types=SUPPORTED_RUN_TYPES)
+    assert matches_filters(event, include_names=["RunnableSequence"])
+    assert not matches_filters(
+        event, include_names=["RunnableSequence"], exclude_types=["chain"]
+    )
+
+
+def test_project_chat_model_stream() -> None:
+    chunk = AIMessageChunk(content="Hello", id="run-1", response_metadata={"a": 1})
+    event = {
+        "event": "on_chat_model_stream",
+        "name": "ChatVertexAI",
+        "run_id": "run-1",
+        "tags": ["seq:step:2"],
+        "metadata": {"ls_provider": "google_vertexai"},
+        "parent_ids": ["parent"],
+        "data": {"chunk": chunk},
+    }
+    assert project_event(event) == {
+        "event": "on_chat_model_stream",
+        "data": {"chunk": {"content": "Hello", "additional_kwargs": {}}},
+    }
+
+
+def test_project_tool_and_retriever_end() -> None:
+    message = ToolMessage(
+        content="docs", tool_call_id="call_1", name="retrieve_docs", id="msg_1"
+    )
+    projected = project_event(
+        {
+            "event": "on_tool_end",
+            "name": "retrieve_docs",
+            "run_id": "run-2",
+            "data": {"input": {"query": "q"}, "output": message},
+        }
+    )
+    assert projected["data"]["input"] == {"query": "q"}
+    output = projected["data"]["output"]
+    assert "id" not in output and "response_metadata" not in output
+    assert ToolMessage(**output).tool_call_id == "call_1"
+
+    documents = [Document(page_content="text", metadata={"source": "a.pdf"})]
+    projected = project_event(
+        {
+            "event": "on_retriever_end",
+            "name": "retriever",
+            "data": {"input": {"query": "q"}, "output": documents},
+        }
+    )
+    assert projected["data"]["output"][0]["page_content"] == "text"
+
+
+def test_project_passes_unknown_shapes_through() -> None:
+    event = {"event": "on_chat_model_stream", "data": {"content": "Hello"}}
+    assert project_event(event) is event
+    event = {"event": "metadata", "data": {"run_id": "run-1"}}
+    assert project_event(event) is event
+
+
+@pytest.mark.asyncio
+async def test_custom_chain_filters_events() -> None:
+    @custom_chain
+    async def chain(input: Dict[str, Any], **kwargs: Any) -> AsyncGenerator:
+        yield OnToolEndEvent(
+            data={
+                "input": {},
+                "output": ToolMessage(content="docs", tool_call_id="call_1"),
+            }
+        )
+        yield OnChatModelStreamEvent(data={"chunk": AIMessageChunk(content="Hi")})
+
+    async def events(**kwargs: Any) -> List[str]:
+        return [event["event"] async for event in chain.astream_events({}, **kwargs)]
+
+    assert await events() == ["on_tool_end", "on_chat_model_stream"]
+    assert await events(include_types=["chat_model"]) == ["on_chat_model_stream"]
+    assert await events(exclude_types=["chat_model"]) == ["on_tool_end"]
@@ -0,0 +1,39 @@
+from app.utils.metrics import MetricsRegistry
+import pytest
+
+
+def test_counter_gauge_and_histogram() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("decisions_total", "Decisions")
+    counter.inc(source="local")
+    counter.inc(2, source="llm")
+    assert registry.counter("decisions_total", "Decisions") is counter
+    assert counter.value(source="llm") == 2
+    assert counter.total() == 3
+
+    gauge = registry.gauge("in_flight", "In flight")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    assert gauge.value() == 1
+
+    histogram = registry.histogram("latency_seconds", "Latency", buckets=[0.1, 1.0])
+    for value in [0.05, 0.5, 0.7, 5.0]:
+        histogram.observe(value, stage="retrieval")
+    assert histogram.count(stage="retrieval") == 4
+    assert histogram.sum(stage="retrieval") == pytest.approx(6.25)
+    assert histogram.quantile(0.5, stage="retrieval") == 1.0
+
+    text = registry.render()
+    assert 'latency_seconds_bucket{stage="retrieval",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{stage="retrieval",le="+Inf"} 4' in text
+    assert "in_flight 1.0" in text
+
+    with pytest.raises(ValueError, match="already registered"):
+        registry.gauge("decisions_total", "Decisions")
+
+
+def test_label_values_are_escaped() -> None:
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors").inc(error='bad "path"\\x\nnext')
+    assert 'errors_total{error="bad \\"path\\"\\\\x\\nnext"} 1.0' in registry.render()
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import threading
+import time
+
+import httpx
+from app.utils.model_clients import ModelClients
+import ollama
+import pytest
+
+HOST = "http://ollama.test"
+
+
+def chat_handler(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    if request.url.path == "/api/embed":
+        return httpx.Response(
+            200, json={"model": body["model"], "embeddings": [[1.0, 0.0]]}
+        )
+    lines = [
+        {"model": body["model"], "message": {"role": "assistant", "content": word}}
+        for word in ("Hello", " there")
+    ]
+    lines.append(
+        {
+            "model": body["model"],
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+        }
+    )
+    content = "\n".join(json.dumps(line) for line in lines)
+    return httpx.Response(200, content=content.encode())
+
+
+class MockPools:
+    """Transport factory of ModelClients counting the pools it creates."""
+
+    def __init__(self, handler=chat_handler) -> None:
+        self.handler = handler
+        self.created = 0
+
+    def __call__(self) -> httpx.MockTransport:
+        self.created += 1
+        return httpx.MockTransport(self.handler)
+
+
+def mocked_clients(handler=chat_handler, **kwargs) -> ModelClients:
+    return ModelClients(transport_factory=MockPools(handler), **kwargs)
+
+
+def test_models_share_the_pool_of_their_host() -> None:
+    clients = mocked_clients()
+    llm = clients.chat_model("llm", base_url=HOST)
+    embeddings = clients.embedding_model("embedder", base_url=HOST)
+
+    assert llm.invoke("Hi").content == "Hello there"
+    assert embeddings.embed_query("Hi") == [1.0, 0.0]
+    stats = clients.stats()["models"]
+    assert stats["llm"]["requests"] == 1 and stats["llm"]["in_flight"] == 0
+    assert stats["embedder"]["requests"] == 1 and stats["embedder"]["errors"] == 0
+    assert clients.transport_factory.created == 1
+
+
+def test_in_flight_requests_are_limited_per_model() -> None:
+    running, peak, lock = 0, 0, threading.Lock()
+
+    def slow_handler(request: httpx.Request) -> httpx.Response:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return chat_handler(request)
+
+    clients = mocked_clients(slow_handler, max_in_flight_per_model=2)
+    embeddings = clients.embedding_model("embedder", base_url=HOST)
+    threads = [
+        threading.Thread(target=embeddings.embed_query, args=("Hi",))
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak == 2
+    assert clients.limiter("embedder").stats()["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_async_requests_use_a_pool_per_event_loop() -> None:
+    clients = mocked_clients(max_in_flight_per_model=1)
+    llm = clients.chat_model("async-llm", base_url=HOST)
+    chunks = [chunk.content async for chunk in llm.astream("Hi")]
+    assert "".join(chunks) == "Hello there"
+    results = await asyncio.gather(*(llm.ainvoke("Hi") for _ in range(3)))
+    assert [result.content for result in results] == ["Hello there"] * 3
+    assert clients.limiter("async-llm").stats()["requests"] == 4
+    assert clients.transport_factory.created == 1
+    assert llm.invoke("Hi").content == "Hello there"
+    assert clients.transport_factory.created == 2
+
+
+@pytest.mark.asyncio
+async def test_streams_hold_their_slot_until_closed() -> None:
+    clients = mocked_clients()
+    llm = clients.chat_model("streaming-llm", base_url=HOST)
+    stream = llm.astream("Hi")
+    assert (await stream.__anext__()).content == "Hello"
+    assert clients.limiter("streaming-llm").in_flight == 1
+    await stream.aclose()
+    stats = clients.limiter("streaming-llm").stats()
+    assert stats["in_flight"] == 0 and stats["errors"] == 0
+
+
+@pytest.mark.asyncio
+async def test_models_survive_closing_the_pools() -> None:
+    clients = mocked_clients()
+    llm = clients.chat_model("closed-llm", base_url=HOST)
+    assert llm.invoke("Hi").content == "Hello there"
+    assert (await llm.ainvoke("Hi")).content == "Hello there"
+    assert clients.transport_factory.created == 2
+
+    await clients.aclose()
+    # New pools of the host are created on the next requests
+    assert llm.invoke("Hi").content == "Hello there"
+    assert (await llm.ainvoke("Hi")).content == "Hello there"
+    assert clients.transport_factory.created == 4
+
+
+@pytest.mark.asyncio
+async def test_ollama_clients_use_the_pools_through_their_constructor() -> None:
+    clients = mocked_clients()
+    client = ollama.Client(HOST, **clients.client_kwargs(HOST))
+    async_client = ollama.AsyncClient(HOST, **clients.client_kwargs(HOST))
+    assert client.embed("embedder", "Hi")["embeddings"] == [[1.0, 0.0]]
+    assert (await async_client.embed("embedder", "Hi"))["embeddings"] == [[1.0, 0.0]]
+
+    # Closing a client leaves the shared pools open for the other clients
+    with httpx.Client(base_url=HOST, **clients.client_kwargs(HOST)) as http_client:
+        http_client.post("/api/embed", json={"model": "embedder", "input": "Hi"})
+    assert client.embed("embedder", "Hi")["embeddings"] == [[1.0, 0.0]]
+    assert clients.transport_factory.created == 2
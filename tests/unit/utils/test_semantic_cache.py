@@ -0,0 +1,83 @@
+import time
+from typing import Any, Dict, List
+
+from app.utils.semantic_cache import SemanticCache, SemanticCacheRunnable
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListChatModel
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+import pytest
+
+
+def messages(question: str) -> List[Dict[str, Any]]:
+    return [HumanMessage(question).model_dump()]
+
+
+@pytest.mark.asyncio
+async def test_lookup_threshold_and_doc_ids() -> None:
+    cache = SemanticCache(DeterministicFakeEmbedding(size=32))
+    vector = await cache.aembed(messages("What is MLOps?"))
+    cache.add(vector, ["MLOps ", "is..."], doc_ids=["a", "b"])
+
+    # Whitespace and case are normalized away
+    same = await cache.aembed(messages("  what is   MLOps? "))
+    assert cache.lookup(same).chunks == ["MLOps ", "is..."]
+    assert cache.lookup(same, doc_ids=["a", "b"]) is not None
+    assert cache.lookup(same, doc_ids=["a", "c"]) is None
+    assert cache.lookup(await cache.aembed(messages("What is CI/CD?"))) is None
+    assert (cache.stats.hits, cache.stats.misses) == (2, 2)
+
+    # Lookups validated by the caller are only counted once recorded
+    assert cache.lookup(same, record=False) is not None
+    assert (cache.stats.hits, cache.stats.misses) == (2, 2)
+    cache.record(hit=False)
+    assert (cache.stats.hits, cache.stats.misses) == (2, 3)
+
+
+@pytest.mark.asyncio
+async def test_ttl_and_lru_eviction() -> None:
+    cache = SemanticCache(DeterministicFakeEmbedding(size=32), max_entries=2, ttl=0.2)
+    vectors = [await cache.aembed(messages(f"question {i}")) for i in range(3)]
+    cache.add(vectors[0], ["0"])
+    cache.add(vectors[1], ["1"])
+    # Touch entry 0 so that entry 1 is the least recently used
+    assert cache.lookup(vectors[0]) is not None
+    cache.add(vectors[2], ["2"])
+
+    assert cache.lookup(vectors[1]) is None
+    assert cache.lookup(vectors[0]) is not None
+    assert cache.stats.evictions == 1
+
+    time.sleep(0.25)
+    assert cache.lookup(vectors[2]) is None
+    assert len(cache) == 0
+    assert cache.stats.expirations == 2
+
+
+@pytest.mark.asyncio
+async def test_runnable_replays_stream_events() -> None:
+    model = FakeListChatModel(responses=["Boil the pasta.", "Something else."])
+    prompt = ChatPromptTemplate.from_messages([MessagesPlaceholder("messages")])
+    chain = SemanticCacheRunnable(
+        prompt | model, SemanticCache(DeterministicFakeEmbedding(size=32))
+    )
+    input_dict = {"messages": messages("How do I cook pasta?")}
+
+    def answer(events: List[Dict[str, Any]]) -> str:
+        return "".join(
+            event["data"]["chunk"].content
+            if hasattr(event["data"]["chunk"], "content")
+            else event["data"]["chunk"]["content"]
+            for event in events
+            if event["event"] == "on_chat_model_stream"
+        )
+
+    first = [e async for e in chain.astream_events(input_dict, version="v2")]
+    second = [e async for e in chain.astream_events(input_dict, version="v2")]
+
+    assert answer(first) == answer(second) == "Boil the pasta."
+    streamed = [e for e in second if e["event"] == "on_chat_model_stream"]
+    assert len(streamed) == len(
+        [e for e in first if e["event"] == "on_chat_model_stream"]
+    )
+    assert chain.cache.stats.hits == 1
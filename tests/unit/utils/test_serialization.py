@@ -0,0 +1,40 @@
+import json
+from typing import Any
+
+from app.utils.event_projection import project_event
+from app.utils.output_types import EndEvent, Event, OnToolEndEvent
+from app.utils.serialization import SERIALIZERS, get_serializer
+from langchain_core.messages import AIMessageChunk, ToolMessage
+import pytest
+
+AVAILABLE = [name for name, serializer in SERIALIZERS.items() if serializer]
+
+EVENTS: Any = [
+    Event(event="metadata", data={"run_id": "run-1"}),
+    EndEvent(),
+    OnToolEndEvent(
+        data={"input": {}, "output": ToolMessage(content="é", tool_call_id="call_1")}
+    ),
+    {"event": "on_chat_model_stream", "data": {"chunk": AIMessageChunk(content="Hi")}},
+    project_event(
+        {
+            "event": "on_chat_model_stream",
+            "data": {"chunk": AIMessageChunk(content="Hi")},
+        }
+    ),
+]
+
+
+@pytest.mark.parametrize("name", AVAILABLE)
+def test_serializers_match_the_reference(name: str) -> None:
+    serialize = get_serializer(name)
+    for event in EVENTS:
+        line = serialize(event)
+        assert isinstance(line, bytes) and line.endswith(b"\n")
+        assert json.loads(line) == json.loads(get_serializer("json")(event))
+
+
+def test_get_serializer() -> None:
+    assert get_serializer("auto") is SERIALIZERS[AVAILABLE[0]]
+    with pytest.raises(ValueError):
+        get_serializer("pickle")